@@ -0,0 +1,27 @@
+""" Бенчмарки горячих путей сервиса, запускаются из корня проекта: python -m benchmarks.<имя_модуля> """
+import os
+import sys
+import tempfile
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def prepare_workdir(pg_database: str | None = None) -> str:
+    """ Создаёт временную рабочую директорию и переходит в неё до импорта config,
+    чтобы БД, логи и working_files бенчмарка не пересекались с рабочими.
+    По умолчанию используется SQLite, для Postgres передаётся строка конфигурации как в PG_DATABASE """
+    workdir = tempfile.mkdtemp(prefix='tcs_bench_')
+    for sub_dir in ('database', 'logs', 'working_files/work_sessions', 'working_files/input_files',
+                    'working_files/bad_sessions', 'working_files/good_sessions_after_checker'):
+        os.makedirs(os.path.join(workdir, sub_dir), exist_ok=True)
+    os.chdir(workdir)
+    os.environ['PG_DATABASE'] = pg_database or ''
+    if ROOT_DIR not in sys.path:
+        sys.path.insert(0, ROOT_DIR)
+    return workdir
+
+
+def silence_logger() -> None:
+    """ Отключает вывод логов приложения, чтобы логирование не искажало замеры """
+    from config import logger
+    logger.remove()
@@ -0,0 +1,99 @@
+""" Бенчмарк памяти контактов в очереди воркеров
+
+Чекер: прежний словарь из CSVManager, дополненный результатом проверки через update, против ContactRecord
+с тем же набором значений. Рассыльщик: страница контактов в виде моделей peewee, как их возвращал прежний
+get_campaign_page, против страницы ContactRecord из DBManager.get_campaign_page. Память считается через
+tracemalloc по объектам, которые остаются в памяти, пока контакты находятся в очереди.
+
+Запуск: python -m benchmarks.bench_contact_memory --size 100000
+"""
+import argparse
+import asyncio
+import tracemalloc
+from datetime import datetime
+
+from benchmarks import prepare_workdir, silence_logger
+
+PROMO_ID = 'bench_promo'
+
+
+def measure(name: str, size: int, build) -> None:
+    """ Выводит память занятую результатом build() в расчёте на контакт """
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    result = build()
+    used = tracemalloc.get_traced_memory()[0] - before
+    tracemalloc.stop()
+    assert len(result) == size
+    print(f'{name:<42} | {used / 2 ** 20:>9.1f} | {used / size:>9.0f}')
+
+
+def checker_rows(size: int) -> list[tuple]:
+    """ Строки входного файла и результаты проверки, значения одинаковые для обоих представлений """
+    return [(str(79_000_000_000 + num), f'Имя {num}', f'{num % 100}', 'город', 'Ok', 10 ** 9 + num,
+             f'user_{num}', 'First', 'Last') for num in range(size)]
+
+
+def legacy_checker_contacts(rows: list[tuple]) -> list[dict]:
+    contacts = []
+    for phone, var_1, var_2, var_3, check_result, user_id, username, first_name, last_name in rows:
+        contact = {'promo_id': PROMO_ID, 'phone': phone, 'var_1': var_1, 'var_2': var_2, 'var_3': var_3}
+        contact.update({'check_result': check_result, 'user_id': user_id, 'username': username,
+                        'first_name': first_name, 'last_name': last_name})
+        contact.update({'session_name': 'session'})
+        contacts.append(contact)
+    return contacts
+
+
+def record_checker_contacts(rows: list[tuple]) -> list:
+    from managers.contact_record import ContactRecord
+
+    contacts = []
+    for phone, var_1, var_2, var_3, check_result, user_id, username, first_name, last_name in rows:
+        contact = ContactRecord(phone=int(phone), promo_id=PROMO_ID, var_1=var_1, var_2=var_2, var_3=var_3)
+        contact.update(check_result=check_result, user_id=user_id, username=username, first_name=first_name,
+                       last_name=last_name, session_check='session')
+        contacts.append(contact)
+    return contacts
+
+
+def seed_campaign(dbm, rows: list[tuple]) -> None:
+    """ Записывает контакты кампании для чтения страниц рассыльщика """
+    contacts = [{'phone': int(phone), 'promo_id': PROMO_ID, 'var_1': var_1, 'var_2': var_2, 'var_3': var_3,
+                 'date_check': datetime.now(), 'session_check': 'session', 'user_id': user_id,
+                 'username': username if int(phone) % 2 else None, 'first_name': first_name, 'last_name': last_name}
+                for phone, var_1, var_2, var_3, _, user_id, username, first_name, last_name in rows]
+    asyncio.run(dbm.save_results_many(contacts=contacts, bad_contacts=[], sent_contacts=[]))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--size', type=int, default=100000)
+    parser.add_argument('--pg', default=None, help='конфигурация Postgres в формате PG_DATABASE (по умолчанию SQLite)')
+    args = parser.parse_args()
+
+    prepare_workdir(pg_database=args.pg)
+    silence_logger()
+    from database.migrations import migrate
+    from managers.async_db_manager import DBManager
+
+    migrate()
+    dbm = DBManager()
+    rows = checker_rows(args.size)
+    seed_campaign(dbm, rows)
+    table = dbm.tables.contacts
+
+    def legacy_campaign_page() -> list:
+        with dbm.point_db_connection:
+            return list(dbm._campaign_query(PROMO_ID).where(table.phone > 0).order_by(table.phone).limit(args.size))
+
+    print(f'{"contacts: " + str(args.size):<42} | {"total, Mb":>9} | {"bytes/contact":>9}')
+    measure('checker: dict + update (прежний)', args.size, lambda: legacy_checker_contacts(rows))
+    measure('checker: ContactRecord', args.size, lambda: record_checker_contacts(rows))
+    measure('mailer: модели peewee (прежний)', args.size, legacy_campaign_page)
+    measure('mailer: ContactRecord', args.size, lambda: asyncio.run(
+        dbm.get_campaign_page(promo_id=PROMO_ID, after_phone=0, limit=args.size)))
+
+
+if __name__ == '__main__':
+    main()
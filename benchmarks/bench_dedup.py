@@ -0,0 +1,90 @@
+""" Бенчмарк дедупликации контактов DBManager.check_contacts_in_all_tables
+
+Для каждого размера входного списка в БД заранее записывается половина номеров (поровну в contacts и
+bad_contacts), после чего сравнивается пакетная проверка с прежней построчной проверкой через get_or_none.
+Построчная проверка выполняется только до --legacy-max номеров, дальше она занимает десятки минут.
+
+Запуск: python -m benchmarks.bench_dedup --sizes 10000,100000,1000000,10000000
+"""
+import argparse
+import asyncio
+import random
+import time
+
+from benchmarks import prepare_workdir, silence_logger
+
+
+def make_contacts(size: int) -> list:
+    """ Генерирует входной список контактов в формате CSVManager """
+    from managers.contact_record import ContactRecord
+
+    phones = random.sample(range(79_000_000_000, 79_999_999_999), size)
+    return [ContactRecord(phone=phone, promo_id='bench', var_1='a', var_2='b', var_3='c') for phone in phones]
+
+
+def fill_tables(tables, contacts: list) -> None:
+    """ Записывает каждый второй номер в БД, чередуя таблицы contacts и bad_contacts """
+    from peewee import chunked
+
+    known = [contact.phone for contact in contacts[::2]]
+    for table, phones in ((tables.contacts, known[::2]), (tables.bad_contacts, known[1::2])):
+        with table._meta.database.atomic():
+            for batch in chunked(phones, 450):
+                table.insert_many([{'phone': phone} for phone in batch]).on_conflict_ignore().execute()
+
+
+def clear_tables(tables) -> None:
+    """ Очищает таблицы перед следующим прогоном """
+    for table in tables.all_tables():
+        table.delete().execute()
+
+
+def legacy_check(tables, contacts: list) -> list:
+    """ Прежняя построчная проверка: по два запроса get_or_none на каждый номер """
+    return [contact for contact in contacts
+            if not tables.contacts.get_or_none(phone=contact.phone)
+            and not tables.bad_contacts.get_or_none(phone=contact.phone)]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sizes', default='10000,100000,1000000,10000000')
+    parser.add_argument('--legacy-max', type=int, default=100000)
+    parser.add_argument('--pg', default=None, help='конфигурация Postgres в формате PG_DATABASE (по умолчанию SQLite)')
+    args = parser.parse_args()
+
+    prepare_workdir(pg_database=args.pg)
+    silence_logger()
+    from database.migrations import migrate
+    from managers.async_db_manager import DBManager
+
+    migrate()
+
+    dbm = DBManager()
+    print(f'{"rows":>10} | {"bulk, sec":>10} | {"rows/sec":>12} | {"legacy, sec":>11} | to check')
+    for size in map(int, args.sizes.split(',')):
+        contacts = make_contacts(size)
+        with dbm.point_db_connection:
+            clear_tables(dbm.tables)
+            fill_tables(dbm.tables, contacts)
+
+        started = time.perf_counter()
+        result = asyncio.run(dbm.check_contacts_in_all_tables(contacts))
+        bulk_time = time.perf_counter() - started
+
+        legacy_time = '-'
+        if size <= args.legacy_max:
+            started = time.perf_counter()
+            with dbm.point_db_connection:
+                legacy_result = legacy_check(dbm.tables, contacts)
+            legacy_time = f'{time.perf_counter() - started:.2f}'
+            assert len(legacy_result) == len(result)
+
+        print(f'{size:>10} | {bulk_time:>10.2f} | {size / bulk_time:>12.0f} | {legacy_time:>11} | {len(result)}')
+
+    with dbm.point_db_connection:
+        clear_tables(dbm.tables)
+
+
+if __name__ == '__main__':
+    main()
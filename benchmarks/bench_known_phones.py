@@ -0,0 +1,115 @@
+""" Бенчмарк индекса известных номеров KnownPhonesManager
+
+Для каждого размера записывается файл снимка с заданным количеством номеров (половина в contacts, половина
+в bad_contacts) без заполнения БД, после чего замеряется открытие снимка, скорость поиска номеров (половина
+запросов - известные номера) и память процесса. Память снимка (8 байт на номер) отображается из файла и
+учитывается в RSS только в прочитанных страницах, поэтому RSS выводится после поиска по всему диапазону.
+Параметр --db-rows дополнительно замеряет создание снимка из БД и сравнивает отсев пачки контактов по индексу
+с запросами к БД DBManager.check_contacts_in_all_tables.
+
+Запуск: python -m benchmarks.bench_known_phones --sizes 1000000,10000000,50000000 --db-rows 1000000
+"""
+import argparse
+import asyncio
+import os
+import random
+import resource
+import time
+from array import array
+
+from benchmarks import prepare_workdir, silence_logger
+
+FIRST_PHONE = 79_000_000_000
+
+
+def rss_mb() -> float:
+    """ Текущий RSS процесса, Mb """
+    with open('/proc/self/statm') as file:
+        return int(file.read().split()[1]) * resource.getpagesize() / 2 ** 20
+
+
+def write_snapshot(manager, size: int) -> None:
+    """ Записывает снимок из size чётных номеров начиная с FIRST_PHONE без обращения к БД """
+    from config import KNOWN_PHONES_SNAPSHOT_PATH
+
+    counts = (size // 2, size - size // 2)
+    with open(KNOWN_PHONES_SNAPSHOT_PATH, 'wb') as file:
+        file.write(manager.header.pack(manager.magic, *counts, time.time()))
+        for start in range(0, size, 10 ** 6):
+            array('q', range(FIRST_PHONE + start * 2, FIRST_PHONE + min(size, start + 10 ** 6) * 2, 2)).tofile(file)
+
+
+def bench_lookups(manager, size: int, lookups: int) -> None:
+    phones = [FIRST_PHONE + random.randrange(size * 2) for _ in range(lookups)]
+    started = time.perf_counter()
+    found = sum(phone in manager for phone in phones)
+    elapsed = time.perf_counter() - started
+    assert found == sum(1 for phone in phones if phone % 2 == 0)
+    print(f'{size:>10} | {lookups / elapsed:>12.0f} | {rss_mb():>8.1f} | '
+          f'{os.path.getsize(manager.file.name) / 2 ** 20:>9.1f} | {found}')
+
+
+def bench_db(manager, dbm, rows: int) -> None:
+    """ Создание снимка из БД и отсев пачки контактов по индексу и запросами к БД """
+    from benchmarks.bench_dedup import make_contacts, fill_tables, clear_tables
+    from config import DEDUP_CHUNK_SIZE
+
+    contacts = make_contacts(rows)
+    with dbm.point_db_connection:
+        clear_tables(dbm.tables)
+        fill_tables(dbm.tables, contacts)
+
+    async def run() -> None:
+        started = time.perf_counter()
+        await manager.build_snapshot()
+        print(f'создание снимка из БД, {rows // 2} номеров: {time.perf_counter() - started:.2f} сек.')
+        manager.loaded = True
+
+        chunk = contacts[:DEDUP_CHUNK_SIZE * 10]
+        started = time.perf_counter()
+        by_index = manager.filter_new(chunk)
+        index_time = time.perf_counter() - started
+        started = time.perf_counter()
+        by_db = await dbm.check_contacts_in_all_tables(chunk)
+        db_time = time.perf_counter() - started
+        assert len(by_index) == len(by_db)
+        print(f'отсев {len(chunk)} контактов: по индексу {index_time * 1000:.1f} мс, '
+              f'запросами к БД {db_time * 1000:.1f} мс')
+
+    asyncio.run(run())
+    with dbm.point_db_connection:
+        clear_tables(dbm.tables)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sizes', default='1000000,10000000,50000000')
+    parser.add_argument('--lookups', type=int, default=200000)
+    parser.add_argument('--db-rows', type=int, default=0, help='номеров для замера создания снимка из БД')
+    parser.add_argument('--pg', default=None, help='конфигурация Postgres в формате PG_DATABASE (по умолчанию SQLite)')
+    args = parser.parse_args()
+
+    prepare_workdir(pg_database=args.pg)
+    silence_logger()
+    from database.migrations import migrate
+    from managers.async_db_manager import DBManager
+    from managers.known_phones_manager import KnownPhonesManager
+
+    migrate()
+    dbm = DBManager()
+    manager = KnownPhonesManager(db_manager=dbm)
+    print(f'RSS до загрузки снимка: {rss_mb():.1f} Mb')
+    print(f'{"phones":>10} | {"lookups/s":>12} | {"RSS, Mb":>8} | {"file, Mb":>9} | found')
+    for size in map(int, args.sizes.split(',')):
+        write_snapshot(manager, size)
+        assert manager.open_snapshot()
+        bench_lookups(manager, size, args.lookups)
+        manager.close()
+
+    if args.db_rows:
+        bench_db(manager, dbm, args.db_rows)
+        manager.close()
+
+
+if __name__ == '__main__':
+    main()
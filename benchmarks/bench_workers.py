@@ -0,0 +1,215 @@
+""" Бенчмарк пропускной способности Checker и Mailer на поддельном Telegram
+
+Настоящие Checker и Mailer из loader работают с временной БД и сессиями, вместо TelegramClient подставляется
+FakeTelegramClient с настраиваемыми задержками, долей зарегистрированных номеров, FloodWait и разрывами.
+Чекер проверяет --contacts номеров из сгенерированного phones.csv, рассыльщик отправляет сообщения найденным
+контактам (в режиме mailer контакты записываются в БД заранее). Выводятся контакты/сообщения в секунду,
+перцентили времени этапов и пиковая память процесса.
+
+Запуск: python -m benchmarks.bench_workers --mode all --contacts 2000 --sessions 20 --concurrency 8
+"""
+import argparse
+import asyncio
+import csv
+import functools
+import json
+import os
+import random
+import resource
+import time
+import tracemalloc
+from collections import defaultdict
+from typing import Callable
+
+from benchmarks import prepare_workdir, silence_logger
+from benchmarks.fake_telegram import FakeTelegramBackend, FakeTelegramClient
+
+PROMO_ID = 'bench'
+
+
+class StageTimer:
+    """ Замеряет время вызовов асинхронных методов по этапам """
+
+    def __init__(self):
+        self.durations = defaultdict(list)
+
+    def wrap(self, obj, attr: str, stage: str) -> None:
+        """ Подменяет метод obj.attr на обёртку замеряющую время вызова """
+        method = getattr(obj, attr)
+
+        @functools.wraps(method)
+        async def timed(*args, **kwargs):
+            started = time.perf_counter()
+            try:
+                return await method(*args, **kwargs)
+            finally:
+                self.durations[stage].append(time.perf_counter() - started)
+
+        setattr(obj, attr, timed)
+
+    def report(self) -> list[str]:
+        """ Таблица перцентилей времени этапов в миллисекундах """
+        lines = [f'{"stage":<16} | {"calls":>7} | {"p50, ms":>9} | {"p95, ms":>9} | {"p99, ms":>9} | {"max, ms":>9}']
+        for stage, values in self.durations.items():
+            values = sorted(values)
+            row = [values[min(len(values) - 1, int(len(values) * q))] * 1000 for q in (0.5, 0.95, 0.99)]
+            lines.append(f'{stage:<16} | {len(values):>7} | ' + ' | '.join(f'{value:>9.2f}' for value in row)
+                         + f' | {values[-1] * 1000:>9.2f}')
+        return lines
+
+
+def make_sessions(work_sessions_dir: str, count: int) -> None:
+    """ Создаёт json файлы сессий, файлы .session не нужны: клиент подменяется """
+    for num in range(count):
+        data = {'app_id': 0, 'app_hash': 'bench', 'first_name': 'bench', 'last_name': str(num), 'phone_book': []}
+        with open(os.path.join(work_sessions_dir, f'bench_{num}.json'), 'w', encoding='utf-8') as file:
+            json.dump(data, file)
+
+
+def make_phones(size: int) -> list[int]:
+    """ Случайные уникальные номера телефонов """
+    return random.sample(range(79_000_000_000, 79_999_999_999), size)
+
+
+def write_phones_csv(path: str, phones: list[int]) -> None:
+    """ Записывает входной файл чекера """
+    with open(path, 'w', newline='', encoding='utf-8') as file:
+        csv.writer(file).writerows([PROMO_ID, phone, 'a', 'b', 'c'] for phone in phones)
+
+
+def patch_limits(args: argparse.Namespace) -> None:
+    """ Подменяет лимиты и задержки сервиса, импортированные модулями по имени """
+    import managers.base
+    import managers.checker_manager
+    import managers.mailer_manager
+    import managers.pacing_manager
+    import managers.session_files_manager
+
+    for module in (managers.base, managers.checker_manager, managers.mailer_manager, managers.pacing_manager,
+                   managers.session_files_manager):
+        for name, value in (('MAX_CONTACTS', args.max_contacts), ('DEFAULT_QUARANTINE_TIME', args.quarantine),
+                            ('WORKERS_CONCURRENCY', args.concurrency), ('CHECK_BATCH_SIZE', args.batch_size),
+                            ('FROM', 0), ('PACING_INITIAL_DELAY', 0), ('PACING_ERROR_QUARANTINE', args.quarantine)):
+            if hasattr(module, name):
+                setattr(module, name, value)
+    managers.mailer_manager.Mailer.stop_sending_time = 0
+
+
+def instrument(timer: StageTimer, backend: FakeTelegramBackend) -> None:
+    """ Подменяет клиента Telegram на поддельный и расставляет замеры этапов """
+    from loader import checker, mailer, sfm, dbm, wbm, mm, kpm
+
+    async def get_tg_client(session_name: str, session_data: dict) -> FakeTelegramClient:
+        return FakeTelegramClient(backend=backend, session_name=session_name)
+
+    for worker in (checker, mailer):
+        worker.get_tg_client = get_tg_client
+        timer.wrap(worker, 'connect_tg_client', 'connect')
+    timer.wrap(sfm, 'get_session_name', 'session_pick')
+    timer.wrap(checker, 'get_tg_contacts', 'check_batch')
+    timer.wrap(mailer, 'get_access_hash', 'access_hash')
+    timer.wrap(mailer, 'sender_from_user_id', 'send_user_id')
+    timer.wrap(mailer, 'sender_from_username', 'send_username')
+    timer.wrap(mm, 'get_message_text', 'render_message')
+    timer.wrap(dbm, 'check_contacts_in_all_tables', 'db_dedup')
+    timer.wrap(kpm, 'load', 'index_load')
+    timer.wrap(dbm, 'get_campaign_page', 'db_campaign_page')
+    timer.wrap(wbm, 'flush', 'db_flush')
+
+
+async def seed_campaign(phones: list[int]) -> None:
+    """ Записывает контакты кампании в БД для режима mailer """
+    from datetime import datetime
+    from loader import dbm
+
+    rows = [{'phone': phone, 'promo_id': PROMO_ID, 'date_check': datetime.now(), 'session_check': 'bench_seed',
+             'user_id': phone, 'username': f'user_{phone}' if phone % 2 else None} for phone in phones]
+    await dbm.save_results_many(contacts=rows, bad_contacts=[], sent_contacts=[])
+
+
+def checked_phones() -> int:
+    """ Количество номеров с записанным в БД результатом проверки """
+    from loader import dbm
+
+    with dbm.point_db_connection:
+        return dbm.tables.contacts.select().count() + dbm.tables.bad_contacts.select().count()
+
+
+def run_stage(name: str, worker, count: Callable[[], int]) -> tuple[float, int]:
+    """ Запускает воркер в новом цикле событий и возвращает время работы и количество результатов count() """
+    from managers.session_files_manager import SessionFilesManager
+
+    # сервис рассчитан на один цикл событий на процесс, событие очередей сессий привязывается к циклу
+    SessionFilesManager.schedule_changed = asyncio.Event()
+    started = time.perf_counter()
+    asyncio.run(worker())
+    elapsed = time.perf_counter() - started
+    value = count()
+    print(f'{name}: {value} за {elapsed:.2f} сек. -> {value / elapsed:.1f}/сек. | '
+          f'загружено в очередь: {worker.total_contacts} | упало сессий: {worker.fallen_sessions}')
+    return elapsed, value
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Бенчмарк Checker и Mailer на поддельном Telegram')
+    parser.add_argument('--mode', choices=['checker', 'mailer', 'all'], default='all')
+    parser.add_argument('--contacts', type=int, default=2000)
+    parser.add_argument('--sessions', type=int, default=20)
+    parser.add_argument('--concurrency', type=int, default=8)
+    parser.add_argument('--batch-size', type=int, default=1)
+    parser.add_argument('--max-contacts', type=int, default=10 ** 6, help='лимит телефонной книги сессии')
+    parser.add_argument('--quarantine', type=int, default=1, help='карантин сессии после ошибки, сек.')
+    parser.add_argument('--latency', type=float, default=0.02, help='средняя задержка запроса, сек.')
+    parser.add_argument('--jitter', type=float, default=0.5)
+    parser.add_argument('--hit-rate', type=float, default=0.5)
+    parser.add_argument('--flood-rate', type=float, default=0.0)
+    parser.add_argument('--flood-seconds', type=int, default=1)
+    parser.add_argument('--disconnect-rate', type=float, default=0.0)
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--tracemalloc', action='store_true', help='пик памяти Python объектов (замедляет работу)')
+    parser.add_argument('--pg', default=None, help='конфигурация Postgres в формате PG_DATABASE (по умолчанию SQLite)')
+    parser.add_argument('--verbose', action='store_true', help='не отключать логи приложения')
+    args = parser.parse_args()
+
+    prepare_workdir(pg_database=args.pg)
+    if not args.verbose:
+        silence_logger()
+    random.seed(args.seed)
+
+    from config import WORK_SESSIONS_DIR, INPUT_CSV_FILE_PATH, INPUT_FILES_DIR
+    from loader import checker, mailer
+
+    make_sessions(WORK_SESSIONS_DIR, args.sessions)
+    with open(os.path.join(INPUT_FILES_DIR, f'{PROMO_ID}.txt'), 'w', encoding='utf-8') as file:
+        file.write('Здравствуйте, {var_1}! Проверка {var_4}')
+    phones = make_phones(args.contacts)
+
+    backend = FakeTelegramBackend(latency=args.latency, jitter=args.jitter, hit_rate=args.hit_rate,
+                                  flood_rate=args.flood_rate, flood_seconds=args.flood_seconds,
+                                  disconnect_rate=args.disconnect_rate, seed=args.seed)
+    timer = StageTimer()
+    patch_limits(args)
+    instrument(timer, backend)
+    if args.tracemalloc:
+        tracemalloc.start()
+
+    if args.mode in ('checker', 'all'):
+        write_phones_csv(INPUT_CSV_FILE_PATH, phones)
+        run_stage('checker, номеров проверено', checker, checked_phones)
+    if args.mode == 'mailer':
+        asyncio.run(seed_campaign(phones))
+    if args.mode in ('mailer', 'all'):
+        mailer.promo_id, mailer.send_interval_hours = PROMO_ID, 1
+        run_stage('mailer, сообщений отправлено', mailer, lambda: mailer.sent_messages)
+
+    print('\n'.join(timer.report()))
+    print('запросы к поддельному Telegram: '
+          + ' | '.join(f'{key}: {value}' for key, value in backend.counters.items()))
+    peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    peak_python = f' | пик памяти Python объектов: {tracemalloc.get_traced_memory()[1] / 2 ** 20:.1f} Mb' \
+        if args.tracemalloc else ''
+    print(f'пик памяти процесса (RSS): {peak_rss:.1f} Mb{peak_python}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,118 @@
+""" Локальная замена TelegramClient для бенчмарков и проверки воркеров без реальных сессий и сети
+
+FakeTelegramBackend хранит настройки задержек и ошибок и общие счётчики запросов, FakeTelegramClient реализует
+используемую сервисом часть TelegramClient: connect, disconnect, is_connected, get_me, send_message и вызов
+запросов ImportContactsRequest и DeleteContactsRequest. Зарегистрирован ли номер в Telegram определяется по
+хэшу номера, поэтому результат проверки одного номера одинаков во всех прогонах.
+"""
+import asyncio
+import random
+import zlib
+from collections import Counter
+
+from telethon import functions
+from telethon.errors import FloodWaitError
+from telethon.tl.types import User, ImportedContact
+from telethon.tl.types.contacts import ImportedContacts
+
+
+class FakeTelegramBackend:
+    """ Настройки и счётчики поддельного Telegram общие для всех клиентов:
+        latency - средняя задержка(сек.) запроса, jitter - разброс задержки в долях от latency,
+        hit_rate - доля номеров зарегистрированных в Telegram, flood_rate и disconnect_rate - вероятность
+        FloodWaitError на flood_seconds сек. и разрыва соединения на один запрос. Как и TelegramClient,
+        FloodWait не дольше flood_sleep_threshold сек. клиент пережидает сам, более долгий - выбрасывает,
+        по умолчанию 0 как у клиентов сервиса """
+
+    def __init__(self, latency: float = 0.05, jitter: float = 0.5, hit_rate: float = 0.5, flood_rate: float = 0.0,
+                 flood_seconds: int = 5, disconnect_rate: float = 0.0, flood_sleep_threshold: int = 0,
+                 seed: int | None = None):
+        self.latency = latency
+        self.jitter = jitter
+        self.hit_rate = hit_rate
+        self.flood_rate = flood_rate
+        self.flood_seconds = flood_seconds
+        self.disconnect_rate = disconnect_rate
+        self.flood_sleep_threshold = flood_sleep_threshold
+        self.random = random.Random(seed)
+        self.counters = Counter()
+
+    def is_registered(self, phone: str) -> bool:
+        """ Зарегистрирован ли номер в Telegram """
+        return zlib.crc32(str(phone).encode()) % 10000 < self.hit_rate * 10000
+
+    @staticmethod
+    def make_user(phone: str) -> User:
+        """ Пользователь Telegram номера, у части пользователей нет username """
+        user_id = int(str(phone).lstrip('+'))
+        return User(id=user_id, access_hash=user_id * 31 % 2 ** 63, phone=str(phone), first_name=f'first_{phone}',
+                    last_name=f'last_{phone}', username=f'user_{phone}' if user_id % 2 else None)
+
+    async def delay(self) -> None:
+        """ Задержка одного запроса """
+        if self.latency:
+            await asyncio.sleep(self.latency * (1 + self.random.uniform(-self.jitter, self.jitter)))
+
+
+class FakeTelegramClient:
+    """ Поддельный клиент сессии session_name работающий с FakeTelegramBackend """
+
+    def __init__(self, backend: FakeTelegramBackend, session_name: str):
+        self.backend = backend
+        self.session_name = session_name
+        self.connected = False
+
+    def is_connected(self) -> bool:
+        return self.connected
+
+    async def connect(self) -> None:
+        self.backend.counters['connect'] += 1
+        await self.backend.delay()
+        self.connected = True
+
+    async def disconnect(self) -> None:
+        self.connected = False
+
+    async def get_me(self) -> User:
+        await self.rpc('get_me')
+        return User(id=zlib.crc32(self.session_name.encode()), phone=self.session_name,
+                    first_name='bench', last_name=self.session_name)
+
+    async def send_message(self, entity, message: str, **kwargs) -> None:
+        await self.rpc('send_message')
+
+    async def __call__(self, request):
+        if isinstance(request, functions.contacts.ImportContactsRequest):
+            await self.rpc('import_contacts')
+            hits = [contact for contact in request.contacts if self.backend.is_registered(contact.phone)]
+            self.backend.counters['imported'] += len(hits)
+            return ImportedContacts(
+                imported=[ImportedContact(user_id=int(contact.phone.lstrip('+')), client_id=contact.client_id)
+                          for contact in hits],
+                popular_invites=[], retry_contacts=[],
+                users=[self.backend.make_user(contact.phone) for contact in hits])
+
+        if isinstance(request, functions.contacts.DeleteContactsRequest):
+            await self.rpc('delete_contacts')
+            return None
+
+        raise NotImplementedError(f'FakeTelegramClient: запрос {type(request).__name__} не поддерживается')
+
+    async def rpc(self, name: str) -> None:
+        """ Один запрос: задержка, учёт в счётчиках и случайные FloodWait и разрыв соединения """
+        if not self.connected:
+            raise ConnectionError('FakeTelegramClient: клиент не подключен')
+        self.backend.counters[name] += 1
+        await self.backend.delay()
+
+        roll = self.backend.random.random()
+        if roll < self.backend.disconnect_rate:
+            self.backend.counters['disconnects'] += 1
+            self.connected = False
+            raise ConnectionError('FakeTelegramClient: соединение разорвано')
+        if roll < self.backend.disconnect_rate + self.backend.flood_rate:
+            self.backend.counters['flood_waits'] += 1
+            if self.backend.flood_seconds <= self.backend.flood_sleep_threshold:
+                await asyncio.sleep(self.backend.flood_seconds)
+            else:
+                raise FloodWaitError(request=None, capture=self.backend.flood_seconds)
@@ -14,6 +14,36 @@ if not os.getenv('PG_DATABASE'):
 else:
     DATABASE_CONFIG = ('postgres', ast.literal_eval(os.getenv('PG_DATABASE')))
 
+""" Миграции схемы БД применяются при запуске, процессы запущенные через start_workers.py получают
+SKIP_MIGRATIONS=1: миграции один раз применяет родительский процесс до их запуска """
+AUTO_MIGRATE = not os.getenv('SKIP_MIGRATIONS')
+
+""" Количество потоков выполнения запросов к БД, у каждого потока своё постоянное соединение,
+для SQLite один поток: запись в файл БД всё равно выполняется по одной транзакции """
+DB_EXECUTOR_WORKERS = 1 if DATABASE_CONFIG[0] == 'sqlite' else int(os.getenv('DB_EXECUTOR_WORKERS', 4))
+
+""" Максимальное количество параметров в одном запросе, для SQLite ограничено лимитом переменных
+в запросе (999 в старых версиях) """
+DB_QUERY_MAX_PARAMS = 900 if DATABASE_CONFIG[0] == 'sqlite' else 30000
+
+""" Размер пачки номеров для одного запроса IN (...) при проверке контактов на наличие в БД """
+DEDUP_CHUNK_SIZE = min(DB_QUERY_MAX_PARAMS, 10000)
+
+""" Интервал(сек.) проверки изменения файла шаблона сообщения promo_id """
+TEMPLATE_CHECK_INTERVAL = 5
+
+""" Размер страницы контактов читаемой рассыльщиком из БД, в памяти держится не больше двух страниц """
+MAILER_PAGE_SIZE = 1000
+
+""" Отложенная запись результатов в БД: размер буфера(записей) и максимальный интервал(сек.) между записями """
+DB_BUFFER_SIZE = 500
+DB_BUFFER_FLUSH_INTERVAL = 10
+
+""" Номер процесса и общее количество процессов при запуске через start_workers.py, каждый процесс
+работает только со своей частью файлов сессий и номеров телефонов """
+SHARD_INDEX = int(os.getenv('SHARD_INDEX', 0))
+SHARD_COUNT = int(os.getenv('SHARD_COUNT', 1))
+
 """ Конфигурация логирования """
 ERRORS_FORMAT = '{time:DD-MM-YYYY at HH:mm:ss} | {level} | {message}'
 DEBUG_FORMAT = '{time:DD-MM-YYYY at HH:mm:ss} | {level} | {message}'
@@ -26,8 +56,11 @@ logger_common_args = {
     'compression': 'zip'
 }
 
-PATH_FILE_DEBUG_LOGS = 'logs/debug.log'
-PATH_FILE_ERRORS_LOGS = 'logs/errors.log'
+""" При запуске в нескольких процессах у каждого процесса свои файлы логов, иначе процессы одновременно
+пишут и ротируют один файл """
+LOGS_SUFFIX = f'_{SHARD_INDEX}' if SHARD_COUNT > 1 else ''
+PATH_FILE_DEBUG_LOGS = f'logs/debug{LOGS_SUFFIX}.log'
+PATH_FILE_ERRORS_LOGS = f'logs/errors{LOGS_SUFFIX}.log'
 
 LOGGER_DEBUG = {'sink': PATH_FILE_DEBUG_LOGS, 'level': 'DEBUG', 'format': ERRORS_FORMAT} | logger_common_args
 LOGGER_ERRORS = {'sink': PATH_FILE_ERRORS_LOGS, 'level': 'WARNING', 'format': DEBUG_FORMAT} | logger_common_args
@@ -45,22 +78,111 @@ INPUT_FILES_DIR = os.path.abspath(f'{WORKING_FILES_DIR}{os.sep}input_files')
 INPUT_CSV_FILE_NAME = 'phones.csv'
 INPUT_CSV_FILE_PATH = os.path.abspath(f'{INPUT_FILES_DIR}{os.sep}{INPUT_CSV_FILE_NAME}')
 
-SESSION_IN_WORK_FILE_NAME = 'sessions_in_work.json'
-SESSION_IN_WORK_FILE_PATH = os.path.abspath(f'{WORKING_FILES_DIR}{os.sep}{SESSION_IN_WORK_FILE_NAME}')
+""" Потоковая загрузка входного csv файла: размер пачки контактов, максимум контактов ожидающих проверки в памяти
+и интервал(сек.) проверки появления файла """
+CSV_CHUNK_SIZE = 5000
+CSV_MAX_QUEUE_SIZE = CSV_CHUNK_SIZE * 2
+CSV_WAIT_FILE_INTERVAL = 5
+
+""" Время(сек.) аренды сессии процессом, аренда продлевается пока процесс работает с сессией """
+SESSION_LEASE_TTL = 60
+
+""" Интервал(сек.) повторной проверки json файлов сессий на изменения и задержка(сек.) повторной выдачи сессии,
+которая уже используется другим процессом """
+SESSIONS_REFRESH_INTERVAL = 5
+SESSION_IN_WORK_DELAY = 10
 
 """ Дефолтное время карантина(сек.) для сессии в случае исключения от Телеграм"""
 DEFAULT_QUARANTINE_TIME = 60 * 15
 
-""" Диапазон рандомной задержки(сек.) между запросами к Телеграм """
+""" Диапазон задержки(сек.) между запросами к Телеграм: FROM - минимальная задержка адаптивного темпа,
+начальная задержка - середина диапазона """
 FROM = 1
 BEFORE = 5
 
+""" Адаптивный темп запросов сессии: задержка(сек.) между запросами начинается с PACING_INITIAL_DELAY,
+после успешного запроса уменьшается на PACING_DECREASE_STEP (если доля ошибок среди последних PACING_HISTORY_SIZE
+запросов не больше PACING_MAX_ERROR_RATE), после ошибки умножается на PACING_BACKOFF_FACTOR, всегда в пределах
+FROM..PACING_MAX_DELAY и с разбросом PACING_JITTER в долях от задержки """
+PACING_INITIAL_DELAY = (FROM + BEFORE) / 2
+PACING_MAX_DELAY = 60
+PACING_DECREASE_STEP = 0.25
+PACING_BACKOFF_FACTOR = 2
+PACING_JITTER = 0.3
+PACING_HISTORY_SIZE = 20
+PACING_MAX_ERROR_RATE = 0.1
+
+""" Карантин(сек.) сессии по ошибкам Telegram: при FloodWait - время ожидания из ошибки плюс PACING_FLOOD_MARGIN,
+при PeerFlood и превышении лимита импорта контактов (ограничения без указанного времени ожидания) -
+PEER_FLOOD_QUARANTINE_TIME, при других ошибках - PACING_ERROR_QUARANTINE, удваивается при повторных ошибках подряд
+до DEFAULT_QUARANTINE_TIME """
+PACING_FLOOD_MARGIN = 5
+PEER_FLOOD_QUARANTINE_TIME = 60 * 60
+PACING_ERROR_QUARANTINE = 60
+
+""" Таймауты(сек.): подключения к сессии с проверкой авторизации, одного запроса к Telegram и отправки сообщения,
+действуют только на свою операцию, поэтому сессии могут работать одновременно """
+CONNECT_TIMEOUT = 30
+RPC_TIMEOUT = 30
+SEND_TIMEOUT = 30
+
+""" Количество сессий работающих одновременно, каждая со своими задержками и лимитами """
+WORKERS_CONCURRENCY = 1
+
+""" Метрики в формате Prometheus: адрес и порт HTTP сервера (0 - сервер не запускается, при запуске через
+start_workers.py к порту прибавляется номер процесса), интервал(сек.) записи снимка метрик в файл
+(0 - не записывать) и путь файла снимка """
+METRICS_HOST = os.getenv('METRICS_HOST', '127.0.0.1')
+METRICS_PORT = int(os.getenv('METRICS_PORT')) + SHARD_INDEX if os.getenv('METRICS_PORT') else 0
+METRICS_SNAPSHOT_INTERVAL = 15
+METRICS_SNAPSHOT_PATH = os.path.abspath(f'{WORKING_FILES_DIR}{os.sep}metrics_{SHARD_INDEX}.prom')
+
+""" Профилирование (переменная окружения PROFILING=1): замер времени этапов работы, поиск блокировок цикла событий
+дольше LOOP_LAG_THRESHOLD сек. с выборкой стека вызовов каждые LOOP_LAG_SAMPLE_INTERVAL сек.,
+отчёт записывается по завершении работы в файл profile_<checker|mailer>_<номер процесса>.txt """
+PROFILING = bool(os.getenv('PROFILING'))
+LOOP_LAG_THRESHOLD = 0.1
+LOOP_LAG_SAMPLE_INTERVAL = 0.02
+PROFILE_REPORT_DIR = WORKING_FILES_DIR
+
 """ Максимальное количество запросов от одной сессии за одно подключение """
 MAX_REQUESTS = 25
 
 """ Максимальное количество контактов в телефонной книге одной сессии """
 MAX_CONTACTS = 19
 
+""" Пул подключенных клиентов Telegram: максимум свободных подключений, через сколько сек. простоя клиент
+отключается, через сколько сек. простоя соединение проверяется перед использованием и таймаут(сек.) проверки """
+CLIENT_POOL_SIZE = 20
+CLIENT_IDLE_TIMEOUT = 300
+CLIENT_HEALTH_CHECK_INTERVAL = 60
+CLIENT_HEALTH_CHECK_TIMEOUT = 10
+
+""" Количество номеров телефонов проверяемых одним запросом чекера, не больше MAX_CONTACTS и MAX_REQUESTS """
+CHECK_BATCH_SIZE = 1
+
+""" Индекс номеров уже записанных в contacts и bad_contacts для отсева без запросов к БД: снимок отсортированных
+номеров (8 байт на номер) читается из файла через mmap, номера проверенные после создания снимка дочитываются
+из БД по date_check с запасом KNOWN_PHONES_CATCH_UP_MARGIN сек., снимок перестраивается если он старше
+KNOWN_PHONES_SNAPSHOT_MAX_AGE сек. или дочитано больше KNOWN_PHONES_MAX_DELTA номеров """
+KNOWN_PHONES_INDEX = True
+KNOWN_PHONES_SNAPSHOT_PATH = os.path.abspath(f'{WORKING_FILES_DIR}{os.sep}known_phones.bin')
+KNOWN_PHONES_SNAPSHOT_MAX_AGE = 60 * 60 * 24
+KNOWN_PHONES_CATCH_UP_MARGIN = 60 * 5
+KNOWN_PHONES_MAX_DELTA = 1_000_000
+KNOWN_PHONES_PAGE_SIZE = 100_000
+
+""" Общая очередь номеров чекера в БД (переменная окружения DB_WORK_QUEUE=1) для одновременной проверки на
+нескольких серверах с общей БД Postgres: номера выдаются процессу пачками по WORK_QUEUE_CLAIM_SIZE на
+WORK_QUEUE_CLAIM_TTL сек. (выдача продлевается пока процесс работает), номера упавшего процесса выдаются снова
+после истечения выдачи, но не больше WORK_QUEUE_MAX_ATTEMPTS раз, состояние очереди обновляется не чаще
+раза в WORK_QUEUE_REFRESH_INTERVAL сек. """
+DB_WORK_QUEUE = bool(os.getenv('DB_WORK_QUEUE'))
+WORK_QUEUE_CLAIM_SIZE = 50
+WORK_QUEUE_CLAIM_TTL = 600
+WORK_QUEUE_MAX_ATTEMPTS = 5
+WORK_QUEUE_REFRESH_INTERVAL = 2
+
 """ Конфигурация прокси, если == None -> используется прокcи указанный в json файле сессии """
 # CONFIG_PROXY = None
 CONFIG_PROXY = {
@@ -73,6 +195,15 @@ CONFIG_PROXY = {
 }
 # 51.79.192.224:10090|username:oskosks9221|password:293aae  # на выходе динамический ip
 
+""" Фоновая проверка прокси: интервал(сек.) между проверками, таймаут(сек.) одной проверки,
+максимальное ожидание(сек.) доступного прокси при подключении сессии, через сколько сек. неиспользуемый
+прокси перестаёт проверяться и нужно ли ждать смены ip прокси из CONFIG_PROXY перед каждой сессией """
+PROXY_CHECK_INTERVAL = 5
+PROXY_CHECK_TIMEOUT = 10
+PROXY_WAIT_TIMEOUT = 60
+PROXY_IDLE_TIMEOUT = 600
+PROXY_REQUIRE_IP_CHANGE = True
+
 """ Конфигурация класса Tester для удобства данные ввода можно указать тут или / None """
 
 # убедиться что сессия в категории work_sessions
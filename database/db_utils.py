@@ -1,29 +1,34 @@
 from datetime import datetime
 
-from peewee import ModelBase, Model, CharField, IntegerField, DateTimeField
-from playhouse.sqlite_ext import SqliteDatabase, PostgresqlDatabase, MySQLDatabase
-from config import DATABASE_CONFIG
+from peewee import ModelBase, Model, CharField, IntegerField, BigIntegerField, DateTimeField
+from playhouse.pool import PooledPostgresqlDatabase
+from playhouse.sqlite_ext import SqliteDatabase, MySQLDatabase
+from config import DATABASE_CONFIG, DB_EXECUTOR_WORKERS
 
 databases = {
     'sqlite': SqliteDatabase,
-    'postgres': PostgresqlDatabase,
+    'postgres': PooledPostgresqlDatabase,
     'mysql': MySQLDatabase
 }
 
-db: SqliteDatabase | PostgresqlDatabase | MySQLDatabase = databases[DATABASE_CONFIG[0]](**DATABASE_CONFIG[1])
+""" Пул соединений Postgres: по соединению на поток DBManager и одно для основного потока """
+pool_config = {'max_connections': DB_EXECUTOR_WORKERS + 1, 'stale_timeout': 300}
+
+db: SqliteDatabase | PooledPostgresqlDatabase | MySQLDatabase = databases[DATABASE_CONFIG[0]](
+    **(pool_config | DATABASE_CONFIG[1] if DATABASE_CONFIG[0] == 'postgres' else DATABASE_CONFIG[1]))
 
 
 class Contact(Model):
     """ Модель таблицы номеров имеющих Telegram контакты """
     promo_id = CharField(null=True)
-    phone = IntegerField(primary_key=True, unique=True)
+    phone = BigIntegerField(primary_key=True, unique=True)
     var_1 = CharField(null=True)
     var_2 = CharField(null=True)
     var_3 = CharField(null=True)
-    date_check = DateTimeField(default=datetime.now(), null=False)
+    date_check = DateTimeField(default=datetime.now, null=False)
     session_check = CharField(null=True)
 
-    user_id = IntegerField(null=True)
+    user_id = BigIntegerField(null=True)
     username = CharField(null=True)
     first_name = CharField(null=True)
     last_name = CharField(null=True)
@@ -40,11 +45,11 @@ class Contact(Model):
 class BadContact(Model):
     """ Модель таблицы номеров не имеющих Telegram контакты """
     promo_id = CharField(null=True)
-    phone = IntegerField(primary_key=True, unique=True)
+    phone = BigIntegerField(primary_key=True, unique=True)
     var_1 = CharField(null=True)
     var_2 = CharField(null=True)
     var_3 = CharField(null=True)
-    date_check = DateTimeField(default=datetime.now(), null=False)
+    date_check = DateTimeField(default=datetime.now, null=False)
     session_check = CharField(null=True)
     check_result = CharField(null=True)
 
@@ -54,10 +59,58 @@ class BadContact(Model):
         db_table = 'bad_contacts'
 
 
+class SessionLease(Model):
+    """ Модель таблицы аренды сессий процессами: сессия занята владельцем до времени expires_at """
+    session_name = CharField(primary_key=True)
+    owner = CharField(null=False)
+    expires_at = BigIntegerField(null=False)
+
+    class Meta:
+        database = db
+        db_table = 'session_leases'
+
+
+class IngestProgress(Model):
+    """ Модель таблицы прогресса загрузки входных файлов: до позиции offset(байт) файл загружен и обработан,
+    prefix_hash - хэш содержимого файла до этой позиции, lines - количество строк до неё """
+    source = CharField(primary_key=True)
+    offset = BigIntegerField(null=False)
+    prefix_hash = CharField(null=False)
+    lines = BigIntegerField(null=False)
+    updated_at = DateTimeField(default=datetime.now, null=False)
+
+    class Meta:
+        database = db
+        db_table = 'ingest_progress'
+
+
+class WorkItem(Model):
+    """ Модель таблицы очереди номеров на проверку общей для нескольких процессов и серверов:
+    status - pending (ожидает), claimed (взят в работу процессом owner до claim_expires), done или failed,
+    claim_id - идентификатор выдачи, attempts - количество выдач номера в работу """
+    phone = BigIntegerField(primary_key=True)
+    promo_id = CharField(null=True)
+    var_1 = CharField(null=True)
+    var_2 = CharField(null=True)
+    var_3 = CharField(null=True)
+    status = CharField(null=False, default='pending')
+    owner = CharField(null=True)
+    claim_id = CharField(null=True)
+    claim_expires = BigIntegerField(null=True)
+    attempts = IntegerField(null=False, default=0)
+
+    class Meta:
+        database = db
+        db_table = 'work_queue'
+
+
 class Tables:
     """ Единая точка доступа ко всем моделям приложения """
     contacts = Contact
     bad_contacts = BadContact
+    session_leases = SessionLease
+    ingest_progress = IngestProgress
+    work_queue = WorkItem
 
     @classmethod
     def all_tables(cls):
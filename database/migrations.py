@@ -0,0 +1,158 @@
+import argparse
+from datetime import datetime
+from typing import Callable
+
+from peewee import Model, IntegerField, CharField, DateTimeField, PostgresqlDatabase
+
+from config import logger
+from database.db_utils import db, Contact, BadContact, SessionLease, IngestProgress, WorkItem
+
+""" Ключ advisory lock Postgres, чтобы миграции не применялись одновременно из нескольких процессов """
+MIGRATIONS_LOCK_KEY = 7204311
+
+
+class SchemaVersion(Model):
+    """ Модель таблицы применённых миграций схемы БД """
+    version = IntegerField(primary_key=True)
+    description = CharField(null=False)
+    applied_at = DateTimeField(default=datetime.now, null=False)
+
+    class Meta:
+        database = db
+        db_table = 'schema_version'
+
+
+def is_postgres() -> bool:
+    """ Используется ли СУБД Postgresql """
+    return isinstance(db, PostgresqlDatabase)
+
+
+def create_index(table: str, name: str, columns: tuple[str, ...]) -> None:
+    """ Создаёт индекс если его ещё нет, в Postgres индекс строится без блокировки записи (CONCURRENTLY),
+    недостроенный индекс прерванной миграции удаляется и строится заново """
+    if is_postgres():
+        invalid = db.execute_sql('SELECT 1 FROM pg_index i JOIN pg_class c ON c.oid = i.indexrelid '
+                                 'WHERE c.relname = %s AND NOT i.indisvalid', (name,)).fetchone()
+        if invalid:
+            db.execute_sql(f'DROP INDEX CONCURRENTLY IF EXISTS {name}')
+        db.execute_sql(f'CREATE INDEX CONCURRENTLY IF NOT EXISTS {name} ON {table} ({", ".join(columns)})')
+    else:
+        db.execute_sql(f'CREATE INDEX IF NOT EXISTS {name} ON {table} ({", ".join(columns)})')
+
+
+def migration_initial_tables() -> None:
+    """ Исходная схема: таблицы создаются только если их ещё нет """
+    db.create_tables([Contact, BadContact], safe=True)
+
+
+def migration_indexes() -> None:
+    """ Индексы выборки контактов для рассылки и по дате проверки, индекс (promo_id, num_sends, phone)
+    используется и для выборки только по promo_id, phone в конце индекса позволяет читать контакты по порядку """
+    create_index('contacts', 'contacts_promo_id_num_sends_phone', ('promo_id', 'num_sends', 'phone'))
+    create_index('contacts', 'contacts_date_check', ('date_check',))
+    create_index('bad_contacts', 'bad_contacts_date_check', ('date_check',))
+
+
+def integer_columns() -> list[tuple[str, str]]:
+    """ Столбцы phone и user_id оставшиеся INTEGER в БД Postgres, созданной до перехода на BIGINT """
+    if not is_postgres():
+        return []
+    result = []
+    for table, column in (('contacts', 'phone'), ('contacts', 'user_id'), ('bad_contacts', 'phone')):
+        data_type = db.execute_sql('SELECT data_type FROM information_schema.columns '
+                                   'WHERE table_name = %s AND column_name = %s', (table, column)).fetchone()
+        if data_type and data_type[0] == 'integer':
+            result.append((table, column))
+    return result
+
+
+def migration_bigint_columns() -> None:
+    """ phone и user_id в Postgres переводятся в BIGINT (в SQLite INTEGER и так 64-битный). ALTER COLUMN TYPE
+    перезаписывает таблицу и её индексы под блокировкой ACCESS EXCLUSIVE, на всё время перестройки чтение
+    и запись таблицы останавливаются, поэтому миграция не применяется migrate() автоматически и запускается
+    вручную при остановленных процессах: python -m database.migrations --maintenance """
+    with db.atomic():
+        db.execute_sql("SET LOCAL lock_timeout = '10s'")
+        for table, column in integer_columns():
+            logger.info(f'Перестройка таблицы {table}: {column} -> BIGINT')
+            db.execute_sql(f'ALTER TABLE {table} ALTER COLUMN {column} TYPE BIGINT')
+
+
+def migration_ingest_progress() -> None:
+    """ Таблица прогресса загрузки входного csv файла """
+    db.create_tables([IngestProgress], safe=True)
+
+
+def migration_work_queue() -> None:
+    """ Таблица очереди номеров на проверку и индекс выбора номеров для выдачи в работу """
+    db.create_tables([WorkItem], safe=True)
+    create_index('work_queue', 'work_queue_status_claim_expires', ('status', 'claim_expires'))
+    create_index('work_queue', 'work_queue_claim_id', ('claim_id',))
+
+
+def migration_session_leases() -> None:
+    """ Таблица аренды сессий процессами, в БД применивших раннюю версию 1 таблица уже создана """
+    db.create_tables([SessionLease], safe=True)
+
+
+""" Миграции схемы БД в порядке применения: (версия, описание, функция) """
+MIGRATIONS = [
+    (1, 'исходные таблицы', migration_initial_tables),
+    (2, 'индексы promo_id, num_sends и date_check', migration_indexes),
+    (4, 'прогресс загрузки входного файла', migration_ingest_progress),
+    (5, 'очередь номеров на проверку', migration_work_queue),
+    (6, 'аренда сессий процессами', migration_session_leases),
+]
+
+""" Миграции перестраивающие таблицы под блокировкой, применяются только вручную в окно обслуживания """
+MAINTENANCE_MIGRATIONS = [
+    (3, 'BIGINT для phone и user_id', migration_bigint_columns),
+]
+
+
+def apply_migrations(migrations: list[tuple[int, str, Callable]]) -> int:
+    """ Применяет к БД миграции из списка которые ещё не были применены, возвращает количество применённых """
+    applied_now = 0
+    with db.connection_context():
+        if is_postgres():
+            db.execute_sql('SELECT pg_advisory_lock(%s)', (MIGRATIONS_LOCK_KEY,))
+        try:
+            db.create_tables([SchemaVersion], safe=True)
+            applied = {row.version for row in SchemaVersion.select(SchemaVersion.version)}
+            for version, description, migration in migrations:
+                if version in applied:
+                    continue
+                logger.info(f'Миграция схемы БД: {version} -> {description}')
+                migration()
+                SchemaVersion.insert(version=version, description=description).on_conflict_ignore().execute()
+                applied_now += 1
+        finally:
+            if is_postgres():
+                db.execute_sql('SELECT pg_advisory_unlock(%s)', (MIGRATIONS_LOCK_KEY,))
+    return applied_now
+
+
+def migrate() -> int:
+    """ Применяет к БД миграции которые ещё не были применены, возвращает количество применённых.
+    Если в БД остались столбцы для обслуживающих миграций, выводит предупреждение """
+    applied_now = apply_migrations(MIGRATIONS)
+    with db.connection_context():
+        if columns := integer_columns():
+            logger.warning(f'Столбцы {", ".join(".".join(column) for column in columns)} имеют тип INTEGER, '
+                           f'остановите процессы и выполните: python -m database.migrations --maintenance')
+    return applied_now
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Миграции схемы БД')
+    parser.add_argument('--maintenance', action='store_true',
+                        help='применить обслуживающие миграции, процессы сервиса должны быть остановлены')
+    args = parser.parse_args()
+    applied_now = migrate()
+    if args.maintenance:
+        applied_now += apply_migrations(MAINTENANCE_MIGRATIONS)
+    logger.info(f'Применено миграций схемы БД: {applied_now}')
+
+
+if __name__ == '__main__':
+    main()
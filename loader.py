@@ -1,3 +1,5 @@
+from config import AUTO_MIGRATE
+from database.migrations import migrate
 from managers.async_db_manager import DBManager
 from managers.session_files_manager import SessionFilesManager
 from managers.proxy_manager import ProxyManager
@@ -6,13 +8,33 @@ from managers.checker_manager import Checker
 from managers.message_manager import MessageManager
 from managers.mailer_manager import Mailer
 from managers.test_manager import Tester
+from managers.write_buffer_manager import WriteBufferManager
+from managers.client_pool_manager import ClientPoolManager
+from managers.metrics_manager import MetricsManager
+from managers.profiler_manager import ProfilerManager
+from managers.pacing_manager import PacingManager
+from managers.known_phones_manager import KnownPhonesManager
 
 
+if AUTO_MIGRATE:
+    migrate()
 dbm = DBManager()
-sfm = SessionFilesManager()
+sfm = SessionFilesManager(db_manager=dbm)
 pm = ProxyManager()
 csvm = CSVManager()
 mm = MessageManager()
-checker = Checker(db_manager=dbm, proxy_manager=pm, session_files_manager=sfm, csv_manager=csvm, message_manager=mm)
-mailer = Mailer(db_manager=dbm, proxy_manager=pm, session_files_manager=sfm, csv_manager=csvm, message_manager=mm)
-tester = Tester(db_manager=dbm, proxy_manager=pm, session_files_manager=sfm, csv_manager=csvm, message_manager=mm)
+mtm = MetricsManager()
+prm = ProfilerManager()
+pcm = PacingManager()
+kpm = KnownPhonesManager(db_manager=dbm)
+wbm = WriteBufferManager(db_manager=dbm, metrics_manager=mtm, known_phones_manager=kpm, session_files_manager=sfm)
+cpm = ClientPoolManager(session_files_manager=sfm)
+checker = Checker(db_manager=dbm, proxy_manager=pm, session_files_manager=sfm, csv_manager=csvm, message_manager=mm,
+                  write_buffer_manager=wbm, client_pool_manager=cpm, metrics_manager=mtm, profiler_manager=prm,
+                  pacing_manager=pcm, known_phones_manager=kpm)
+mailer = Mailer(db_manager=dbm, proxy_manager=pm, session_files_manager=sfm, csv_manager=csvm, message_manager=mm,
+                write_buffer_manager=wbm, client_pool_manager=cpm, metrics_manager=mtm, profiler_manager=prm,
+                pacing_manager=pcm)
+tester = Tester(db_manager=dbm, proxy_manager=pm, session_files_manager=sfm, csv_manager=csvm, message_manager=mm,
+                write_buffer_manager=wbm, client_pool_manager=cpm, metrics_manager=mtm, profiler_manager=prm,
+                pacing_manager=pcm)
@@ -1,84 +1,113 @@
+import asyncio
 import functools
+import time
+import uuid
+from array import array
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 from types import FunctionType
 from typing import Any, Callable
 
-from peewee import Model
+from peewee import Model, SQL, fn, chunked, OperationalError, InterfaceError, PostgresqlDatabase
 
-from database.db_utils import Tables, db, Contact
+from config import DEDUP_CHUNK_SIZE, DB_QUERY_MAX_PARAMS, SHARD_INDEX, SHARD_COUNT, DB_EXECUTOR_WORKERS, \
+    DB_WORK_QUEUE, WORK_QUEUE_MAX_ATTEMPTS
+from database.db_utils import Tables, db
 from managers.base import BaseSingletonClass
-
-db.create_tables(Tables.all_tables())
+from managers.contact_record import ContactRecord
 
 
 class DBManager(BaseSingletonClass):
     """ Класс Singleton надстройка над ORM "peewee" для соблюдения принципа DRY и
-        вынесения логики сохранения данных """
+        вынесения логики сохранения данных. Публичные методы пишутся синхронными,
+        db_connector превращает их в корутины выполняемые в пуле потоков """
     point_db_connection = db
     tables = Tables
+    # поля контактов читаемые для рассылки
+    campaign_fields = ('phone', 'promo_id', 'var_1', 'var_2', 'var_3', 'date_check', 'session_check', 'user_id',
+                       'username', 'num_sends')
 
     def __new__(cls, *args, **kwargs):
         cls.__instance = super().__new__(cls)
         cls.decorate_methods()
         return cls.__instance
 
+    # запросы выполняются в пуле потоков, каждый поток держит своё постоянное соединение с БД
+    executor = ThreadPoolExecutor(max_workers=DB_EXECUTOR_WORKERS, thread_name_prefix='db')
+
     @staticmethod
     def db_connector(method: Callable) -> Callable:
-        """ Единая точка доступа к БД из всех методов класса """
+        """ Единая точка доступа к БД из всех методов класса: синхронный метод выполняется в пуле потоков
+        executor, вызывающий получает корутину и цикл событий не блокируется на время запроса """
 
         @functools.wraps(method)
         async def wrapper(*args, **kwargs) -> Any:
-            with DBManager.point_db_connection:
-                result = await method(*args, **kwargs)
-            return result
+            return await asyncio.get_running_loop().run_in_executor(
+                DBManager.executor, functools.partial(DBManager._run_in_transaction, method, *args, **kwargs))
 
         return wrapper
 
+    @staticmethod
+    def _run_in_transaction(method: Callable, *args, **kwargs) -> Any:
+        """ Выполняет метод одной транзакцией на соединении текущего потока, соединение остаётся открытым
+        для следующих запросов и закрывается только при ошибке соединения """
+        db_connection = DBManager.point_db_connection
+        db_connection.connect(reuse_if_open=True)
+        try:
+            with db_connection.atomic():
+                return method(*args, **kwargs)
+        except (OperationalError, InterfaceError):
+            if not db_connection.is_closed():
+                db_connection.close()
+            raise
+
     @classmethod
     def decorate_methods(cls):
-        """ Оборачивает все методы класса которым нужен доступ БД, декоратором db_connector """
+        """ Оборачивает все методы класса которым нужен доступ БД, декоратором db_connector,
+        служебные методы с префиксом _ вызываются из уже обёрнутых методов и не оборачиваются """
 
         for attr_name in cls.__dict__:
-            if not attr_name.startswith('__') and attr_name not in ['db_connector', 'decorate_methods']:
+            if not attr_name.startswith('_') and attr_name not in ['db_connector', 'decorate_methods']:
                 method = cls.__getattribute__(cls, attr_name)
                 if isinstance(method, FunctionType):
                     # cls.logger.debug(cls.sign + f'decorate_methods -> db_connector wrapper -> method: {attr_name}')
                     setattr(cls, attr_name, cls.db_connector(method))
 
-    async def get_or_create_contact(self, contact: dict, bad_contact: bool = False) -> tuple[Model, bool]:
-        """ Если phone не найден в таблице contacts или bad_contacts -> создаёт новую запись """
-        if bad_contact:
-            db_contact, fact_create = self.tables.bad_contacts.get_or_create(phone=contact.get('phone'))
-        else:
-            db_contact, fact_create = self.tables.contacts.get_or_create(phone=contact.get('phone'))
-        if fact_create:
-            db_contact.promo_id = contact.get('promo_id')
-            db_contact.var_1 = contact.get('var_1')
-            db_contact.var_2 = contact.get('var_2')
-            db_contact.var_3 = contact.get('var_3')
-            db_contact.date_check = datetime.now()
-            db_contact.session_check = contact.get('session_name')
-            if bad_contact:
-                db_contact.check_result = contact.get('check_result')
-            else:
-                db_contact.user_id = contact.get('user_id')
-                db_contact.username = contact.get('username')
-                db_contact.first_name = contact.get('first_name')
-                db_contact.last_name = contact.get('last_name')
-            db_contact.save()
-
-        text = 'created new contact' if fact_create else 'get contact'
-        self.logger.debug(self.sign + f'{bad_contact=} | {text.upper()}: {db_contact.phone=}')
-        return db_contact, fact_create
-
-    async def get_or_none_contact_in_contacts(self, phone: int) -> Tables.contacts | None:
+    def save_results_many(self, contacts: list[dict], bad_contacts: list[dict],
+                          sent_contacts: list[ContactRecord], work_owner: str | None = None) -> None:
+        """ Записывает накопленные результаты одной транзакцией: новые записи contacts и bad_contacts через
+        insert_many без перезаписи существующих phone, изменения после рассылки через bulk_update,
+        для которого контакты преобразуются в модели peewee. Номера очереди в БД выданные work_owner
+        отмечаются проверенными """
+        for table, rows in ((self.tables.contacts, contacts), (self.tables.bad_contacts, bad_contacts)):
+            if rows:
+                for batch in chunked(rows, max(1, DB_QUERY_MAX_PARAMS // len(rows[0]))):
+                    table.insert_many(batch).on_conflict_ignore().execute()
+
+        if sent_contacts:
+            fields = [self.tables.contacts.date_check, self.tables.contacts.session_check,
+                      self.tables.contacts.user_id, self.tables.contacts.date_last_send,
+                      self.tables.contacts.session_last_send, self.tables.contacts.num_sends]
+            models = [self.tables.contacts(**contact.to_row(('phone', *(field.name for field in fields))))
+                      for contact in sent_contacts]
+            self.tables.contacts.bulk_update(
+                models, fields=fields, batch_size=max(1, DB_QUERY_MAX_PARAMS // (len(fields) * 2 + 1)))
+
+        if DB_WORK_QUEUE and work_owner and (checked := [row['phone'] for row in contacts + bad_contacts]):
+            # номер отмечается проверенным в одной транзакции с записью результата
+            self._complete_work(owner=work_owner, phones=checked)
+
+        self.logger.debug(self.sign + f'записано: contacts: {len(contacts)} | bad_contacts: {len(bad_contacts)} | '
+                                      f'обновлено после рассылки: {len(sent_contacts)}')
+
+    def get_or_none_contact_in_contacts(self, phone: int) -> Tables.contacts | None:
         """ Возвращает контакт из таблицы contacts если он там есть """
         contact = self.tables.contacts.get_or_none(phone=phone)
         msg = self.sign + f'{contact=}'
         self.logger.debug(msg) if contact else self.logger.warning(msg)
         return contact
 
-    async def get_or_none_contact_in_bad_contacts(self, phone: int) -> Tables.contacts | None:
+    def get_or_none_contact_in_bad_contacts(self, phone: int) -> Tables.contacts | None:
         """ Возвращает контакт из таблицы bad_contacts если он там есть """
 
         contact = self.tables.bad_contacts.get_or_none(phone=phone)
@@ -105,24 +134,198 @@ class DBManager(BaseSingletonClass):
         # contact.save()
         # return db_contact
 
-    async def check_contacts_in_all_tables(self, contacts: list[dict]) -> list[dict]:
+    def check_contacts_in_all_tables(self, contacts: list[ContactRecord]) -> list[ContactRecord]:
         """ Проверяет входящий список контактов на наличие каждого контакта в БД и
-        возвращает список только тех контактов, которых нет в БД"""
+        возвращает список только тех контактов, которых нет в БД и которые не повторяются во входящем списке.
+        Номера проверяются пачками по DEDUP_CHUNK_SIZE запросами IN (...) сначала к contacts,
+        затем к bad_contacts только для не найденных номеров """
 
         result_contacts = []
-        for contact in contacts:
-            phone = contact.get('phone')
-            if not self.tables.contacts.get_or_none(phone=phone) \
-                    and not self.tables.bad_contacts.get_or_none(phone=phone):
-                result_contacts.append(contact)
+        seen_phones = set()
+        invalid = duplicates = 0
+        for chunk in chunked(contacts, DEDUP_CHUNK_SIZE):
+            chunk_phones = {}
+            for contact in chunk:
+                try:
+                    phone = int(contact.phone)
+                except (TypeError, ValueError):
+                    invalid += 1
+                    continue
+                if phone in seen_phones:
+                    duplicates += 1
+                    continue
+                seen_phones.add(phone)
+                chunk_phones[phone] = contact
+
+            known_phones = set()
+            for table in (self.tables.contacts, self.tables.bad_contacts):
+                if not (phones := [phone for phone in chunk_phones if phone not in known_phones]):
+                    break
+                known_phones.update(self._select_known_phones(table, phones))
+
+            result_contacts.extend(contact for phone, contact in chunk_phones.items() if phone not in known_phones)
+
         self.logger.debug(self.sign + f'Проверено: {len(contacts)} контактов, '
-                                      f'из них ранее записано в БД: {len(contacts) - len(result_contacts)}, '
+                                      f'из них ранее записано в БД: '
+                                      f'{len(contacts) - len(result_contacts) - invalid - duplicates}, '
+                                      f'повторов в списке: {duplicates}, невалидных номеров: {invalid}, '
                                       f'к дальнейшей обработке: {len(result_contacts)}')
         return result_contacts
 
-    async def get_contacts_from_promo_id(self, promo_id: str) -> list[Contact]:
-        """ Возвращает список контактов соответствующих promo_id """
-        # args = [(self.tables.contacts.promo_id == promo_id), (self.tables.contacts.num_sends > 0)]
-        # contacts = self.tables.contacts.select().where(*args)
-        contacts: Tables.contacts = self.tables.contacts.select().where(self.tables.contacts.promo_id == promo_id)
-        return list(contacts)
+    def _select_known_phones(self, table: type[Model], phones: list[int]) -> list[int]:
+        """ Возвращает номера из phones, которые есть в таблице table. Значения передаются драйверу БД напрямую:
+        обработка тысяч параметров выражения IN (...) средствами peewee дороже самого запроса """
+        placeholders = SQL(f'({", ".join([self.point_db_connection.param] * len(phones))})')
+        sql, _ = table.select(table.phone).where(table.phone.in_(placeholders)).sql()
+        return [row[0] for row in self.point_db_connection.execute_sql(sql, phones)]
+
+    def acquire_session_lease(self, session_name: str, owner: str, ttl: int) -> bool:
+        """ Атомарно берёт сессию в аренду на ttl сек.: перехватывает истёкшую или свою аренду,
+        либо создаёт новую запись, при конфликте вставки аренда остаётся у процесса успевшего первым """
+        table = self.tables.session_leases
+        now = int(time.time())
+        updated = table.update(owner=owner, expires_at=now + ttl).where(
+            (table.session_name == session_name) & ((table.expires_at < now) | (table.owner == owner))).execute()
+        if not updated:
+            table.insert(session_name=session_name, owner=owner, expires_at=now + ttl).on_conflict_ignore().execute()
+            updated = table.select().where((table.session_name == session_name) & (table.owner == owner)).exists()
+        return bool(updated)
+
+    def renew_session_leases(self, owner: str, ttl: int) -> int:
+        """ Продлевает все действующие аренды владельца, возвращает количество продлённых """
+        table = self.tables.session_leases
+        now = int(time.time())
+        return table.update(expires_at=now + ttl).where((table.owner == owner) & (table.expires_at >= now)).execute()
+
+    def release_session_lease(self, session_name: str | None, owner: str) -> int:
+        """ Освобождает аренду сессии владельца, если session_name не указан - все аренды владельца """
+        table = self.tables.session_leases
+        query = table.delete().where(table.owner == owner)
+        if session_name:
+            query = query.where(table.session_name == session_name)
+        return query.execute()
+
+    def check_session_lease(self, session_name: str, owner: str) -> bool:
+        """ Проверяет арендована ли сессия другим процессом """
+        table = self.tables.session_leases
+        return table.select().where((table.session_name == session_name) & (table.owner != owner) &
+                                    (table.expires_at >= int(time.time()))).exists()
+
+    def get_ingest_progress(self, source: str) -> dict | None:
+        """ Возвращает сохранённый прогресс загрузки входного файла source: offset, prefix_hash и lines """
+        table = self.tables.ingest_progress
+        if progress := table.get_or_none(table.source == source):
+            return {'offset': progress.offset, 'prefix_hash': progress.prefix_hash, 'lines': progress.lines}
+        return None
+
+    def save_ingest_progress(self, source: str, offset: int, prefix_hash: str, lines: int) -> None:
+        """ Сохраняет прогресс загрузки входного файла source """
+        table = self.tables.ingest_progress
+        table.insert(source=source, offset=offset, prefix_hash=prefix_hash, lines=lines,
+                     updated_at=datetime.now()).on_conflict(
+            conflict_target=[table.source],
+            update={table.offset: offset, table.prefix_hash: prefix_hash, table.lines: lines,
+                    table.updated_at: datetime.now()}).execute()
+
+    def get_known_phones_page(self, table_name: str, after_phone: int, limit: int) -> array:
+        """ Возвращает следующую страницу номеров таблицы table_name (contacts или bad_contacts) с phone больше
+        after_phone по возрастанию phone, номера читаются по первичному ключу без сортировки """
+        table = getattr(self.tables, table_name)
+        query = table.select(table.phone).where(table.phone > after_phone).order_by(table.phone).limit(limit)
+        return array('q', (row[0] for row in query.tuples().iterator()))
+
+    def get_phones_checked_since(self, since: datetime) -> list[int]:
+        """ Возвращает номера из contacts и bad_contacts проверенные начиная с since, по индексам date_check """
+        return [row[0] for table in (self.tables.contacts, self.tables.bad_contacts)
+                for row in table.select(table.phone).where(table.date_check >= since).tuples().iterator()]
+
+    def enqueue_work(self, contacts: list[ContactRecord]) -> None:
+        """ Добавляет номера в очередь на проверку, номера уже находящиеся в очереди пропускаются """
+        rows = [contact.to_row(('phone', 'promo_id', 'var_1', 'var_2', 'var_3')) for contact in contacts]
+        for batch in chunked(rows, DB_QUERY_MAX_PARAMS // 5):
+            self.tables.work_queue.insert_many(batch).on_conflict_ignore().execute()
+
+    def claim_work(self, owner: str, limit: int, ttl: int) -> list[ContactRecord]:
+        """ Атомарно выдаёт владельцу до limit ожидающих номеров или номеров с истёкшей выдачей на ttl сек.:
+        в Postgres строки выбираются с FOR UPDATE SKIP LOCKED и параллельные выдачи не ждут друг друга,
+        в SQLite выбор и изменение выполняются одним UPDATE с повторной проверкой условия.
+        Номера с истёкшей выдачей исчерпавшие WORK_QUEUE_MAX_ATTEMPTS попыток отмечаются failed """
+        table = self.tables.work_queue
+        now = int(time.time())
+        expired = (table.status == 'claimed') & (table.claim_expires < now)
+        table.update(status='failed').where(expired & (table.attempts >= WORK_QUEUE_MAX_ATTEMPTS)).execute()
+
+        claimable = (table.status == 'pending') | expired
+        candidates = table.select(table.phone).where(claimable).limit(limit)
+        if isinstance(self.point_db_connection, PostgresqlDatabase):
+            candidates = candidates.for_update('FOR UPDATE SKIP LOCKED')
+        claim_id = uuid.uuid4().hex
+        table.update(status='claimed', owner=owner, claim_id=claim_id, claim_expires=now + ttl,
+                     attempts=table.attempts + 1).where(table.phone.in_(candidates) & claimable).execute()
+
+        return [ContactRecord(*row) for row in table.select(
+            table.phone, table.promo_id, table.var_1, table.var_2, table.var_3).where(
+            table.claim_id == claim_id).tuples()]
+
+    def renew_work_claims(self, owner: str, ttl: int) -> int:
+        """ Продлевает выдачу всех номеров владельца, возвращает количество продлённых """
+        table = self.tables.work_queue
+        return table.update(claim_expires=int(time.time()) + ttl).where(
+            (table.owner == owner) & (table.status == 'claimed')).execute()
+
+    def release_work(self, owner: str, phones: list[int | str]) -> int:
+        """ Возвращает выданные владельцу номера в ожидание, номера исчерпавшие попытки отмечаются failed """
+        table = self.tables.work_queue
+        released = 0
+        for batch in chunked([int(phone) for phone in phones], DB_QUERY_MAX_PARAMS):
+            claimed = (table.owner == owner) & (table.status == 'claimed') & table.phone.in_(batch)
+            table.update(status='failed').where(claimed & (table.attempts >= WORK_QUEUE_MAX_ATTEMPTS)).execute()
+            released += table.update(status='pending', owner=None, claim_id=None, claim_expires=None).where(
+                claimed).execute()
+        return released
+
+    def complete_work(self, owner: str, phones: list[int | str]) -> int:
+        """ Отмечает выданные владельцу номера проверенными без записи результата """
+        return self._complete_work(owner=owner, phones=phones)
+
+    def _complete_work(self, owner: str, phones: list[int | str]) -> int:
+        """ Отмечает выданные владельцу номера проверенными, номера выданные другому владельцу не меняются """
+        table = self.tables.work_queue
+        completed = 0
+        for batch in chunked([int(phone) for phone in phones], DB_QUERY_MAX_PARAMS):
+            completed += table.update(status='done').where(
+                (table.owner == owner) & (table.status == 'claimed') & table.phone.in_(batch)).execute()
+        return completed
+
+    def count_work(self) -> dict[str, int]:
+        """ Количество номеров в очереди: ожидающих выдачи (с истёкшей выдачей тоже) и выданных в работу """
+        table = self.tables.work_queue
+        now = int(time.time())
+        pending = table.select().where(table.status == 'pending').count()
+        claimed = {bool(row.expired): row.count for row in table.select(
+            (table.claim_expires < now).alias('expired'), fn.COUNT(table.phone).alias('count')).where(
+            table.status == 'claimed').group_by(SQL('1'))}
+        return {'pending': pending + claimed.get(True, 0), 'claimed': claimed.get(False, 0)}
+
+    def _campaign_query(self, promo_id: str, *fields) -> Any:
+        """ Запрос контактов promo_id которым ещё не отправлялось сообщение, только своей части номеров """
+        table = self.tables.contacts
+        query = table.select(*fields).where((table.promo_id == promo_id) & (table.num_sends == 0))
+        if SHARD_COUNT > 1:
+            # остаток от деления через целочисленное деление: оператор % в peewee означает LIKE
+            query = query.where(table.phone - table.phone / SHARD_COUNT * SHARD_COUNT == SHARD_INDEX)
+        return query
+
+    def count_campaign_contacts(self, promo_id: str) -> int:
+        """ Возвращает количество контактов promo_id ожидающих рассылки """
+        return self._campaign_query(promo_id).count()
+
+    def get_campaign_page(self, promo_id: str, after_phone: int, limit: int) -> list[ContactRecord]:
+        """ Возвращает следующую страницу контактов promo_id ожидающих рассылки с phone больше after_phone
+        по возрастанию phone, постраничное чтение по ключу не зависит от размера уже прочитанной части.
+        Строки читаются кортежами без создания моделей peewee """
+        table = self.tables.contacts
+        fields = [getattr(table, name) for name in self.campaign_fields]
+        query = self._campaign_query(promo_id, *fields).where(table.phone > after_phone)
+        return [ContactRecord(**dict(zip(self.campaign_fields, row)))
+                for row in query.order_by(table.phone).limit(limit).tuples()]
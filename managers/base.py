@@ -1,7 +1,10 @@
 import asyncio
+import contextlib
+import contextvars
 import functools
 import os
-import signal
+import time
+import zlib
 from sqlite3 import OperationalError
 from types import FunctionType
 from typing import Callable, Any
@@ -9,7 +12,9 @@ from typing import Callable, Any
 from telethon import TelegramClient
 from telethon.sessions.sqlite import SQLiteSession
 
-from config import logger, MAX_CONTACTS
+from config import logger, MAX_CONTACTS, SESSION_IN_WORK_DELAY, WORKERS_CONCURRENCY, SHARD_INDEX, SHARD_COUNT, \
+    CONNECT_TIMEOUT
+from managers.contact_queue import ContactQueue
 
 
 class BaseSingletonClass:
@@ -29,16 +34,25 @@ class BaseSingletonClass:
         pass
 
 
-class SignalTimeout(Exception):
-    """ Исключение для signal """
+# имя сессии с которой работает текущий воркер, у каждой задачи asyncio своё значение
+current_session = contextvars.ContextVar('current_session', default='')
 
 
-def signal_handler(signum, frame):
-    """ Обработчик вызовов signal """
-    raise SignalTimeout("Прерывание запуска клиента сессии по SignalTimeout")
+class ConnectTimeout(Exception):
+    """ Исключение для превышения CONNECT_TIMEOUT при подключении к сессии """
 
 
-signal.signal(signal.SIGALRM, signal_handler)
+class SessionUnauthorized(Exception):
+    """ Исключение для не авторизованной сессии """
+
+
+def in_shard(key: int | str) -> bool:
+    """ Проверяет относится ли номер телефона или имя сессии к части данных текущего процесса """
+    if SHARD_COUNT <= 1:
+        return True
+    if isinstance(key, str):
+        key = zlib.crc32(key.encode())
+    return key % SHARD_COUNT == SHARD_INDEX
 
 
 class BaseTelegramWorkers(BaseSingletonClass):
@@ -56,6 +70,11 @@ class BaseTelegramWorkers(BaseSingletonClass):
         self.session_files = kwargs.get('session_files_manager')
         self.csv_manager = kwargs.get('csv_manager')
         self.message_manager = kwargs.get('message_manager')
+        self.write_buffer = kwargs.get('write_buffer_manager')
+        self.client_pool = kwargs.get('client_pool_manager')
+        self.metrics = kwargs.get('metrics_manager')
+        self.profiler = kwargs.get('profiler_manager')
+        self.pacing = kwargs.get('pacing_manager')
         self.decorate_call()
         self.decorate_start_tg_client()
 
@@ -65,7 +84,7 @@ class BaseTelegramWorkers(BaseSingletonClass):
     async def all_checks_for_one_session(self, session_name: str, mailing: bool) -> bool | dict:
         """ Метод объединяющий все проверки доступности сессии """
         if await self.session_files.session_in_work_status(session_name=session_name) == 'in_work':
-            await asyncio.sleep(10)
+            await self.session_files.release_session(session_name, not_before=time.time() + SESSION_IN_WORK_DELAY)
             return False
 
         session_data = await self.session_files.get_session_data(session_name)
@@ -92,8 +111,9 @@ class BaseTelegramWorkers(BaseSingletonClass):
             session_name = await self.session_files.get_session_name(mailing=mailing)
         return session_name
 
-    async def start_work_with_contacts(self, contacts: list) -> None:
-        """ Для проверки номеров телефонов на наличие Telegram контактов полученных из входного csv файла """
+    async def start_work_with_contacts(self, contacts: ContactQueue) -> None:
+        """ Для проверки номеров телефонов на наличие Telegram контактов полученных из входного csv файла,
+        запускает WORKERS_CONCURRENCY воркеров с общей очередью контактов """
         if self.__class__.__name__ == 'Mailer':
             mailing = True
             log_text_1 = 'Рассылка завершена -> ' \
@@ -109,31 +129,83 @@ class BaseTelegramWorkers(BaseSingletonClass):
                          'упало сессий: {fallen_sessions}'
             log_text_2 = 'непроверенных номеров: {contacts}'
 
-        while session_name := await self.get_and_choice_session_name(mailing=mailing):
+        self.register_metrics(contacts=contacts)
+        await self.metrics.start()
+        await self.profiler.start(worker=self)
+        await self.write_buffer.start()
+        try:
+            await asyncio.gather(*(self.worker(contacts=contacts, mailing=mailing, log_text=log_text_2)
+                                   for _ in range(WORKERS_CONCURRENCY)))
+        finally:
+            await self.write_buffer.stop()
+            await self.client_pool.close_all()
+            await self.session_files.release_all_sessions()
+            await self.proxy_manager.stop()
+            await self.metrics.stop()
+            await self.profiler.stop()
+
+        if contacts.exhausted:
+            self.logger.info(self.sign + log_text_1.format(
+                sent_messages=self.sent_messages, total_contacts=self.total_contacts,
+                fallen_sessions=self.fallen_sessions, added_contacts=self.added_contacts))
+
+    def register_metrics(self, contacts: ContactQueue) -> None:
+        """ Регистрирует значения метрик вычисляемые при чтении: очередь контактов, счётчики воркера,
+        состояния сессий, буфер записи в БД и пул клиентов """
+        worker = self.__class__.__name__
+        self.metrics.gauge('tcs_queue_depth', lambda: len(contacts), worker=worker)
+        for counter in ('total_contacts', 'added_contacts', 'sent_messages', 'fallen_sessions'):
+            self.metrics.gauge('tcs_worker_contacts', lambda counter=counter: getattr(self, counter),
+                               worker=worker, counter=counter)
+        for state in ('total', 'in_work', 'quarantine', 'stop_sending'):
+            self.metrics.gauge('tcs_sessions', lambda state=state: self.session_files.count_sessions()[state],
+                               state=state)
+        self.metrics.gauge('tcs_write_buffer_size', lambda: len(self.write_buffer))
+        self.metrics.gauge('tcs_client_pool_size', lambda: len(self.client_pool))
+
+    async def worker(self, contacts: ContactQueue, mailing: bool, log_text: str) -> None:
+        """ Цикл одного воркера: берёт ближайшую свободную сессию и обрабатывает ею контакты из общей очереди,
+        несколько воркеров работают одновременно с разными сессиями """
+        while not contacts.exhausted:
+            await contacts.refresh()
             if not contacts:
                 await asyncio.sleep(1)
-                self.logger.info(self.sign + log_text_1.format(
-                    sent_messages=self.sent_messages, total_contacts=self.total_contacts,
-                    fallen_sessions=self.fallen_sessions, added_contacts=self.added_contacts))
+                continue
+
+            if not (session_name := await self.get_and_choice_session_name(mailing=mailing)):
                 break
 
-            self.logger.info(self.sign + log_text_2.format(contacts=len(contacts)))
+            self.logger.info(self.sign + log_text.format(contacts=len(contacts)))
 
-            session_data = await self.all_checks_for_one_session(session_name=session_name, mailing=mailing)
-            if not session_data:
-                continue
+            await self.work_with_session(session_name=session_name, contacts=contacts, mailing=mailing)
 
-            try:
-                if client := await self.get_tg_client(session_name=session_name, session_data=session_data):
-                    self.logger.info(self.sign + f'СТАРТ сессии: {session_name} | '
-                                                 f'{session_data.get("first_name")} {session_data.get("last_name")}')
-                    await self.session_files.session_in_work_status(session_name=session_name, action='start')
-                    await self.start_tg_client(
-                        session_name=session_name, session_data=session_data, client=client, contacts=contacts)
+    async def work_with_session(self, session_name: str, contacts: ContactQueue, mailing: bool) -> None:
+        """ Проверяет доступность сессии, подключается к ней и обрабатывает контакты из очереди """
+        current_session.set(session_name)
+        session_data = await self.all_checks_for_one_session(session_name=session_name, mailing=mailing)
+        if not session_data:
+            await self.session_files.release_session(session_name)
+            return
 
-            except BaseException as base_exc:
-                self.logger.error(self.sign + f'Critical ERROR -> {base_exc=}')
+        if await self.session_files.session_in_work_status(session_name=session_name, action='start') != 'start':
+            await self.session_files.release_session(session_name, not_before=time.time() + SESSION_IN_WORK_DELAY)
+            return
+
+        try:
+            if client := await self.client_pool.acquire(session_name) or \
+                    await self.get_tg_client(session_name=session_name, session_data=session_data):
+                self.logger.info(self.sign + f'СТАРТ сессии: {session_name} | '
+                                             f'{session_data.get("first_name")} {session_data.get("last_name")}')
+                await self.start_tg_client(
+                    session_name=session_name, session_data=session_data, client=client, contacts=contacts)
+
+        except BaseException as base_exc:
+            self.logger.error(self.sign + f'Critical ERROR -> {base_exc=}')
 
+        if self.client_pool.is_pooled(session_name):
+            # клиент остался подключенным в пуле, аренда сессии сохраняется до его отключения
+            await self.session_files.release_session(session_name)
+        else:
             await self.session_files.session_in_work_status(session_name=session_name, action='stop')
 
     async def get_tg_client(self, session_name: str, session_data: dict) -> TelegramClient | None:
@@ -150,13 +222,36 @@ class BaseTelegramWorkers(BaseSingletonClass):
                 api_id=session_data.get('app_id'),
                 api_hash=session_data.get('app_hash'),
                 proxy=proxy,
+                # FloodWait любой длительности выбрасывается, а не пережидается внутри запроса,
+                # чтобы сессия ушла в карантин на время ограничения и ошибка учитывалась в темпе и метриках
+                flood_sleep_threshold=0,
             )
 
         return client
 
+    @contextlib.asynccontextmanager
+    async def connected(self, client: TelegramClient) -> TelegramClient:
+        """ Подключает клиента сессии если он ещё не подключен, клиент из пула уже подключен и проверен,
+        подключение и проверка сессии ограничены CONNECT_TIMEOUT сек. только для этого клиента,
+        клиент не отключается при выходе: его возвращает в пул или отключает wrapper_for_start_tg_client """
+        if not client.is_connected():
+            try:
+                await asyncio.wait_for(self.connect_tg_client(client=client), CONNECT_TIMEOUT)
+            except asyncio.TimeoutError:
+                raise ConnectTimeout(f'подключение к сессии дольше {CONNECT_TIMEOUT} сек.') from None
+        yield client
+
+    async def connect_tg_client(self, client: TelegramClient) -> None:
+        """ Подключение клиента и проверка сессии """
+        with self.metrics.track_rpc('connect'):
+            await client.connect()
+        with self.metrics.track_rpc('get_me'):
+            await self.check_connect_session(client=client)
+
     async def check_connect_session(self, client: TelegramClient) -> None:
         """ Проверка подключения к сессии """
-        user = await client.get_me()
+        if not (user := await client.get_me()):
+            raise SessionUnauthorized('сессия не авторизована')
         self.logger.info(self.sign + f'Ok -> подключен к сессии -> '
                                      f'{user.phone=} | {user.first_name} {user.last_name} | {user.id=}')
 
@@ -187,7 +282,7 @@ class BaseTelegramWorkers(BaseSingletonClass):
             setattr(cls, '__call__', cls.wrapper_for_call(method))
 
     async def start_tg_client(self, session_name: str, session_data: dict,
-                              client: TelegramClient, contacts: list, msg_text: str | None = None) -> None:
+                              client: TelegramClient, contacts: ContactQueue, msg_text: str | None = None) -> None:
         """ Подключение к сессии и старт проверки номеров телефонов на наличие Telegram контактов в классе Checker
         или начало рассылки по контактам в классе Mailer """
 
@@ -197,12 +292,13 @@ class BaseTelegramWorkers(BaseSingletonClass):
 
         @functools.wraps(method)
         async def wrapper(self, session_name: str, session_data: dict,
-                          client: TelegramClient, contacts: list, msg_text: str | None = None) -> None:
+                          client: TelegramClient, contacts: ContactQueue, msg_text: str | None = None) -> None:
+            reusable = False
             try:
-                signal.alarm(30)
                 await method(self, session_name, session_data, client, contacts, msg_text)
+                reusable = True
 
-            except SignalTimeout as exc:
+            except (ConnectTimeout, SessionUnauthorized) as exc:
                 self.logger.warning(self.sign + f'ERROR ошибка подключения к сессии {exc=}')
                 await self.session_files.move_session_to_bad_sessions(session_name=session_name)
                 self.fallen_sessions += 1
@@ -216,8 +312,7 @@ class BaseTelegramWorkers(BaseSingletonClass):
 
             finally:
                 try:
-                    signal.alarm(0)
-                    await client.__aexit__()
+                    await self.client_pool.release(session_name=session_name, client=client, reusable=reusable)
                 except OperationalError:
                     pass
                 except Exception as exc:
@@ -1,15 +1,16 @@
 import asyncio
-import signal
 import time
-from random import randint
 
 from telethon import TelegramClient
 from telethon import functions
 from telethon.tl.types import InputPhoneContact
 from telethon.tl.types.contacts import ImportedContacts
 
-from config import MAX_REQUESTS, FROM, BEFORE, DEFAULT_QUARANTINE_TIME, MAX_CONTACTS
-from managers.base import BaseTelegramWorkers
+from config import MAX_REQUESTS, MAX_CONTACTS, CSV_MAX_QUEUE_SIZE, SHARD_INDEX, SHARD_COUNT, CHECK_BATCH_SIZE, \
+    RPC_TIMEOUT, INPUT_CSV_FILE_NAME, DB_WORK_QUEUE
+from managers.base import BaseTelegramWorkers, in_shard
+from managers.contact_queue import ContactQueue, DBWorkQueue
+from managers.contact_record import ContactRecord
 
 
 class Checker(BaseTelegramWorkers):
@@ -17,103 +18,217 @@ class Checker(BaseTelegramWorkers):
 
     def __init__(self, **kwargs):
         super().__init__(**kwargs)
+        self.known_phones = kwargs.get('known_phones_manager')
 
     async def __call__(self):
-        contacts = await self.db_manager.check_contacts_in_all_tables(await self.csv_manager())
-        self.total_contacts = len(contacts)
-        await self.start_work_with_contacts(contacts=contacts)
+        if DB_WORK_QUEUE:
+            contacts = DBWorkQueue(db_manager=self.db_manager, owner=self.session_files.lease_owner)
+        else:
+            contacts = ContactQueue(closed=False)
+        ingest_task = asyncio.create_task(self.ingest_contacts(contacts=contacts))
+        try:
+            await self.start_work_with_contacts(contacts=contacts)
+        finally:
+            ingest_task.cancel()
+            await contacts.release()
+        if not contacts.persistent and ingest_task.done() and not ingest_task.cancelled() and ingest_task.result():
+            await self.save_ingest_progress(contacts=contacts)
+
+    @staticmethod
+    def ingest_source() -> str:
+        """ Ключ прогресса загрузки входного файла, у каждой части номеров при запуске в нескольких процессах свой """
+        return f'{INPUT_CSV_FILE_NAME}:{SHARD_INDEX}/{SHARD_COUNT}'
+
+    async def ingest_contacts(self, contacts: ContactQueue) -> bool:
+        """ Потоково загружает номера телефонов из входного csv файла, начиная с позиции сохранённой прошлой
+        загрузкой, отсеивает ранее записанные в БД (по индексу номеров, если он загружен, иначе запросами к БД)
+        и пополняет очередь, пока очередь заполнена загрузка приостанавливается, возвращает True если файл
+        прочитан до конца без ошибок. Для очереди в БД позиция загрузки сохраняется сразу: загруженные номера
+        уже записаны в очередь """
+        try:
+            progress = await self.db_manager.get_ingest_progress(source=self.ingest_source())
+            indexed = await self.known_phones.load()
+            seen_phones = set()
+            async for chunk in self.csv_manager.iter_chunks(progress=progress):
+                await contacts.wait_for_space(CSV_MAX_QUEUE_SIZE)
+                if SHARD_COUNT > 1:
+                    chunk = [contact for contact in chunk if in_shard(contact.phone)]
+                new_contacts = await self.filter_new_contacts(chunk=chunk, indexed=indexed, seen_phones=seen_phones)
+                self.total_contacts += len(new_contacts)
+                await contacts.put_many(new_contacts)
+        except Exception as exc:
+            self.logger.error(self.sign + f'ERROR загрузки номеров из входного файла: {exc=}')
+            return False
+        finally:
+            contacts.close()
+        if contacts.persistent:
+            await self.save_ingest_progress(contacts=contacts)
+        return True
+
+    async def filter_new_contacts(self, chunk: list[ContactRecord], indexed: bool,
+                                  seen_phones: set) -> list[ContactRecord]:
+        """ Отсеивает номера ранее записанные в БД и номера уже загруженные в очередь из прошлых пачек файла:
+        с индексом номеров загруженные номера сразу добавляются в индекс, без него - в seen_phones """
+        if indexed:
+            new_contacts = self.known_phones.filter_new(chunk)
+            self.known_phones.add_many(contact.phone for contact in new_contacts)
+            return new_contacts
+
+        new_contacts = [contact for contact in await self.db_manager.check_contacts_in_all_tables(chunk)
+                        if contact.phone not in seen_phones]
+        seen_phones.update(contact.phone for contact in new_contacts)
+        return new_contacts
+
+    async def save_ingest_progress(self, contacts: ContactQueue) -> None:
+        """ Сохраняет позицию до которой входной файл загружен, только если все загруженные номера проверены
+        и результаты записаны в БД или номера сохранены в очереди в БД, иначе следующая загрузка прочитает файл
+        с прошлой сохранённой позиции """
+        if not contacts.persistent and (not contacts.exhausted or len(self.write_buffer)):
+            return
+        try:
+            await self.db_manager.save_ingest_progress(source=self.ingest_source(), **self.csv_manager.get_position())
+        except Exception as exc:
+            self.logger.error(self.sign + f'ERROR сохранения прогресса загрузки входного файла: {exc=}')
 
     async def start_tg_client(self, session_name: str, session_data: dict,
-                              client: TelegramClient, contacts: list, msg_text: str | None = None) -> None:
-        """ Подключение к сессии и старт проверки номеров телефонов на наличие Telegram контактов """
-
-        async with client:
-            signal.alarm(0)
-            await self.check_connect_session(client=client)
+                              client: TelegramClient, contacts: ContactQueue, msg_text: str | None = None) -> None:
+        """ Подключение к сессии и старт проверки номеров телефонов на наличие Telegram контактов,
+        номера проверяются пачками по CHECK_BATCH_SIZE с паузой адаптивного темпа сессии между запросами,
+        импортированные контакты удаляются одним запросом при завершении подключения """
 
+        async with self.connected(client):
             step = 0
-            while contacts:
-                contact = contacts[-1]
-                phone = contact.get('phone')
-                step += 1
-
-                phone_book = await self.session_files.get_session_phone_book(session_name)
-                if any((True for cont in phone_book if cont.get('phone') == phone)):
-                    self.logger.warning(
-                        self.sign + f'{step}. Номер: {phone} уже в телефонной книге, {len(phone_book)=}')
-                    contacts.pop(-1)
-                    continue
-
-                result, bad = await self.get_tg_contact(phone=phone, client=client)
-                contact.update(result)
-                contact.update({'session_name': session_name})
-
-                self.logger.debug(self.sign + f'{step}. {bad=} | {contact=} | {len(phone_book)=}')
-
-                if contact.get('check_result').startswith('ERROR'):
-                    contacts.pop(-1)
-                    contacts.insert(0, contact)
-                    self.logger.warning(self.sign + f'{phone=} | перемещён в начало списка')
-
-                    await self.session_files.update_key_session_json(
-                        session_name, key='quarantine_until', value=int(time.time()) + DEFAULT_QUARANTINE_TIME)
-                    self.logger.warning(self.sign + f'Сессия: {session_name} -> '
-                                                    f'помещена в карантин на {DEFAULT_QUARANTINE_TIME} сек.')
-                    break
-
-                await self.db_manager.get_or_create_contact(contact=contact, bad_contact=bad)
-                contacts.pop(-1)
-
-                if bad is False:
-                    self.added_contacts += 1
-                    len_phone_book = await self.session_files.update_key_session_json(session_name,
-                                                                                      value=contact)
-                    if len_phone_book >= MAX_CONTACTS:
+            batch = []
+            imported_users = []
+            phone_book = {int(phone) for cont in
+                          await self.session_files.get_session_phone_book(session_name, session_data)
+                          if str(phone := cont.get('phone')).lstrip('+').isdigit()}
+            try:
+                while True:
+                    batch_size = min(CHECK_BATCH_SIZE, MAX_REQUESTS - step, MAX_CONTACTS - len(phone_book))
+                    batch = await self.take_batch(contacts=contacts, phone_book=phone_book, batch_size=batch_size)
+                    if not batch:
                         break
 
-                if step == MAX_REQUESTS:
-                    break
-
-                await asyncio.sleep(randint(FROM, BEFORE))
+                    step += len(batch)
+                    phones = [str(contact.phone) for contact in batch]
+                    results = await self.get_tg_contacts(session_name=session_name, phones=phones, client=client,
+                                                         imported_users=imported_users)
+                    stop = await self.save_batch_results(session_name=session_name, batch=batch, results=results,
+                                                         contacts=contacts, phone_book=phone_book)
 
-    async def get_tg_contact(self, phone: str, client: TelegramClient) -> tuple[dict, bool]:
-        """ Проверка конкретного номера телефона на наличие Telegram контакта, получение данных контакта """
+                    if stop or step >= MAX_REQUESTS:
+                        break
 
-        bad = False
-        result = {
-            'check_result': '',
-            'user_id': 0,
-            'username': '',
-            'first_name': '',
-            'last_name': '',
-        }
+                    await self.pacing.wait(session_name)
+            finally:
+                for contact in reversed(batch):
+                    await contacts.put_back(contact)
+                await self.delete_imported_users(client=client, users=imported_users)
+
+    async def take_batch(self, contacts: ContactQueue, phone_book: set, batch_size: int) -> list[ContactRecord]:
+        """ Берёт из очереди до batch_size контактов, номера уже находящиеся в телефонной книге сессии пропускаются:
+        они уже проверены этой сессией и результат записан """
+        batch = []
+        while len(batch) < batch_size and (contact := await contacts.get()):
+            if (phone := contact.phone) in phone_book:
+                self.logger.warning(self.sign + f'Номер: {phone} уже в телефонной книге, {len(phone_book)=}')
+                await contacts.skip(contact)
+                continue
+            batch.append(contact)
+        return batch
+
+    async def save_batch_results(self, session_name: str, batch: list[ContactRecord],
+                                 results: list[tuple[dict, bool]], contacts: ContactQueue, phone_book: set) -> bool:
+        """ Записывает результаты проверки пачки, обработанные контакты удаляются из batch, найденные номера
+        добавляются в phone_book и одной записью в json файл сессии,
+        возвращает True если работу с сессией нужно завершить """
+        quarantine = False
+        new_entries = []
+        for result, bad in results:
+            contact = batch.pop(0)
+            contact.update(session_check=session_name, **result)
+            self.logger.debug(self.sign + f'{bad=} | {contact=}')
+
+            if contact.check_result.startswith('ERROR'):
+                await contacts.retry(contact)
+                self.logger.warning(self.sign + f'phone={contact.phone} | перемещён в конец очереди')
+                quarantine = True
+                continue
+
+            await self.write_buffer.add_contact(contact=contact, bad_contact=bad)
+
+            if bad is False:
+                self.added_contacts += 1
+                phone_book.add(contact.phone)
+                new_entries.append(contact.phone_book_entry())
+
+        stop = False
+        if new_entries:
+            len_phone_book = await self.session_files.extend_phone_book(session_name, entries=new_entries)
+            stop = len_phone_book >= MAX_CONTACTS
+
+        if quarantine:
+            quarantine_time = self.pacing.quarantine_time(session_name)
+            await self.session_files.update_key_session_json(
+                session_name, key='quarantine_until', value=int(time.time()) + quarantine_time)
+            self.logger.warning(self.sign + f'Сессия: {session_name} -> помещена в карантин на {quarantine_time} сек.')
+        return stop or quarantine
+
+    async def get_tg_contacts(self, session_name: str, phones: list[str], client: TelegramClient,
+                              imported_users: list) -> list[tuple[dict, bool]]:
+        """ Проверка пачки номеров телефонов одним запросом на наличие Telegram контактов, получение данных
+        контактов, результаты возвращаются в порядке phones, найденные пользователи добавляются в imported_users,
+        результат запроса учитывается в темпе сессии """
+        results = [({'check_result': '', 'user_id': 0, 'username': '', 'first_name': '', 'last_name': ''}, False)
+                   for _ in phones]
         try:
-            contact = InputPhoneContact(client_id=0, phone=phone, first_name="", last_name="")
-            contacts: ImportedContacts = await client(functions.contacts.ImportContactsRequest([contact]))
-
-            if not contacts.to_dict()['imported']:
-                result['check_result'] = 'phone_not_detected'
-                bad = True
-
+            input_contacts = [InputPhoneContact(client_id=client_id, phone=phone, first_name="", last_name="")
+                              for client_id, phone in enumerate(phones)]
+            request = functions.contacts.ImportContactsRequest(input_contacts)
+            with self.metrics.track_rpc('import_contacts'):
+                imported: ImportedContacts = await asyncio.wait_for(client(request), RPC_TIMEOUT)
+
+            users = {user.id: user for user in imported.users}
+            retry_contacts = set(imported.retry_contacts)
+            found = {contact.client_id: users.get(contact.user_id) for contact in imported.imported}
+            if retry_contacts:
+                # Telegram не импортировал часть номеров: превышен лимит импорта контактов сессии
+                self.pacing.on_error(session_name, flood=True)
             else:
-                result['check_result'] = 'Ok'
-                result['username'] = username = contacts.to_dict()['users'][0]['username']
-                result['first_name'] = contacts.to_dict()['users'][0]['first_name']
-                result['last_name'] = contacts.to_dict()['users'][0]['first_name']
-                result['user_id'] = user_id = contacts.to_dict()['users'][0]['id']
-
-                if not username:
-                    try:
-                        await client(functions.contacts.DeleteContactsRequest(id=[user_id]))
-                    except Exception as exc:
-                        self.logger.warning(self.sign + f'ERROR при удалении контакта: {exc=}')
+                self.pacing.on_success(session_name)
+            for client_id, (result, _) in enumerate(results):
+                if client_id in retry_contacts:
+                    result['check_result'] = 'ERROR получения контакта: превышен лимит импорта, повторить позже'
+                    results[client_id] = result, True
+                elif not (user := found.get(client_id)):
+                    result['check_result'] = 'phone_not_detected'
+                    results[client_id] = result, True
                 else:
-                    await client(functions.contacts.DeleteContactsRequest(id=[username]))
+                    result['check_result'] = 'Ok'
+                    result['username'] = user.username
+                    result['first_name'] = user.first_name
+                    result['last_name'] = user.last_name
+                    result['user_id'] = user.id
+                    imported_users.append(user)
 
         except Exception as exc:
-            result['check_result'] = check_result = f'ERROR получения контакта: {exc=}'
+            check_result = f'ERROR получения контакта: {exc=}'
+            self.pacing.on_error(session_name, exc)
             self.logger.warning(self.sign + f'{check_result=}')
-            bad = True
+            for result, _ in results:
+                result['check_result'] = check_result
+            results = [(result, True) for result, _ in results]
 
-        self.logger.debug(self.sign + f'{phone=} | {result=}')
-        return result, bad
+        self.logger.debug(self.sign + f'{phones=} | {results=}')
+        return results
+
+    async def delete_imported_users(self, client: TelegramClient, users: list) -> None:
+        """ Удаляет импортированные за подключение контакты из контактов сессии одним запросом """
+        if not users:
+            return
+        try:
+            with self.metrics.track_rpc('delete_contacts'):
+                await asyncio.wait_for(client(functions.contacts.DeleteContactsRequest(id=users)), RPC_TIMEOUT)
+        except Exception as exc:
+            self.logger.warning(self.sign + f'ERROR при удалении контактов: {len(users)=} | {exc=}')
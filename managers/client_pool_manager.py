@@ -0,0 +1,97 @@
+import asyncio
+import time
+
+from telethon import TelegramClient
+
+from config import CLIENT_POOL_SIZE, CLIENT_IDLE_TIMEOUT, CLIENT_HEALTH_CHECK_INTERVAL, CLIENT_HEALTH_CHECK_TIMEOUT
+from managers.base import BaseSingletonClass
+
+
+class ClientPoolManager(BaseSingletonClass):
+    """ Класс Singleton пула подключенных клиентов Telegram по имени сессии.
+        После работы с сессией клиент остаётся подключенным и при следующей выдаче сессии используется
+        без повторного подключения, пока сессия в пуле её аренда в БД сохраняется за процессом """
+
+    def __init__(self, **kwargs):
+        super().__init__()
+        self.session_files = kwargs.get('session_files_manager')
+        # свободные подключенные клиенты: {session_name: {'client': TelegramClient, 'used': float, 'checked': float}}
+        self.idle = {}
+        self.evict_task = None
+
+    def __len__(self) -> int:
+        return len(self.idle)
+
+    def is_pooled(self, session_name: str) -> bool:
+        """ Находится ли клиент сессии в пуле """
+        return session_name in self.idle
+
+    async def acquire(self, session_name: str) -> TelegramClient | None:
+        """ Возвращает подключенного клиента сессии из пула, если клиент давно не проверялся - проверяет
+        соединение запросом get_me, неработающий клиент отключается и возвращается None """
+        if not (entry := self.idle.pop(session_name, None)):
+            return None
+
+        client = entry['client']
+        if client.is_connected() and (time.monotonic() - entry['checked'] < CLIENT_HEALTH_CHECK_INTERVAL
+                                      or await self.health_check(client)):
+            self.logger.debug(self.sign + f'сессия: {session_name} | клиент из пула, без повторного подключения')
+            return client
+
+        self.logger.warning(self.sign + f'сессия: {session_name} | клиент из пула не прошёл проверку соединения')
+        await self.disconnect(session_name, client)
+        return None
+
+    async def release(self, session_name: str, client: TelegramClient, reusable: bool) -> None:
+        """ Возвращает клиента в пул если работа с ним завершилась без ошибок, иначе отключает,
+        при заполненном пуле отключается клиент дольше всех не использовавшийся """
+        if not reusable or not client.is_connected() or not CLIENT_POOL_SIZE:
+            await self.disconnect(session_name, client)
+            return
+
+        while len(self.idle) >= CLIENT_POOL_SIZE:
+            await self.evict(min(self.idle, key=lambda name: self.idle[name]['used']))
+
+        now = time.monotonic()
+        self.idle[session_name] = {'client': client, 'used': now, 'checked': now}
+        if not self.evict_task or self.evict_task.done():
+            self.evict_task = asyncio.create_task(self.evict_idle())
+
+    @staticmethod
+    async def health_check(client: TelegramClient) -> bool:
+        """ Проверяет что соединение клиента рабочее """
+        try:
+            return await asyncio.wait_for(client.get_me(), CLIENT_HEALTH_CHECK_TIMEOUT) is not None
+        except Exception:
+            return False
+
+    async def evict_idle(self) -> None:
+        """ Фоновая задача: отключает клиентов не использовавшихся CLIENT_IDLE_TIMEOUT сек. """
+        while self.idle:
+            await asyncio.sleep(min(CLIENT_IDLE_TIMEOUT, 10))
+            now = time.monotonic()
+            expired = [name for name, entry in self.idle.items() if now - entry['used'] > CLIENT_IDLE_TIMEOUT]
+            for session_name in expired:
+                await self.evict(session_name)
+
+    async def evict(self, session_name: str) -> None:
+        """ Отключает клиента из пула и освобождает аренду сессии """
+        if entry := self.idle.pop(session_name, None):
+            await self.disconnect(session_name, entry['client'])
+            await self.session_files.session_in_work_status(session_name=session_name, action='stop')
+
+    async def disconnect(self, session_name: str, client: TelegramClient) -> None:
+        """ Отключает клиента """
+        try:
+            await client.disconnect()
+        except Exception as exc:
+            self.logger.warning(self.sign + f'сессия: {session_name} | ERROR отключения клиента: {exc=}')
+
+    async def close_all(self) -> None:
+        """ Отключает всех клиентов пула при завершении работы, аренды освобождаются release_all_sessions """
+        if self.evict_task:
+            self.evict_task.cancel()
+            self.evict_task = None
+        idle, self.idle = self.idle, {}
+        for session_name, entry in idle.items():
+            await self.disconnect(session_name, entry['client'])
@@ -0,0 +1,124 @@
+import asyncio
+import time
+from collections import deque
+from typing import Any, Iterable
+
+from config import WORK_QUEUE_CLAIM_SIZE, WORK_QUEUE_CLAIM_TTL, WORK_QUEUE_REFRESH_INTERVAL
+
+
+class ContactQueue:
+    """ Очередь контактов для обработки сессиями, может пополняться по мере загрузки данных.
+        Контакт выдаётся методом get и в очереди больше не находится, пока его не вернут через retry/put_back """
+    # контакты хранятся вне процесса и не теряются при его завершении
+    persistent = False
+
+    def __init__(self, contacts: Iterable | None = None, closed: bool = True):
+        self.items = deque(contacts or [])
+        self.closed = closed
+
+    def __len__(self) -> int:
+        return len(self.items)
+
+    @property
+    def exhausted(self) -> bool:
+        """ Очередь пуста и пополнений больше не будет """
+        return self.closed and not self.items
+
+    def close(self) -> None:
+        """ Отмечает что пополнений очереди больше не будет """
+        self.closed = True
+
+    async def put_many(self, contacts: Iterable) -> None:
+        """ Пополняет очередь """
+        self.items.extend(contacts)
+
+    async def wait_for_space(self, max_size: int) -> None:
+        """ Ожидает пока в очереди останется меньше max_size контактов, ограничивает память при загрузке """
+        while len(self.items) >= max_size:
+            await asyncio.sleep(1)
+
+    async def get(self) -> Any | None:
+        """ Возвращает следующий контакт или None если очередь сейчас пуста """
+        return self.items.pop() if self.items else None
+
+    async def put_back(self, contact: Any) -> None:
+        """ Возвращает необработанный контакт в очередь, он будет выдан следующим """
+        self.items.append(contact)
+
+    async def retry(self, contact: Any) -> None:
+        """ Возвращает контакт в конец очереди для повторной обработки после остальных """
+        self.items.appendleft(contact)
+
+    async def skip(self, contact: Any) -> None:
+        """ Контакт выдан, но обрабатывать его не нужно """
+
+    async def refresh(self) -> None:
+        """ Обновляет состояние очереди перед проверкой наличия контактов """
+
+    async def release(self) -> None:
+        """ Освобождает контакты очереди при завершении работы """
+
+
+class DBWorkQueue(ContactQueue):
+    """ Очередь номеров на проверку в таблице БД work_queue, общая для процессов и серверов с одной БД.
+        Номера выдаются процессу пачками по WORK_QUEUE_CLAIM_SIZE и хранятся в памяти до выдачи воркерам,
+        номер отмечается проверенным при записи результата в БД, повторная проверка возвращает номер в БД """
+    persistent = True
+
+    def __init__(self, db_manager, owner: str):
+        super().__init__(closed=False)
+        self.db_manager = db_manager
+        self.owner = owner
+        self.counts = {'pending': 0, 'claimed': 0}
+        self.refreshed = 0
+        self.renewed = time.monotonic()
+
+    def __len__(self) -> int:
+        return len(self.items) + self.counts['pending']
+
+    @property
+    def exhausted(self) -> bool:
+        """ Загрузка завершена, в памяти и в БД нет ожидающих номеров и нет номеров в работе у других процессов """
+        return self.closed and not self.items and not self.counts['pending'] and not self.counts['claimed']
+
+    async def put_many(self, contacts: Iterable) -> None:
+        """ Добавляет номера в очередь в БД """
+        if contacts := list(contacts):
+            await self.db_manager.enqueue_work(contacts=contacts)
+            self.counts['pending'] += len(contacts)
+
+    async def wait_for_space(self, max_size: int) -> None:
+        """ Очередь хранится в БД, загрузка не ограничивается памятью """
+
+    async def get(self) -> Any | None:
+        """ Возвращает следующий номер, если номеров в памяти нет - получает очередную пачку из БД """
+        if not self.items:
+            self.items.extend(await self.db_manager.claim_work(
+                owner=self.owner, limit=WORK_QUEUE_CLAIM_SIZE, ttl=WORK_QUEUE_CLAIM_TTL))
+        return await super().get()
+
+    async def retry(self, contact: Any) -> None:
+        """ Возвращает номер в БД для повторной проверки любым процессом """
+        await self.db_manager.release_work(owner=self.owner, phones=[contact.phone])
+
+    async def skip(self, contact: Any) -> None:
+        """ Отмечает номер в БД проверенным, иначе выданный номер продлевается вместе с остальными
+        и очередь не исчерпывается """
+        await self.db_manager.complete_work(owner=self.owner, phones=[contact.phone])
+
+    async def refresh(self) -> None:
+        """ Не чаще раза в WORK_QUEUE_REFRESH_INTERVAL сек. обновляет количество номеров в БД,
+        продлевает выдачу номеров процесса каждые WORK_QUEUE_CLAIM_TTL / 3 сек. """
+        now = time.monotonic()
+        if now - self.renewed >= WORK_QUEUE_CLAIM_TTL / 3:
+            self.renewed = now
+            await self.db_manager.renew_work_claims(owner=self.owner, ttl=WORK_QUEUE_CLAIM_TTL)
+        if now - self.refreshed >= WORK_QUEUE_REFRESH_INTERVAL:
+            self.refreshed = now
+            self.counts = await self.db_manager.count_work()
+
+    async def release(self) -> None:
+        """ Возвращает в БД номера выданные процессу, но не переданные воркерам """
+        if self.items:
+            items, self.items = self.items, deque()
+            await self.db_manager.release_work(owner=self.owner, phones=[item.phone for item in items])
@@ -0,0 +1,52 @@
+from datetime import datetime
+
+
+class ContactRecord:
+    """ Контакт в памяти воркеров от загрузки до записи результата в БД.
+        Поля хранятся в __slots__ без словаря атрибутов, номер телефона - целым числом, в строки таблиц и модели
+        peewee контакт преобразуется только при записи в БД """
+    __slots__ = ('phone', 'promo_id', 'var_1', 'var_2', 'var_3', 'check_result', 'user_id', 'username',
+                 'first_name', 'last_name', 'date_check', 'session_check', 'date_last_send', 'session_last_send',
+                 'num_sends')
+
+    def __init__(self, phone: int, promo_id: str | None = None, var_1: str | None = None, var_2: str | None = None,
+                 var_3: str | None = None, check_result: str | None = None, user_id: int | None = None,
+                 username: str | None = None, first_name: str | None = None, last_name: str | None = None,
+                 date_check: datetime | None = None, session_check: str | None = None,
+                 date_last_send: datetime | None = None, session_last_send: str | None = None, num_sends: int = 0):
+        self.phone = phone
+        self.promo_id = promo_id
+        self.var_1 = var_1
+        self.var_2 = var_2
+        self.var_3 = var_3
+        self.check_result = check_result
+        self.user_id = user_id
+        self.username = username
+        self.first_name = first_name
+        self.last_name = last_name
+        self.date_check = date_check
+        self.session_check = session_check
+        self.date_last_send = date_last_send
+        self.session_last_send = session_last_send
+        self.num_sends = num_sends
+
+    def __repr__(self) -> str:
+        fields = ', '.join(f'{name}={value!r}' for name in self.__slots__
+                           if (value := getattr(self, name)) is not None)
+        return f'{self.__class__.__name__}({fields})'
+
+    def update(self, **fields) -> None:
+        """ Записывает значения полей """
+        for name, value in fields.items():
+            setattr(self, name, value)
+
+    def to_row(self, fields: tuple) -> dict:
+        """ Строка таблицы БД из значений полей fields """
+        return {name: getattr(self, name) for name in fields}
+
+    def phone_book_entry(self) -> dict:
+        """ Запись телефонной книги в json файле сессии """
+        return {'promo_id': self.promo_id, 'phone': str(self.phone), 'var_1': self.var_1, 'var_2': self.var_2,
+                'var_3': self.var_3, 'check_result': self.check_result, 'user_id': self.user_id,
+                'username': self.username, 'first_name': self.first_name, 'last_name': self.last_name,
+                'session_name': self.session_check}
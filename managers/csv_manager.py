@@ -1,37 +1,119 @@
+import asyncio
 import csv
+import hashlib
 import os.path
+from typing import AsyncIterator, BinaryIO, Iterator
 
 from managers.base import BaseSingletonClass
-from config import INPUT_CSV_FILE_PATH, INPUT_CSV_FILE_NAME
+from managers.contact_record import ContactRecord
+from config import INPUT_CSV_FILE_PATH, INPUT_CSV_FILE_NAME, CSV_CHUNK_SIZE, CSV_WAIT_FILE_INTERVAL
 
 
 class CSVManager(BaseSingletonClass):
-    """ Класс для вынесения логики получения данных из входящего .csv файла """
+    """ Класс для вынесения логики получения данных из входящего .csv файла.
+        При чтении запоминается позиция конца последней полной прочитанной строки и хэш содержимого файла до неё,
+        по ним следующая загрузка может прочитать только дописанную в конец файла часть """
+    file_path = INPUT_CSV_FILE_PATH
+    # размер блока чтения(байт) при проверке хэша начала файла
+    hash_block_size = 1024 * 1024
+
+    def __init__(self):
+        super().__init__()
+        self.offset = 0
+        self.lines = 0
+        self.prefix_hash = hashlib.sha256()
 
     async def __call__(self) -> list:
         result = []
-
-        while not (os.path.exists(INPUT_CSV_FILE_PATH) and os.path.isfile(INPUT_CSV_FILE_PATH)):
-            input(f'Не найден файл: {INPUT_CSV_FILE_NAME}, загрузите файл и нажмите Enter для продолжения: ')
-
-        with open(INPUT_CSV_FILE_PATH, newline='', encoding='utf-8') as file:
-            reader = csv.reader(file)
-            for num, row in enumerate(reader, 1):
-                row = [elem.replace("\uFEFF", "").strip('\n').strip() for elem in row]
-                try:
-                    contact = {
-                        'promo_id': row[0],
-                        'phone': row[1],
-                        'var_1': row[2],
-                        'var_2': row[3],
-                        'var_3': row[4],
-                    }
-                except Exception as exc:
-                    self.logger.warning(self.sign + f'Невалидная запись в строке: {num} | {row=} | {exc=}')
-                    continue
-                else:
-                    result.append(contact)
-
-        self.logger.debug(self.sign + f'загружено валидных строк: {len(result)} '
-                                      f'из {reader.line_num} строк файла {INPUT_CSV_FILE_NAME}')
+        async for chunk in self.iter_chunks():
+            result.extend(chunk)
         return result
+
+    async def wait_for_file(self) -> None:
+        """ Ожидает появления входного файла не блокируя цикл событий """
+        if not os.path.isfile(self.file_path):
+            self.logger.warning(self.sign + f'Не найден файл: {INPUT_CSV_FILE_NAME}, загрузите файл, '
+                                            f'проверка начнётся автоматически')
+        while not os.path.isfile(self.file_path):
+            await asyncio.sleep(CSV_WAIT_FILE_INTERVAL)
+
+    async def iter_chunks(self, chunk_size: int = CSV_CHUNK_SIZE,
+                          progress: dict | None = None) -> AsyncIterator[list[ContactRecord]]:
+        """ Построчно читает входной файл и отдаёт валидные контакты пачками по chunk_size,
+        в памяти одновременно находится не больше одной пачки. Если передан progress прошлой загрузки
+        (get_position) и начало файла до сохранённой позиции не изменилось, читается только дописанная часть.
+        Каждая пачка читается в отдельном потоке, чтобы чтение файла не блокировало цикл событий """
+        await self.wait_for_file()
+        await asyncio.to_thread(self.resume, progress)
+        skipped_lines = self.lines
+
+        valid = 0
+        with open(self.file_path, 'rb') as file:
+            file.seek(self.offset)
+            reader = csv.reader(self.iter_lines(file))
+            while chunk := await asyncio.to_thread(self.read_chunk, reader, chunk_size, skipped_lines):
+                valid += len(chunk)
+                yield chunk
+
+        self.logger.debug(self.sign + f'загружено валидных строк: {valid} '
+                                      f'из {reader.line_num} новых строк файла {INPUT_CSV_FILE_NAME}')
+
+    def read_chunk(self, reader: Iterator[list[str]], chunk_size: int, skipped_lines: int) -> list[ContactRecord]:
+        """ Читает из reader до chunk_size валидных контактов, пустой список - файл дочитан до конца """
+        chunk = []
+        for row in reader:
+            if contact := self.parse_row(skipped_lines + reader.line_num, row):
+                chunk.append(contact)
+                if len(chunk) >= chunk_size:
+                    break
+        return chunk
+
+    def iter_lines(self, file: BinaryIO) -> Iterator[str]:
+        """ Отдаёт строки файла для csv.reader, учитывая позицию и хэш только полных строк: последняя строка
+        без перевода строки может быть ещё не дописана и будет прочитана повторно при следующей загрузке """
+        for line in file:
+            if line.endswith(b'\n'):
+                self.offset += len(line)
+                self.lines += 1
+                self.prefix_hash.update(line)
+            yield line.decode('utf-8')
+
+    def get_position(self) -> dict:
+        """ Позиция конца последней полной прочитанной строки, хэш файла до неё и количество строк """
+        return {'offset': self.offset, 'prefix_hash': self.prefix_hash.hexdigest(), 'lines': self.lines}
+
+    def resume(self, progress: dict | None) -> None:
+        """ Устанавливает позицию начала чтения: сохранённую позицию прошлой загрузки, если файл не короче неё и
+        хэш начала файла совпадает с сохранённым, иначе начало файла. Выполняется в отдельном потоке """
+        self.offset, self.lines, self.prefix_hash = 0, 0, hashlib.sha256()
+        if not progress or not progress['offset']:
+            return
+
+        prefix_hash = hashlib.sha256()
+        if os.path.getsize(self.file_path) >= progress['offset']:
+            with open(self.file_path, 'rb') as file:
+                remaining = progress['offset']
+                while remaining and (block := file.read(min(self.hash_block_size, remaining))):
+                    prefix_hash.update(block)
+                    remaining -= len(block)
+
+        if prefix_hash.hexdigest() != progress['prefix_hash']:
+            self.logger.warning(self.sign + f'начало файла {INPUT_CSV_FILE_NAME} изменилось после прошлой загрузки, '
+                                            f'файл будет загружен полностью')
+            return
+
+        self.offset, self.lines, self.prefix_hash = progress['offset'], progress['lines'], prefix_hash
+        self.logger.info(self.sign + f'файл {INPUT_CSV_FILE_NAME} уже загружен до строки {self.lines}, '
+                                     f'загружается только дописанная часть')
+
+    def parse_row(self, num: int, row: list[str]) -> ContactRecord | None:
+        """ Возвращает контакт из строки файла или None если строка невалидна """
+        row = [elem.replace("\uFEFF", "").strip('\n').strip() for elem in row]
+        try:
+            if not row[1].lstrip('+').isdigit():
+                raise ValueError('номер телефона должен состоять из цифр')
+            contact = ContactRecord(phone=int(row[1]), promo_id=row[0], var_1=row[2], var_2=row[3], var_3=row[4])
+        except Exception as exc:
+            self.logger.warning(self.sign + f'Невалидная запись в строке: {num} | {row=} | {exc=}')
+            return None
+        return contact
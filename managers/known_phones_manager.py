@@ -0,0 +1,173 @@
+import asyncio
+import mmap
+import os
+import struct
+import time
+from bisect import bisect_left
+from datetime import datetime
+from typing import Iterable
+
+from config import KNOWN_PHONES_INDEX, KNOWN_PHONES_SNAPSHOT_PATH, KNOWN_PHONES_SNAPSHOT_MAX_AGE, \
+    KNOWN_PHONES_CATCH_UP_MARGIN, KNOWN_PHONES_MAX_DELTA, KNOWN_PHONES_PAGE_SIZE
+from managers.base import BaseSingletonClass
+from managers.contact_record import ContactRecord
+
+
+class KnownPhonesManager(BaseSingletonClass):
+    """ Класс Singleton индекса номеров уже записанных в таблицы contacts и bad_contacts.
+        Номера каждой таблицы хранятся в файле снимка отсортированными массивами int64 (8 байт на номер), файл
+        отображается в память через mmap и поиск номера идёт бинарным поиском без загрузки массива в память процесса.
+        Номера проверенные после создания снимка и записанные воркером во время работы хранятся в множестве delta """
+    # заголовок файла снимка: метка формата, количество номеров contacts и bad_contacts, время создания снимка
+    header = struct.Struct('<8sQQd')
+    magic = b'TCSPHONE'
+    tables = ('contacts', 'bad_contacts')
+
+    def __init__(self, **kwargs):
+        super().__init__()
+        self.db_manager = kwargs.get('db_manager')
+        self.file = None
+        self.mmap = None
+        # отсортированные номера таблиц из снимка
+        self.views = []
+        self.delta = set()
+        self.loaded = False
+
+    def __len__(self) -> int:
+        return sum(len(view) for view in self.views) + len(self.delta)
+
+    def __contains__(self, phone: int) -> bool:
+        if phone in self.delta:
+            return True
+        for view in self.views:
+            num = bisect_left(view, phone)
+            if num < len(view) and view[num] == phone:
+                return True
+        return False
+
+    async def load(self) -> bool:
+        """ Загружает индекс из файла снимка и дочитывает из БД номера проверенные после его создания,
+        снимок создаётся заново если его нет, он устарел или дочитано слишком много номеров.
+        Возвращает True если индекс загружен, иначе номера отсеиваются запросами к БД """
+        if not KNOWN_PHONES_INDEX:
+            return False
+        if self.loaded:
+            return True
+        started = time.perf_counter()
+        try:
+            if not (built_at := await asyncio.to_thread(self.open_snapshot)):
+                built_at = await self.build_snapshot()
+            self.delta = set(await self.db_manager.get_phones_checked_since(
+                since=datetime.fromtimestamp(built_at - KNOWN_PHONES_CATCH_UP_MARGIN)))
+            if len(self.delta) > KNOWN_PHONES_MAX_DELTA:
+                built_at = await self.build_snapshot()
+                self.delta = set(await self.db_manager.get_phones_checked_since(
+                    since=datetime.fromtimestamp(built_at - KNOWN_PHONES_CATCH_UP_MARGIN)))
+        except Exception as exc:
+            self.logger.error(self.sign + f'ERROR загрузки индекса номеров, номера будут проверяться '
+                                          f'запросами к БД: {exc=}')
+            self.close()
+            return False
+        self.loaded = True
+        self.logger.info(self.sign + f'индекс номеров загружен: {len(self)} номеров, из них после создания '
+                                     f'снимка: {len(self.delta)} | {time.perf_counter() - started:.2f} сек.')
+        return True
+
+    def open_snapshot(self) -> float | None:
+        """ Отображает файл снимка в память, возвращает время создания снимка или None если снимка нет,
+        он повреждён или старше KNOWN_PHONES_SNAPSHOT_MAX_AGE сек. """
+        self.close()
+        try:
+            file = open(KNOWN_PHONES_SNAPSHOT_PATH, 'rb')
+        except FileNotFoundError:
+            return None
+        try:
+            size = os.fstat(file.fileno()).st_size
+            magic, *counts, built_at = self.header.unpack(file.read(self.header.size))
+            if magic != self.magic or size != self.header.size + sum(counts) * 8 or \
+                    time.time() - built_at > KNOWN_PHONES_SNAPSHOT_MAX_AGE:
+                file.close()
+                return None
+        except (OSError, struct.error):
+            file.close()
+            return None
+
+        self.file = file
+        if sum(counts):
+            self.mmap = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+            phones = memoryview(self.mmap)[self.header.size:].cast('q')
+            self.views = [phones[:counts[0]], phones[counts[0]:]]
+        return built_at
+
+    async def build_snapshot(self) -> float:
+        """ Создаёт файл снимка постранично читая номера таблиц по возрастанию, в памяти держится только
+        одна страница, файл заменяется целиком. Возвращает время создания снимка """
+        started = time.perf_counter()
+        built_at = time.time()
+        tmp_path = f'{KNOWN_PHONES_SNAPSHOT_PATH}.{os.getpid()}.tmp'
+        counts = []
+        try:
+            with open(tmp_path, 'wb') as file:
+                file.write(bytes(self.header.size))
+                for table_name in self.tables:
+                    count, after_phone = 0, -1
+                    while page := await self.db_manager.get_known_phones_page(
+                            table_name=table_name, after_phone=after_phone, limit=KNOWN_PHONES_PAGE_SIZE):
+                        await asyncio.to_thread(page.tofile, file)
+                        count, after_phone = count + len(page), page[-1]
+                    counts.append(count)
+                file.seek(0)
+                file.write(self.header.pack(self.magic, *counts, built_at))
+            os.replace(tmp_path, KNOWN_PHONES_SNAPSHOT_PATH)
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+        self.logger.info(self.sign + f'создан снимок индекса номеров: contacts: {counts[0]}, '
+                                     f'bad_contacts: {counts[1]} | {time.perf_counter() - started:.2f} сек.')
+
+        if await asyncio.to_thread(self.open_snapshot) is None:
+            raise OSError(f'снимок индекса номеров не читается: {KNOWN_PHONES_SNAPSHOT_PATH}')
+        return built_at
+
+    def add_many(self, phones: Iterable[int]) -> None:
+        """ Добавляет в индекс номера записанные в БД или уже загруженные в очередь на проверку """
+        if self.loaded:
+            self.delta.update(phones)
+
+    def filter_new(self, contacts: list[ContactRecord]) -> list[ContactRecord]:
+        """ Возвращает контакты, номеров которых нет в индексе и которые не повторяются во входящем списке """
+        result_contacts = []
+        seen_phones = set()
+        invalid = known = 0
+        for contact in contacts:
+            try:
+                phone = int(contact.phone)
+            except (TypeError, ValueError):
+                invalid += 1
+                continue
+            if phone in seen_phones:
+                continue
+            seen_phones.add(phone)
+            if phone in self:
+                known += 1
+                continue
+            result_contacts.append(contact)
+
+        self.logger.debug(self.sign + f'Проверено по индексу: {len(contacts)} контактов, '
+                                      f'из них ранее записано в БД: {known}, '
+                                      f'повторов в списке: {len(contacts) - len(seen_phones) - invalid}, '
+                                      f'невалидных номеров: {invalid}, к дальнейшей обработке: {len(result_contacts)}')
+        return result_contacts
+
+    def close(self) -> None:
+        """ Закрывает файл снимка """
+        for view in self.views:
+            view.release()
+        self.views = []
+        if self.mmap:
+            self.mmap.close()
+            self.mmap = None
+        if self.file:
+            self.file.close()
+            self.file = None
+        self.loaded = False
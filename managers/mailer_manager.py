@@ -1,5 +1,4 @@
 import asyncio
-import signal
 import time
 from datetime import datetime
 
@@ -9,147 +8,212 @@ from telethon.tl.types import InputPhoneContact, InputPeerUser
 from telethon.tl.types.contacts import ImportedContacts
 
 from managers.base import BaseTelegramWorkers
-from config import MAX_CONTACTS, DEFAULT_QUARANTINE_TIME
+from managers.contact_queue import ContactQueue
+from managers.contact_record import ContactRecord
+from config import MAX_CONTACTS, MAILER_PAGE_SIZE, RPC_TIMEOUT, SEND_TIMEOUT
 
 
 class Mailer(BaseTelegramWorkers):
     """ Класс для рассылки сообщений по контактам из БД """
     stop_sending_time = 60 * 60
     # stop_sending_time = 60  # минуты для разработки
+    promo_id = None
+    send_interval_hours = None
 
     def __init__(self, **kwargs):
         super().__init__(**kwargs)
 
     async def __call__(self):
-        contacts = await self.input_data()
-        self.total_contacts = len(contacts)
-        await self.start_work_with_contacts(contacts=contacts)
-
-    async def input_data(self) -> list:
-        """ Ввод начальных данных и проверка их валидности """
-        contacts = []
-        input_time = ''
-
-        while not contacts:
-            promo_id = input('Введите promo_id: ').strip()
+        promo_id = await self.input_data()
+        await self.message_manager.prepare_template(promo_id)
+        contacts = ContactQueue(closed=False)
+        ingest_task = asyncio.create_task(self.ingest_contacts(contacts=contacts, promo_id=promo_id))
+        try:
+            await self.start_work_with_contacts(contacts=contacts)
+        finally:
+            ingest_task.cancel()
+
+    async def input_data(self) -> str:
+        """ Ввод начальных данных и проверка их валидности, если promo_id и send_interval_hours заданы заранее
+        (запуск через start_workers.py) ввод не запрашивается """
+        total_contacts = 0
+        input_time = str(self.send_interval_hours or '')
+
+        while not total_contacts:
+            promo_id = self.promo_id or input('Введите promo_id: ').strip()
             # promo_id = 'x_promo321'  # для разработки
 
-            contacts = await self.db_manager.get_contacts_from_promo_id(promo_id=promo_id)
-            if not contacts:
-                self.logger.warning(self.sign + f'контактов с {promo_id=} в БД не зарегистрировано')
+            total_contacts = await self.db_manager.count_campaign_contacts(promo_id=promo_id)
+            if not total_contacts:
+                self.logger.warning(self.sign + f'контактов с {promo_id=} ожидающих рассылки в БД не зарегистрировано')
+                if self.promo_id:
+                    break
                 await asyncio.sleep(1)
 
         while not input_time.isdigit() or not 24 > int(input_time) > 0:
             input_time = input('Введите кол-во часов между отправкой сообщений из одной сессии (от 1 до 24): ')
 
         self.stop_sending_time *= int(input_time)
-        return contacts
+        self.total_contacts = total_contacts
+        return promo_id
+
+    async def ingest_contacts(self, contacts: ContactQueue, promo_id: str) -> None:
+        """ Постранично читает из БД контакты promo_id ожидающие рассылки по возрастанию phone и пополняет очередь,
+        следующая страница читается когда в очереди остаётся меньше MAILER_PAGE_SIZE контактов """
+        after_phone = 0
+        try:
+            while True:
+                await contacts.wait_for_space(MAILER_PAGE_SIZE)
+                page = await self.db_manager.get_campaign_page(
+                    promo_id=promo_id, after_phone=after_phone, limit=MAILER_PAGE_SIZE)
+                if page:
+                    after_phone = page[-1].phone
+                    await contacts.put_many(page)
+                if len(page) < MAILER_PAGE_SIZE:
+                    break
+        except Exception as exc:
+            self.logger.error(self.sign + f'ERROR чтения контактов для рассылки из БД: {exc=}')
+        finally:
+            contacts.close()
 
     async def start_tg_client(self, session_name: str, session_data: dict,
-                              client: TelegramClient, contacts: list, msg_text: str | None = None) -> None:
+                              client: TelegramClient, contacts: ContactQueue, msg_text: str | None = None) -> None:
         """ Подключение к сессии и старт рассылки """
-        contact = contacts[-1]
-        text = await self.message_manager(contact)
-        phone_book = await self.session_files.get_session_phone_book(session_name, session_data)
+        if not (contact := await contacts.get()):
+            return
+        in_progress = contact
+        try:
+            text = await self.message_manager(contact)
+            phone_book = await self.session_files.get_session_phone_book(session_name, session_data)
+
+            async with self.connected(client):
+                if (sent := await self.send_to_contact(session_name=session_name, contact=contact, client=client,
+                                                       text=text, phone_book=phone_book)) is None:
+                    return
+
+                if sent is True:
+                    self.sent_messages += 1
+                    contact.date_last_send = datetime.now()
+                    contact.session_last_send = session_name
+                    contact.num_sends += 1
+                    await self.write_buffer.add_sent_contact(contact)
+
+                    await self.session_files.update_key_session_json(
+                        session_name, key='stop_sending', value=int(time.time()) + self.stop_sending_time)
+                    in_progress = None
+
+                elif sent is False:
+                    await contacts.retry(contact)
+                    in_progress = None
+                    await self.session_files.update_key_session_json(
+                        session_name, key='quarantine_until',
+                        value=int(time.time()) + self.pacing.quarantine_time(session_name))
+                else:
+                    self.logger.warning(self.sign + f"недостаточно данных для отправки сообщения {contact.user_id=}")
+
+                msg = self.sign + f'{sent=} | {contact.username=} | {contact.user_id=}'
+                self.logger.info(msg) if sent is True else self.logger.warning(msg)
+        finally:
+            if in_progress:
+                await contacts.put_back(in_progress)
+
+    async def send_to_contact(self, session_name: str, contact: ContactRecord, client: TelegramClient,
+                              text: str, phone_book: list) -> bool | str | None:
+        """ Отправляет сообщение контакту по username, а без него по user_id и access_hash полученным
+        импортом номера в сессию. Возвращает True если сообщение отправлено, False если сессию нужно
+        поместить в карантин, 'did_not_go' если данных для отправки недостаточно,
+        None если телефонная книга сессии заполнена и контакт нужно вернуть в очередь """
         sent = 'did_not_go'
+        if not contact.username:
+            if contact.session_check != session_name:
+                # TODO закоментирован блок проверки доступности сессии из которой контакт чекали
+                # if contact.session_check in await self.session_files.get_sessions():
+                    # if await self.all_checks_for_one_session(session_name=contact.session_check,
+                    #                                            mailing=True):
+                        # self.default_session_name = contact.session_check
+                        # закоментирована настройка следуещего подключения к выбранной сессии
+                    # else:
+                        # contacts.pop(-1)
+                        # contacts.insert(0, contact)
+                        # self.logger.warning(
+                        #     self.sign + f'{contact.phone=} -> перемещён в начало списка')
+                        # закоментировано перемещение контакта в начало списка если сессия из которой его
+                        # чекали ограничена в доступе
+                    # return
+                if len(phone_book) >= MAX_CONTACTS:
+                    return None
+
+            check_user_id, access_hash = await self.get_access_hash(
+                session_name=session_name, phone=str(contact.phone), client=client)
+            if check_user_id and access_hash:
+                contact.date_check = datetime.now()
+                contact.session_check = session_name
+
+                sent = await self.sender_from_user_id(session_name=session_name, user_id=check_user_id,
+                                                      access_hash=access_hash, client=client, text=text)
+                if sent is True:
+                    contact.user_id = check_user_id
+            elif self.pacing.is_flooded(session_name):
+                # сессия получила ограничение Telegram при импорте контакта
+                sent = False
+        else:
+            sent = await self.sender_from_username(
+                session_name=session_name, username=contact.username, client=client, text=text)
+        return sent
 
-        async with client:
-            signal.alarm(0)
-            await self.check_connect_session(client=client)
-
-            if not contact.username:
-                if contact.session_check != session_name:
-                    # TODO закоментирован блок проверки доступности сессии из которой контакт чекали
-                    # if contact.session_check in await self.session_files.get_sessions():
-                        # if await self.all_checks_for_one_session(session_name=contact.session_check, mailing=True):
-                            # self.default_session_name = contact.session_check
-                            # закоментирована настройка следуещего подключения к выбранной сессии
-                        # else:
-                            # contacts.pop(-1)
-                            # contacts.insert(0, contact)
-                            # self.logger.warning(
-                            #     self.sign + f'{contact.phone=} -> перемещён в начало списка')
-                            # закоментировано перемещение контакта в начало списка если сессия из которой его
-                            # чекали ограничена в доступе
-                        # return
-                    if len(phone_book) >= MAX_CONTACTS:
-                        return
-
-                check_user_id, access_hash = await self.get_access_hash(phone=str(contact.phone), client=client)
-                if check_user_id and access_hash:
-                    contact.date_check = datetime.now()
-                    contact.session_check = session_name
-
-                    sent = await self.sender_from_user_id(
-                            user_id=check_user_id, access_hash=access_hash, client=client, text=text)
-                    if sent is True:
-                        contact.user_id = check_user_id
-            else:
-                sent = await self.sender_from_username(username=contact.username, client=client, text=text)
-
-            if sent is True:
-                self.sent_messages += 1
-                contact.date_last_send = datetime.now()
-                contact.session_last_send = session_name
-                contact.num_sends += 1
-                contact.save()
-
-                await self.session_files.update_key_session_json(
-                    session_name, key='stop_sending', value=int(time.time()) + self.stop_sending_time)
-                contacts.pop(-1)
-
-            elif sent is False:
-                error_contact = contacts.pop(-1)
-                contacts.insert(0, error_contact)
-                await self.session_files.update_key_session_json(
-                    session_name, key='quarantine_until', value=int(time.time()) + DEFAULT_QUARANTINE_TIME)
-            else:
-                self.logger.warning(self.sign + f"недостаточно данных для отправки сообщения {contact.user_id=}")
-
-            msg = self.sign + f'{sent=} | {contact.username=} | {contact.user_id=}'
-            self.logger.info(msg) if sent is True else self.logger.warning(msg)
-
-    async def get_access_hash(self, phone: str, client: TelegramClient) -> tuple:
-        """ Возвращает user_id Telegram контакта и его access_hash в данной сессии  """
+    async def get_access_hash(self, session_name: str, phone: str, client: TelegramClient) -> tuple:
+        """ Возвращает user_id Telegram контакта и его access_hash в данной сессии, ошибка импорта контакта
+        учитывается в темпе сессии """
         user_id, access_hash = None, None
         try:
             contact = InputPhoneContact(client_id=0, phone=phone, first_name="", last_name="")
-            contacts: ImportedContacts = await client(functions.contacts.ImportContactsRequest([contact]))
+            request = functions.contacts.ImportContactsRequest([contact])
+            with self.metrics.track_rpc('import_contacts'):
+                contacts: ImportedContacts = await asyncio.wait_for(client(request), RPC_TIMEOUT)
+            self.pacing.on_success(session_name)
 
             if contacts.to_dict()['imported']:
                 user_id = contacts.to_dict()['users'][0]['id']
                 access_hash = contacts.to_dict()['users'][0]['access_hash']
 
                 try:
-                    await client(functions.contacts.DeleteContactsRequest(id=[user_id]))
+                    with self.metrics.track_rpc('delete_contacts'):
+                        await asyncio.wait_for(
+                            client(functions.contacts.DeleteContactsRequest(id=[user_id])), RPC_TIMEOUT)
                 except Exception as exc:
                     self.logger.warning(self.sign + f'ERROR при удалении контакта: {exc=}')
 
         except Exception as exc:
             self.logger.warning(self.sign + f'{exc=}')
+            self.pacing.on_error(session_name, exc)
 
         self.logger.debug(self.sign + f'{user_id=} | {access_hash=}')
         return user_id, access_hash
 
-    @classmethod
-    async def sender_from_user_id(cls, user_id, access_hash, client: TelegramClient, text: str) -> bool:
+    async def sender_from_user_id(self, session_name: str, user_id, access_hash, client: TelegramClient,
+                                  text: str) -> bool:
         """ Отправляет сообщение по user_id и access_hash """
         try:
             user = InputPeerUser(user_id=user_id, access_hash=access_hash)
-            await client.send_message(user, text, link_preview=False)
+            with self.metrics.track_rpc('send_message'):
+                await asyncio.wait_for(client.send_message(user, text, link_preview=False), SEND_TIMEOUT)
             sent = True
+            self.pacing.on_success(session_name)
         except Exception as exc:
-            cls.logger.warning(f'ERROR: {exc=}')
+            self.logger.warning(f'ERROR: {exc=}')
+            self.pacing.on_error(session_name, exc)
             sent = False
         return sent
 
-    @classmethod
-    async def sender_from_username(cls, username: str, client: TelegramClient, text: str) -> bool:
+    async def sender_from_username(self, session_name: str, username: str, client: TelegramClient, text: str) -> bool:
         """ Отправляет сообщение по username """
         try:
-            await client.send_message(username, text, link_preview=False)
+            with self.metrics.track_rpc('send_message'):
+                await asyncio.wait_for(client.send_message(username, text, link_preview=False), SEND_TIMEOUT)
             sent = True
+            self.pacing.on_success(session_name)
         except Exception as exc:
-            cls.logger.warning(f'ERROR: {exc=}')
+            self.logger.warning(f'ERROR: {exc=}')
+            self.pacing.on_error(session_name, exc)
             sent = False
         return sent
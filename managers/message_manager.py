@@ -1,33 +1,113 @@
 import os
+import string
+import time
 from datetime import datetime
 
 from managers.base import BaseSingletonClass
-from config import INPUT_FILES_DIR
+from config import INPUT_FILES_DIR, TEMPLATE_CHECK_INTERVAL
 from database.db_utils import Contact
+from managers.contact_record import ContactRecord
 
 
 class MessageManager(BaseSingletonClass):
-    """ Класс работы с текстами сообщений и переменными контакта из БД """
+    """ Класс работы с текстами сообщений и переменными контакта из БД.
+        Шаблон текста promo_id разбирается один раз и хранится в кэше до изменения файла """
+    # кэш разобранных шаблонов: {promo_id: {'stat': (st_mtime_ns, st_size) | None, 'checked': float, 'parts': list}}
+    templates = {}
+    formatter = string.Formatter()
+    placeholders = ('var_1', 'var_2', 'var_3', 'var_4')
 
-    async def __call__(self, contact: Contact) -> str:
+    async def __call__(self, contact: ContactRecord | Contact) -> str:
         return await self.get_message_text(contact=contact)
 
-    @staticmethod
-    async def get_message_text(contact: Contact) -> str | None:
-        """ Считывает данные из файла с именем promo_id контакта подставляет значения переменных и возвращает текст """
+    @classmethod
+    async def get_message_text(cls, contact: ContactRecord | Contact) -> str | None:
+        """ Подставляет значения переменных контакта в разобранный шаблон promo_id контакта и возвращает текст """
+        if not contact.promo_id or (parts := cls.get_template(contact.promo_id)) is None:
+            return None
 
-        promo_id = contact.promo_id
-        var_1 = contact.var_1
-        var_2 = contact.var_2
-        var_3 = contact.var_3
+        values = {
+            'var_1': contact.var_1,
+            'var_2': contact.var_2,
+            'var_3': contact.var_3,
+            'var_4': datetime.strftime(datetime.now(), '%d.%m.%Y %H:%M:%S'),
+        }
+        return cls.render(parts, values)
 
-        promo_id_text_path = f'{INPUT_FILES_DIR}/{promo_id}.txt'
-        text = None
-        if promo_id and (os.path.exists(promo_id_text_path) and os.path.isfile(promo_id_text_path)):
-            with open(promo_id_text_path, 'r', encoding='utf-8') as file:
-                data = file.read()
+    @classmethod
+    async def prepare_template(cls, promo_id: str) -> bool:
+        """ Загружает шаблон promo_id до начала рассылки, чтобы ошибки шаблона были видны сразу,
+        возвращает True если шаблон найден """
+        if (parts := cls.get_template(promo_id)) is None:
+            cls.logger.warning(cls.sign + f'шаблон сообщения {promo_id}.txt не найден или не прочитан')
+        return parts is not None
 
-            text = data.format(var_1=var_1, var_2=var_2, var_3=var_3,
-                               var_4=datetime.strftime(datetime.now(), '%d.%m.%Y %H:%M:%S'))
+    @classmethod
+    def get_template(cls, promo_id: str) -> list | None:
+        """ Возвращает разобранный шаблон из кэша, изменение файла проверяется
+        не чаще раза в TEMPLATE_CHECK_INTERVAL сек. """
+        now = time.monotonic()
+        entry = cls.templates.get(promo_id)
+        if entry and now - entry['checked'] < TEMPLATE_CHECK_INTERVAL:
+            return entry['parts']
 
-        return text
+        path = os.path.join(INPUT_FILES_DIR, f'{promo_id}.txt')
+        try:
+            file_stat = os.stat(path)
+            stat = (file_stat.st_mtime_ns, file_stat.st_size)
+        except OSError:
+            stat = None
+
+        if not entry or entry['stat'] != stat:
+            entry = {'stat': stat, 'parts': cls.load_template(promo_id, path) if stat else None}
+            cls.templates[promo_id] = entry
+        entry['checked'] = now
+        return entry['parts']
+
+    @classmethod
+    def load_template(cls, promo_id: str, path: str) -> list | None:
+        """ Читает и разбирает шаблон на части (текст, переменная, формат, преобразование), неизвестные
+        переменные сообщаются один раз при загрузке и остаются в тексте без подстановки """
+        try:
+            with open(path, 'r', encoding='utf-8') as file:
+                parsed = list(cls.formatter.parse(file.read()))
+        except (OSError, ValueError) as exc:
+            cls.logger.error(cls.sign + f'ERROR шаблона сообщения {promo_id}.txt: {exc=}')
+            return None
+
+        parts = []
+        unknown = set()
+        literal = ''
+        for text, field, format_spec, conversion in parsed:
+            literal += text
+            if field is None:
+                continue
+            if field.split('.')[0].split('[')[0] not in cls.placeholders:
+                unknown.add(field)
+                literal += '{' + field + (f'!{conversion}' if conversion else '') + \
+                           (f':{format_spec}' if format_spec else '') + '}'
+                continue
+            parts.append((literal, field, format_spec, conversion))
+            literal = ''
+        if literal:
+            parts.append((literal, None, '', None))
+
+        if unknown:
+            cls.logger.warning(cls.sign + f'шаблон сообщения {promo_id}.txt: неизвестные переменные {sorted(unknown)} '
+                                          f'останутся в тексте без подстановки, доступны: {cls.placeholders}')
+        cls.logger.debug(cls.sign + f'шаблон сообщения {promo_id}.txt загружен, частей: {len(parts)}')
+        return parts
+
+    @classmethod
+    def render(cls, parts: list, values: dict) -> str:
+        """ Собирает текст из разобранного шаблона без повторного разбора строки """
+        chunks = []
+        for literal, field, format_spec, conversion in parts:
+            chunks.append(literal)
+            if field is None:
+                continue
+            value = values[field] if field in values else cls.formatter.get_field(field, (), values)[0]
+            if conversion:
+                value = cls.formatter.convert_field(value, conversion)
+            chunks.append(format(value, format_spec))
+        return ''.join(chunks)
@@ -0,0 +1,180 @@
+import asyncio
+import contextlib
+import os
+import time
+from collections import defaultdict
+from typing import Callable
+
+from telethon.errors import FloodWaitError
+
+from config import METRICS_HOST, METRICS_PORT, METRICS_SNAPSHOT_PATH, METRICS_SNAPSHOT_INTERVAL
+from managers.base import BaseSingletonClass, current_session
+
+
+class MetricsManager(BaseSingletonClass):
+    """ Класс Singleton метрик сервиса в текстовом формате Prometheus.
+        Счётчики и гистограммы обновляются в момент события, значения gauge вычисляются функциями при чтении,
+        метрики отдаются по HTTP на METRICS_PORT и записываются в файл METRICS_SNAPSHOT_PATH """
+    # границы корзин гистограмм времени, сек.
+    buckets = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+    descriptions = {
+        'tcs_rpc_duration_seconds': 'Время запросов к Telegram по методам',
+        'tcs_session_requests_total': 'Результаты запросов Telegram по сессиям: success, error, flood_wait, cancelled',
+        'tcs_db_flush_duration_seconds': 'Время записи буфера результатов в БД',
+        'tcs_db_flush_rows_total': 'Записано строк из буфера результатов в БД',
+        'tcs_queue_depth': 'Контактов в очереди воркера',
+        'tcs_sessions': 'Сессий по состояниям',
+        'tcs_worker_contacts': 'Счётчики воркера',
+        'tcs_write_buffer_size': 'Записей в буфере ожидающих записи в БД',
+        'tcs_client_pool_size': 'Подключенных клиентов в пуле',
+    }
+
+    def __init__(self, **kwargs):
+        super().__init__()
+        # {(name, labels): value}, labels - кортеж пар (label, value)
+        self.counters = defaultdict(float)
+        # {(name, labels): [количество в корзинах buckets..., сумма, количество]}
+        self.histograms = {}
+        # {(name, labels): функция возвращающая текущее значение}
+        self.gauges = {}
+        self.server = None
+        self.snapshot_task = None
+
+    @staticmethod
+    def labels(**labels) -> tuple:
+        return tuple(sorted(labels.items()))
+
+    def inc(self, name: str, value: float = 1, **labels) -> None:
+        """ Увеличивает счётчик """
+        self.counters[(name, self.labels(**labels))] += value
+
+    def observe(self, name: str, value: float, **labels) -> None:
+        """ Добавляет значение в гистограмму """
+        key = (name, self.labels(**labels))
+        if not (histogram := self.histograms.get(key)):
+            histogram = self.histograms[key] = [0] * len(self.buckets) + [0.0, 0]
+        for num, bound in enumerate(self.buckets):
+            if value <= bound:
+                histogram[num] += 1
+        histogram[-2] += value
+        histogram[-1] += 1
+
+    def gauge(self, name: str, callback: Callable[[], float], **labels) -> None:
+        """ Регистрирует значение вычисляемое функцией callback при каждом чтении метрик """
+        self.gauges[(name, self.labels(**labels))] = callback
+
+    @contextlib.contextmanager
+    def track_rpc(self, method: str):
+        """ Замеряет время запроса к Telegram и учитывает его результат для сессии текущего воркера,
+        время отменённых запросов не учитывается, исключение запроса не перехватывается """
+        started = time.perf_counter()
+        result = 'success'
+        try:
+            yield
+        except FloodWaitError:
+            result = 'flood_wait'
+            raise
+        except Exception:
+            result = 'error'
+            raise
+        except BaseException:
+            # запрос отменён при завершении работы или отмене воркера
+            result = 'cancelled'
+            raise
+        finally:
+            if result != 'cancelled':
+                self.observe('tcs_rpc_duration_seconds', time.perf_counter() - started, method=method)
+            self.inc('tcs_session_requests_total', session=current_session.get(), result=result)
+
+    @staticmethod
+    def format_labels(labels: tuple, **extra) -> str:
+        labels = labels + tuple(extra.items())
+        if not labels:
+            return ''
+        escaped = (str(value).replace('\\', r'\\').replace('"', r'\"').replace('\n', r'\n') for _, value in labels)
+        return '{' + ','.join(f'{label}="{value}"' for (label, _), value in zip(labels, escaped)) + '}'
+
+    def render(self) -> str:
+        """ Текущие значения всех метрик в текстовом формате Prometheus """
+        metrics = defaultdict(list)
+        types = {}
+        for (name, labels), value in list(self.counters.items()):
+            types[name] = 'counter'
+            metrics[name].append(f'{name}{self.format_labels(labels)} {value:g}')
+
+        for (name, labels), histogram in list(self.histograms.items()):
+            types[name] = 'histogram'
+            for bound, count in zip(self.buckets, histogram):
+                metrics[name].append(f'{name}_bucket{self.format_labels(labels, le=f"{bound:g}")} {count}')
+            metrics[name].append(f'{name}_bucket{self.format_labels(labels, le="+Inf")} {histogram[-1]}')
+            metrics[name].append(f'{name}_sum{self.format_labels(labels)} {histogram[-2]:.6f}')
+            metrics[name].append(f'{name}_count{self.format_labels(labels)} {histogram[-1]}')
+
+        for (name, labels), callback in list(self.gauges.items()):
+            try:
+                value = callback()
+            except Exception as exc:
+                self.logger.debug(self.sign + f'ERROR значения {name}: {exc=}')
+                continue
+            types[name] = 'gauge'
+            metrics[name].append(f'{name}{self.format_labels(labels)} {value:g}')
+
+        lines = []
+        for name in sorted(metrics):
+            if description := self.descriptions.get(name):
+                lines.append(f'# HELP {name} {description}')
+            lines.append(f'# TYPE {name} {types[name]}')
+            lines.extend(metrics[name])
+        return '\n'.join(lines) + '\n'
+
+    async def handle_http(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        """ Отвечает метриками на любой HTTP запрос """
+        try:
+            await asyncio.wait_for(reader.readuntil(b'\r\n\r\n'), 5)
+            body = self.render().encode()
+            writer.write(b'HTTP/1.1 200 OK\r\nContent-Type: text/plain; version=0.0.4; charset=utf-8\r\n'
+                         + f'Content-Length: {len(body)}\r\nConnection: close\r\n\r\n'.encode() + body)
+            await writer.drain()
+        except (asyncio.TimeoutError, asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            writer.close()
+
+    def write_snapshot(self) -> None:
+        """ Записывает метрики в файл снимка, файл заменяется целиком """
+        tmp_path = f'{METRICS_SNAPSHOT_PATH}.tmp'
+        try:
+            with open(tmp_path, 'w', encoding='utf-8') as file:
+                file.write(self.render())
+            os.replace(tmp_path, METRICS_SNAPSHOT_PATH)
+        except OSError as exc:
+            self.logger.warning(self.sign + f'ERROR записи снимка метрик: {exc=}')
+
+    async def periodic_snapshot(self) -> None:
+        """ Фоновая задача: записывает снимок метрик каждые METRICS_SNAPSHOT_INTERVAL сек. """
+        while True:
+            await asyncio.sleep(METRICS_SNAPSHOT_INTERVAL)
+            self.write_snapshot()
+
+    async def start(self) -> None:
+        """ Запускает HTTP сервер метрик если задан METRICS_PORT и запись снимков если задан интервал """
+        if METRICS_PORT and not self.server:
+            try:
+                self.server = await asyncio.start_server(self.handle_http, METRICS_HOST, METRICS_PORT)
+                self.logger.info(self.sign + f'метрики доступны: http://{METRICS_HOST}:{METRICS_PORT}/metrics')
+            except OSError as exc:
+                self.logger.warning(self.sign + f'ERROR запуска HTTP сервера метрик: {exc=}')
+        if METRICS_SNAPSHOT_INTERVAL and (not self.snapshot_task or self.snapshot_task.done()):
+            self.snapshot_task = asyncio.create_task(self.periodic_snapshot())
+
+    async def stop(self) -> None:
+        """ Останавливает HTTP сервер и запись снимков, записывает итоговый снимок """
+        if self.server:
+            self.server.close()
+            await self.server.wait_closed()
+            self.server = None
+        if self.snapshot_task:
+            self.snapshot_task.cancel()
+            self.snapshot_task = None
+        if METRICS_SNAPSHOT_INTERVAL:
+            self.write_snapshot()
@@ -0,0 +1,77 @@
+import asyncio
+import random
+from collections import deque
+
+from telethon.errors import FloodError, PeerFloodError
+
+from config import FROM, DEFAULT_QUARANTINE_TIME, PACING_INITIAL_DELAY, PACING_MAX_DELAY, PACING_DECREASE_STEP, \
+    PACING_BACKOFF_FACTOR, PACING_JITTER, PACING_HISTORY_SIZE, PACING_MAX_ERROR_RATE, PACING_FLOOD_MARGIN, \
+    PEER_FLOOD_QUARANTINE_TIME, PACING_ERROR_QUARANTINE
+from managers.base import BaseSingletonClass
+
+
+class PacingManager(BaseSingletonClass):
+    """ Класс Singleton адаптивного темпа запросов каждой сессии.
+        Задержка между запросами сессии уменьшается понемногу после успешных запросов и кратно растёт после ошибок,
+        время карантина берётся из ошибки FloodWait, а для остальных ошибок зависит от количества ошибок подряд """
+
+    def __init__(self, **kwargs):
+        super().__init__()
+        # состояние сессий: {session_name: {'delay': float, 'history': deque[bool], 'errors_in_row': int,
+        #                                   'quarantine': int, 'flood': bool}}
+        self.sessions = {}
+
+    def get_state(self, session_name: str) -> dict:
+        if not (state := self.sessions.get(session_name)):
+            state = self.sessions[session_name] = {
+                'delay': PACING_INITIAL_DELAY, 'history': deque(maxlen=PACING_HISTORY_SIZE),
+                'errors_in_row': 0, 'quarantine': DEFAULT_QUARANTINE_TIME, 'flood': False}
+        return state
+
+    def get_delay(self, session_name: str) -> float:
+        """ Текущая задержка(сек.) перед следующим запросом сессии со случайным разбросом """
+        delay = self.get_state(session_name)['delay']
+        return max(0.0, delay * (1 + random.uniform(-PACING_JITTER, PACING_JITTER)))
+
+    async def wait(self, session_name: str) -> None:
+        """ Пауза между запросами сессии """
+        await asyncio.sleep(self.get_delay(session_name))
+
+    def on_success(self, session_name: str) -> None:
+        """ Успешный запрос: задержка уменьшается, если ошибок среди последних запросов немного """
+        state = self.get_state(session_name)
+        state['history'].append(False)
+        state['errors_in_row'] = 0
+        state['flood'] = False
+        if sum(state['history']) <= PACING_MAX_ERROR_RATE * len(state['history']):
+            state['delay'] = max(FROM, state['delay'] - PACING_DECREASE_STEP)
+
+    def on_error(self, session_name: str, exc: Exception | None = None, flood: bool = False) -> int:
+        """ Ошибка запроса: задержка увеличивается, возвращает время карантина(сек.) сессии,
+        которое также доступно через quarantine_time. flood - запрос выполнен, но Telegram сообщил об ограничении
+        без исключения и времени ожидания (лимит импорта контактов), карантин как при PeerFlood """
+        state = self.get_state(session_name)
+        state['history'].append(True)
+        state['errors_in_row'] += 1
+        state['delay'] = min(PACING_MAX_DELAY, max(FROM, state['delay']) * PACING_BACKOFF_FACTOR)
+
+        if isinstance(exc, FloodError) and isinstance(seconds := getattr(exc, 'seconds', None), int):
+            quarantine, state['flood'] = seconds + PACING_FLOOD_MARGIN, True
+        elif isinstance(exc, PeerFloodError) or flood:
+            quarantine, state['flood'] = PEER_FLOOD_QUARANTINE_TIME, True
+        else:
+            quarantine = min(DEFAULT_QUARANTINE_TIME, PACING_ERROR_QUARANTINE * 2 ** (state['errors_in_row'] - 1))
+            state['flood'] = False
+
+        state['quarantine'] = quarantine
+        self.logger.debug(self.sign + f'сессия: {session_name} | {exc=} | {flood=} | карантин: {quarantine} сек. | '
+                                      f'задержка: {state["delay"]:.2f} сек.')
+        return quarantine
+
+    def quarantine_time(self, session_name: str) -> int:
+        """ Время карантина(сек.) по последней ошибке сессии """
+        return self.get_state(session_name)['quarantine']
+
+    def is_flooded(self, session_name: str) -> bool:
+        """ Последний запрос сессии завершился ограничением Telegram: FloodWait, PeerFlood или лимит импорта """
+        return self.get_state(session_name)['flood']
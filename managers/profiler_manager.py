@@ -0,0 +1,178 @@
+import asyncio
+import functools
+import inspect
+import os
+import sys
+import threading
+import time
+import traceback
+from collections import Counter, defaultdict
+from typing import Callable
+
+from config import PROFILING, LOOP_LAG_THRESHOLD, LOOP_LAG_SAMPLE_INTERVAL, PROFILE_REPORT_DIR, SHARD_INDEX
+from managers.base import BaseSingletonClass
+
+
+class ProfilerManager(BaseSingletonClass):
+    """ Класс Singleton профилирования работы воркеров, включается переменной окружения PROFILING.
+        Методы этапов (файлы сессий, БД, прокси, запросы к Telegram, шаблоны сообщений) оборачиваются замером
+        времени, фоновый поток следит за задержкой цикла событий и сохраняет стеки вызовов, которые блокируют
+        цикл дольше LOOP_LAG_THRESHOLD сек., по завершении работы воркера отчёт записывается в PROFILE_REPORT_DIR """
+    # методы этапов: {этап: (атрибут менеджера в воркере, имена методов)}, None - методы самого воркера
+    stages = {
+        'session_files': ('session_files', ('refresh_registry', 'load_session_entry', 'get_session_data',
+                                            'write_session_data', 'update_key_session_json', 'extend_phone_book',
+                                            'move_session_to_bad_sessions', 'session_in_work_status')),
+        'proxy': ('proxy_manager', ('get_proxy', 'probe')),
+        'telegram': (None, ('connect_tg_client', 'get_tg_contacts', 'delete_imported_users', 'get_access_hash',
+                            'sender_from_user_id', 'sender_from_username')),
+        'template': ('message_manager', ('get_message_text', 'render')),
+        'write_buffer': ('write_buffer', ('flush',)),
+    }
+    # количество кадров стека блокировки в отчёте
+    stack_depth = 12
+
+    def __init__(self, **kwargs):
+        super().__init__()
+        self.instrumented = set()
+        # {span: [длительности вызовов, сек.]}, обёртки пишут в список по ссылке, он очищается перед каждым запуском
+        self.durations = defaultdict(list)
+        # блокировки цикла событий: количество, суммарное и максимальное время, выборки стека {стек: количество}
+        self.stalls = 0
+        self.stalled_time = 0.0
+        self.max_stall = 0.0
+        self.stall_samples = Counter()
+        self.beat = None
+        self.heartbeat_task = None
+        self.watchdog = None
+        self.watchdog_stop = threading.Event()
+        self.loop_thread_id = None
+        self.started = None
+        self.worker_name = None
+
+    def instrument(self, obj, names: tuple, stage: str) -> None:
+        """ Заменяет методы объекта обёртками замеряющими время вызова, для синглтонов обёртка ставится
+        на класс, чтобы замерялись и вызовы через cls внутри classmethod """
+        for name in names:
+            if (id(obj), name) in self.instrumented or not callable(method := getattr(obj, name, None)):
+                continue
+            self.instrumented.add((id(obj), name))
+            wrapped = self.span(method, f'{stage}.{name}')
+            if name in vars(obj):
+                setattr(obj, name, wrapped)
+            else:
+                setattr(type(obj), name, staticmethod(wrapped))
+
+    def span(self, method: Callable, span: str) -> Callable:
+        """ Обёртка замеряющая время вызова синхронного или асинхронного метода """
+        durations = self.durations[span]
+
+        if inspect.iscoroutinefunction(method):
+            @functools.wraps(method)
+            async def timed(*args, **kwargs):
+                started = time.perf_counter()
+                try:
+                    return await method(*args, **kwargs)
+                finally:
+                    durations.append(time.perf_counter() - started)
+        else:
+            @functools.wraps(method)
+            def timed(*args, **kwargs):
+                started = time.perf_counter()
+                try:
+                    return method(*args, **kwargs)
+                finally:
+                    durations.append(time.perf_counter() - started)
+        return timed
+
+    def instrument_worker(self, worker) -> None:
+        """ Оборачивает замерами методы этапов воркера и используемых им менеджеров, методы БД - все публичные """
+        for stage, (attr, names) in self.stages.items():
+            self.instrument(getattr(worker, attr) if attr else worker, names, stage)
+        db_methods = tuple(name for name, method in inspect.getmembers(type(worker.db_manager))
+                           if not name.startswith('_') and inspect.iscoroutinefunction(method))
+        self.instrument(worker.db_manager, db_methods, 'db')
+
+    async def start(self, worker) -> None:
+        """ Включает замеры этапов и наблюдение за циклом событий если задан PROFILING """
+        if not PROFILING or self.heartbeat_task:
+            return
+        self.instrument_worker(worker)
+        for values in self.durations.values():
+            values.clear()
+        self.stalls, self.stalled_time, self.max_stall = 0, 0.0, 0.0
+        self.stall_samples.clear()
+        self.worker_name = worker.__class__.__name__
+        self.started = time.perf_counter()
+        self.loop_thread_id = threading.get_ident()
+        self.beat = time.monotonic()
+        self.heartbeat_task = asyncio.create_task(self.heartbeat())
+        self.watchdog_stop.clear()
+        self.watchdog = threading.Thread(target=self.watch, name='loop-watchdog', daemon=True)
+        self.watchdog.start()
+        self.logger.info(self.sign + f'профилирование {self.worker_name} включено')
+
+    async def heartbeat(self) -> None:
+        """ Фоновая задача: отмечает время каждого пробуждения, задержка пробуждения сверх интервала -
+        время, в течение которого цикл событий был занят другим кодом """
+        while True:
+            self.beat = time.monotonic()
+            await asyncio.sleep(LOOP_LAG_SAMPLE_INTERVAL)
+            if (lag := time.monotonic() - self.beat - LOOP_LAG_SAMPLE_INTERVAL) > LOOP_LAG_THRESHOLD:
+                self.stalls += 1
+                self.stalled_time += lag
+                self.max_stall = max(self.max_stall, lag)
+
+    def watch(self) -> None:
+        """ Поток наблюдения: пока цикл событий не пробуждается дольше LOOP_LAG_THRESHOLD сек., каждые
+        LOOP_LAG_SAMPLE_INTERVAL сек. сохраняет стек вызовов потока цикла событий """
+        while not self.watchdog_stop.wait(LOOP_LAG_SAMPLE_INTERVAL):
+            if time.monotonic() - self.beat - LOOP_LAG_SAMPLE_INTERVAL <= LOOP_LAG_THRESHOLD:
+                continue
+            if frame := sys._current_frames().get(self.loop_thread_id):
+                stack = traceback.extract_stack(frame)
+                # стек начиная с выполняемого циклом событий callback, без кадров самого цикла
+                starts = [num for num, item in enumerate(stack) if item.name == '_run' and
+                          item.filename.endswith(f'asyncio{os.sep}events.py')]
+                stack = stack[starts[-1] + 1 if starts else 0:][-self.stack_depth:]
+                self.stall_samples[tuple(f'{item.filename}:{item.lineno} {item.name}' for item in stack)] += 1
+
+    async def stop(self) -> None:
+        """ Останавливает наблюдение и записывает отчёт """
+        if not self.heartbeat_task:
+            return
+        self.heartbeat_task.cancel()
+        self.heartbeat_task = None
+        self.watchdog_stop.set()
+        self.watchdog.join()
+        path = os.path.join(PROFILE_REPORT_DIR, f'profile_{self.worker_name.lower()}_{SHARD_INDEX}.txt')
+        try:
+            with open(path, 'w', encoding='utf-8') as file:
+                file.write('\n'.join(self.report()) + '\n')
+            self.logger.info(self.sign + f'отчёт профилирования записан: {path}')
+        except OSError as exc:
+            self.logger.warning(self.sign + f'ERROR записи отчёта профилирования: {exc=}')
+
+    def report(self) -> list[str]:
+        """ Отчёт: время этапов по методам, блокировки цикла событий и места где цикл был заблокирован """
+        elapsed = time.perf_counter() - self.started
+        lines = [f'Профилирование {self.worker_name} | время работы: {elapsed:.2f} сек.', '',
+                 f'{"span":<45} | {"calls":>8} | {"total, s":>9} | {"% time":>6} | {"mean, ms":>9} | '
+                 f'{"p95, ms":>9} | {"max, ms":>9}']
+        for span, values in sorted(self.durations.items(), key=lambda item: -sum(item[1])):
+            if not values:
+                continue
+            total = sum(values)
+            p95 = sorted(values)[min(len(values) - 1, int(len(values) * 0.95))]
+            lines.append(f'{span:<45} | {len(values):>8} | {total:>9.3f} | {total / elapsed * 100:>6.1f} | '
+                         f'{total / len(values) * 1000:>9.2f} | {p95 * 1000:>9.2f} | {max(values) * 1000:>9.2f}')
+
+        lines += ['', f'Блокировки цикла событий дольше {LOOP_LAG_THRESHOLD} сек.: {self.stalls} | '
+                      f'всего: {self.stalled_time:.2f} сек. ({self.stalled_time / elapsed * 100:.1f}%) | '
+                      f'максимум: {self.max_stall:.2f} сек.']
+        if self.stall_samples:
+            lines.append(f'Места блокировок (выборка стека каждые {LOOP_LAG_SAMPLE_INTERVAL} сек. блокировки):')
+        for stack, samples in self.stall_samples.most_common(20):
+            lines.append(f'\n~{samples * LOOP_LAG_SAMPLE_INTERVAL:.2f} сек. ({samples} выборок):')
+            lines.extend(f'    {frame}' for frame in stack)
+        return lines
@@ -4,24 +4,40 @@ import time
 import aiohttp
 from aiohttp_proxy import ProxyConnector, ProxyType
 
-from config import CONFIG_PROXY
+from config import CONFIG_PROXY, PROXY_CHECK_INTERVAL, PROXY_CHECK_TIMEOUT, PROXY_WAIT_TIMEOUT, PROXY_IDLE_TIMEOUT, \
+    PROXY_REQUIRE_IP_CHANGE
 from managers.base import BaseSingletonClass
 
 
 class ProxyManager(BaseSingletonClass):
-    """ Класс для выбора и проверки работоспособности прокси """
+    """ Класс для выбора и проверки работоспособности прокси.
+        Прокси из config проверяет фоновая задача, клиенту сессии сразу выдаётся результат последней проверки,
+        прокси из данных сессий не проверяются """
+    check_url = 'https://check-host.net/ip'
+
+    def __init__(self):
+        super().__init__()
+        # используемые прокси: {(addr, port): {'proxy': dict, 'require_change': bool, 'used': float}}
+        self.proxies = {}
+        # результат последней проверки: {(addr, port): {'ok', 'ip', 'latency', 'checked', 'change_time'}}
+        self.health = {}
+        self.last_served_ip = {}
+        self.sessions = {}
+        self.monitor_task = None
+        self.probe_requested = None
+        self.updated = None
 
     async def __call__(self, session_data: dict) -> dict | bool:
         proxy = await self.get_proxy(session_data)
         return proxy
 
-    async def get_proxy(self, session_data):
-        """ Возвращает прокси из config если указан или из данных сессии """
-        proxy = CONFIG_PROXY
-        data = {'last_ip': None, 'change_time': None}
-        if not proxy:
+    async def get_proxy(self, session_data: dict) -> dict | bool:
+        """ Возвращает прокси из config если указан, иначе прокси из данных сессии без проверки.
+        Если по последней проверке прокси из config недоступен или ещё не сменил ip, ожидает не дольше
+        PROXY_WAIT_TIMEOUT сек., возвращает False если прокси так и не стал доступен """
+        if not CONFIG_PROXY:
             sd_proxy = session_data.get('proxy')
-            proxy = {
+            return {
                 'proxy_type': ProxyType.SOCKS5,
                 'addr': sd_proxy[1],
                 'port': sd_proxy[2],
@@ -29,44 +45,129 @@ class ProxyManager(BaseSingletonClass):
                 'username': sd_proxy[4],
                 'password': sd_proxy[5],
             }
-        else:
-            check = 'start'
-            while check != 'stop':
-                response = (await self.failed_check_proxi(proxy)).get('response')
-                if not str(response).replace('.', '').isdigit():
-                    self.logger.warning(self.sign + f'{response=}')
-                    continue
-                if data.get('last_ip') and response != data.get('last_ip'):
-                    data['last_ip'] = response
-                    data['change_time'] = int(time.time())
-                    check = 'stop'
-                else:
-                    data['last_ip'] = response
-                    await asyncio.sleep(5)
-                msg = self.sign + f'ip: {response} | tm: {data.get("change_time")}'
-                self.logger.debug(msg) if check != 'stop' else self.logger.info(msg)
+
+        proxy, require_change = CONFIG_PROXY, PROXY_REQUIRE_IP_CHANGE
+        key = (proxy.get('addr'), proxy.get('port'))
+        self.register(key=key, proxy=proxy, require_change=require_change)
+        state = await self.wait_for_ready(key=key, require_change=require_change)
+
+        if state and not state['ok']:
+            self.logger.warning(self.sign + f'прокси {key} недоступен | {state=}')
+            return False
+        if state and require_change and state['ip'] == self.last_served_ip.get(key):
+            self.logger.warning(self.sign + f'ip прокси {key} не сменился за {PROXY_WAIT_TIMEOUT} сек. | {state=}')
+        if state:
+            self.last_served_ip[key] = state['ip']
+            self.logger.info(self.sign + f'ip: {state["ip"]} | tm: {state["change_time"]} | '
+                                         f'latency: {state["latency"]:.2f} сек.')
         return proxy
 
-    async def failed_check_proxi(self, proxy):
-        """ Проверяет доступ к прокси """
-        url = 'https://check-host.net/ip'
-        connector = ProxyConnector(
-            # proxy_type=proxy.get('proxy_type'),
-            proxy_type=ProxyType.SOCKS5,
-            host=proxy.get('addr'),
-            port=proxy.get('port'),
-            username=proxy.get('username'),
-            password=proxy.get('password'),
-        )
-
-        async with aiohttp.ClientSession(connector=connector) as session:
+    def register(self, key: tuple, proxy: dict, require_change: bool) -> None:
+        """ Добавляет прокси в список проверяемых и запускает фоновую проверку """
+        if key not in self.proxies:
+            self.proxies[key] = {'proxy': proxy, 'require_change': require_change}
+        self.proxies[key]['used'] = time.monotonic()
+        self.start_monitor()
+        if key not in self.health:
+            self.probe_requested.set()
+
+    def is_ready(self, key: tuple, require_change: bool) -> bool:
+        """ Прокси доступен и, если требуется, сменил ip после прошлой выдачи """
+        state = self.health.get(key)
+        return bool(state and state['ok'] and (not require_change or state['ip'] != self.last_served_ip.get(key)))
+
+    async def wait_for_ready(self, key: tuple, require_change: bool) -> dict | None:
+        """ Ожидает результатов очередных проверок не дольше PROXY_WAIT_TIMEOUT сек. пока прокси не будет готов,
+        возвращает последний результат проверки или None если прокси ещё не проверялся """
+        deadline = time.monotonic() + PROXY_WAIT_TIMEOUT
+        while not self.is_ready(key, require_change) and (remaining := deadline - time.monotonic()) > 0:
             try:
-                async with session.get(url, ssl=False, timeout=10) as response:
-                    if response.content_type in ['text/html', 'text/plain']:
-                        result = {'response': await response.text()}
-                    else:
-                        result = {'response': str(await response.json())}
-            except Exception as exc:
-                result = {'response': str(exc)}
-        return result
+                await asyncio.wait_for(self.updated.wait(), remaining)
+            except asyncio.TimeoutError:
+                break
+        return self.health.get(key)
+
+    def start_monitor(self) -> None:
+        """ Запускает фоновую проверку прокси если она ещё не запущена """
+        if not self.monitor_task or self.monitor_task.done():
+            self.probe_requested = asyncio.Event()
+            self.updated = asyncio.Event()
+            self.monitor_task = asyncio.create_task(self.monitor())
+
+    async def monitor(self) -> None:
+        """ Фоновая задача: проверяет используемые прокси каждые PROXY_CHECK_INTERVAL сек. или сразу после
+        добавления нового прокси, прокси не используемые PROXY_IDLE_TIMEOUT сек. перестают проверяться """
+        while True:
+            now = time.monotonic()
+            for key in [key for key, entry in self.proxies.items() if now - entry['used'] > PROXY_IDLE_TIMEOUT]:
+                await self.forget(key)
+
+            self.probe_requested.clear()
+            await asyncio.gather(*(self.probe(key) for key in list(self.proxies)))
+            updated, self.updated = self.updated, asyncio.Event()
+            updated.set()
+
+            try:
+                await asyncio.wait_for(self.probe_requested.wait(), PROXY_CHECK_INTERVAL)
+            except asyncio.TimeoutError:
+                pass
+
+    def get_session(self, key: tuple) -> aiohttp.ClientSession:
+        """ Возвращает постоянную http сессию для проверок через прокси, для прокси с динамическим ip
+        соединение не переиспользуется, чтобы каждая проверка видела текущий ip выхода """
+        if not (session := self.sessions.get(key)) or session.closed:
+            entry = self.proxies[key]
+            connector = ProxyConnector(
+                # proxy_type=proxy.get('proxy_type'),
+                proxy_type=ProxyType.SOCKS5,
+                host=entry['proxy'].get('addr'),
+                port=entry['proxy'].get('port'),
+                username=entry['proxy'].get('username'),
+                password=entry['proxy'].get('password'),
+                force_close=entry['require_change'],
+            )
+            session = self.sessions[key] = aiohttp.ClientSession(connector=connector)
+        return session
+
+    async def probe(self, key: tuple) -> None:
+        """ Проверяет доступ к прокси, сохраняет ip выхода и время ответа """
+        started = time.monotonic()
+        try:
+            timeout = aiohttp.ClientTimeout(total=PROXY_CHECK_TIMEOUT)
+            async with self.get_session(key).get(self.check_url, ssl=False, timeout=timeout) as response:
+                response = (await response.text()).strip()
+            ok = response.replace('.', '').isdigit()
+        except Exception as exc:
+            response, ok = str(exc), False
+
+        previous = self.health.get(key, {})
+        state = {
+            'ok': ok,
+            'ip': response if ok else previous.get('ip'),
+            'latency': time.monotonic() - started,
+            'checked': int(time.time()),
+            'change_time': previous.get('change_time'),
+        }
+        if ok and previous.get('ip') and previous['ip'] != response:
+            state['change_time'] = int(time.time())
+        self.health[key] = state
+
+        msg = self.sign + f'{key} | {response=} | {state=}'
+        self.logger.debug(msg) if ok else self.logger.warning(msg)
+
+    async def forget(self, key: tuple) -> None:
+        """ Перестаёт проверять прокси и закрывает его http сессию """
+        self.proxies.pop(key, None)
+        self.health.pop(key, None)
+        self.last_served_ip.pop(key, None)
+        if session := self.sessions.pop(key, None):
+            await session.close()
 
+    async def stop(self) -> None:
+        """ Останавливает фоновую проверку и закрывает http сессии """
+        if self.monitor_task:
+            self.monitor_task.cancel()
+            self.monitor_task = None
+        for session in self.sessions.values():
+            await session.close()
+        self.sessions.clear()
@@ -1,13 +1,17 @@
 import asyncio
 import json
+import math
 import os
 import shutil
+import socket
 import time
-from random import choice
+import uuid
 from typing import Any
 
-from config import WORK_SESSIONS_DIR, GOOD_SESSIONS_AFTER_CHECKER_DIR, BAD_SESSIONS_DIR, SESSION_IN_WORK_FILE_PATH
-from managers.base import BaseSingletonClass
+from config import WORK_SESSIONS_DIR, GOOD_SESSIONS_AFTER_CHECKER_DIR, BAD_SESSIONS_DIR, SESSION_LEASE_TTL, \
+    MAX_CONTACTS, SESSIONS_REFRESH_INTERVAL, SHARD_INDEX, SHARD_COUNT
+from managers.base import BaseSingletonClass, in_shard
+from managers.session_scheduler import SessionScheduler
 
 
 class SessionFilesManager(BaseSingletonClass):
@@ -18,45 +22,57 @@ class SessionFilesManager(BaseSingletonClass):
     good_sessions_after_checker_dir = GOOD_SESSIONS_AFTER_CHECKER_DIR
     bad_sessions_dir = BAD_SESSIONS_DIR
 
-    def __init__(self):
-        super().__init__()
-        self.rewrite_session_in_work_file()
+    # реестр данных json файлов сессий: {session_name: {'stat': (st_mtime_ns, st_size), 'data': dict}},
+    # файл перечитывается только при изменении mtime или размера, список сессий - при изменении mtime каталога
+    registry = {}
+    registry_dir_mtime = None
+    registry_refresh_time = 0
 
-    @staticmethod
-    def rewrite_session_in_work_file():
-        """ Создаёт или перезаписывает данные в файле с информацией о сессиях в работе """
-        with open(f'{SESSION_IN_WORK_FILE_PATH}', 'w', encoding='utf-8') as file:
-            json.dump([], file, ensure_ascii=False)
+    # очереди сессий по времени доступности отдельно для проверки номеров и для рассылки,
+    # выданные в работу сессии находятся в taken_sessions и возвращаются в очереди через release_session
+    schedulers = {False: SessionScheduler(), True: SessionScheduler()}
+    taken_sessions = set()
+    schedule_changed = asyncio.Event()
+
+    # аренда сессий в БД: владелец - текущий процесс, аренда продлевается фоновой задачей,
+    # аренда упавшего процесса истекает через SESSION_LEASE_TTL сек. и сессию может взять другой процесс
+    db_manager = None
+    lease_owner = f'{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}'
+    leased_sessions = set()
+    lease_heartbeat_task = None
+
+    def __init__(self, **kwargs):
+        super().__init__()
+        if db_manager := kwargs.get('db_manager'):
+            self.__class__.db_manager = db_manager
 
     @classmethod
     async def session_in_work_status(cls, session_name: str | None = None,
                                      action: str = 'check', step: int = 1) -> str:
-        """ Проверяет не используется ли сессия в данный момент """
-        rewrite = True
+        """ Проверяет не используется ли сессия в данный момент (check), берёт сессию в аренду (start)
+        или освобождает её (stop), start возвращает in_work если сессию уже арендовал другой процесс """
         try:
-
-            with open(f'{SESSION_IN_WORK_FILE_PATH}', 'r', encoding='utf-8') as file:
-                data: list = json.load(file)
-
             if action == 'stop':
-                data.remove(session_name)
+                await cls.release_session(session_name)
+                cls.leased_sessions.discard(session_name)
+                await cls.db_manager.release_session_lease(session_name=session_name, owner=cls.lease_owner)
                 result = 'stop'
 
             elif action == 'start':
-                data.append(session_name)
-                result = 'start'
+                if await cls.db_manager.acquire_session_lease(
+                        session_name=session_name, owner=cls.lease_owner, ttl=SESSION_LEASE_TTL):
+                    cls.leased_sessions.add(session_name)
+                    cls.start_lease_heartbeat()
+                    result = 'start'
+                else:
+                    result = 'in_work'
 
             else:
-                rewrite = False
-                if session_name in data:
+                if await cls.db_manager.check_session_lease(session_name=session_name, owner=cls.lease_owner):
                     result = 'in_work'
                 else:
                     result = 'free'
 
-            if rewrite:
-                with open(f'{SESSION_IN_WORK_FILE_PATH}', 'w', encoding='utf-8') as file:
-                    json.dump(data, file, ensure_ascii=False)
-
         except BaseException as exc:
             cls.logger.error(cls.sign + f'сессия: {session_name} | {action=} | {exc=}')
             if step <= 3:
@@ -67,6 +83,37 @@ class SessionFilesManager(BaseSingletonClass):
         cls.logger.debug(cls.sign + f'сессия: {session_name} | {action=} | {step=} | {result=}')
         return result
 
+    @classmethod
+    def start_lease_heartbeat(cls) -> None:
+        """ Запускает фоновое продление аренды сессий процесса """
+        if not cls.lease_heartbeat_task or cls.lease_heartbeat_task.done():
+            cls.lease_heartbeat_task = asyncio.create_task(cls.lease_heartbeat())
+
+    @classmethod
+    async def lease_heartbeat(cls) -> None:
+        """ Продлевает аренду сессий процесса каждую треть SESSION_LEASE_TTL """
+        while True:
+            await asyncio.sleep(SESSION_LEASE_TTL / 3)
+            if not cls.leased_sessions:
+                continue
+            try:
+                renewed = await cls.db_manager.renew_session_leases(owner=cls.lease_owner, ttl=SESSION_LEASE_TTL)
+                if renewed < len(cls.leased_sessions):
+                    cls.logger.warning(cls.sign + f'продлено аренд: {renewed} из {len(cls.leased_sessions)}, '
+                                                  f'часть аренд истекла до продления')
+            except Exception as exc:
+                cls.logger.error(cls.sign + f'ERROR продления аренды сессий: {exc=}')
+
+    @classmethod
+    async def release_all_sessions(cls) -> None:
+        """ Останавливает продление аренды и освобождает все сессии арендованные процессом """
+        if cls.lease_heartbeat_task:
+            cls.lease_heartbeat_task.cancel()
+            cls.lease_heartbeat_task = None
+        if cls.leased_sessions:
+            await cls.db_manager.release_session_lease(session_name=None, owner=cls.lease_owner)
+            cls.leased_sessions.clear()
+
     @classmethod
     async def get_paths_session_files(cls, session_name: str) -> tuple[str, str]:
         """ Возвращает абсолютные пути к файлам сессии """
@@ -79,9 +126,11 @@ class SessionFilesManager(BaseSingletonClass):
         """ Возвращает список сессий из рабочей директории """
         inp = 'start'
         while inp.lower() != 'exit':
-            if os.listdir(cls.work_sessions_dir):
-                for data in os.walk(cls.work_sessions_dir):
-                    return list(set(map(lambda f_name: f_name.split('.')[0], data[2])))
+            if sessions := await cls.refresh_registry():
+                return sessions
+            elif SHARD_COUNT > 1:
+                cls.logger.warning(cls.sign + f'Файлы сессий процесса {SHARD_INDEX + 1}/{SHARD_COUNT} не найдены')
+                break
             else:
                 await asyncio.sleep(2)
                 inp = input('\nФайлы сессий не найдены, добавьте сессии и нажмите Enter для продолжения\n'
@@ -89,19 +138,129 @@ class SessionFilesManager(BaseSingletonClass):
         return []
 
     @classmethod
-    async def get_session_name(cls, mailing: bool = False) -> str:
-        """ Возвращает имя сессии """
-        result = None
-        if sessions := await cls.get_sessions():
-            if casfq := await cls.check_all_sessions_for_quarantine(sessions):
-                cls.logger.warning(cls.sign + f'Все сессии в карантине ожидание: {casfq} сек.')
-                await asyncio.sleep(casfq)
-            if mailing:
-                if casfss := await cls.check_all_sessions_for_stop_sending(sessions):
-                    cls.logger.warning(cls.sign + f'Все сессии в stop_sending ожидание: {casfss} сек.')
-                    await asyncio.sleep(casfss)
-            result = choice(sessions)
-        return result
+    async def refresh_registry(cls) -> list:
+        """ Синхронизирует реестр с рабочей директорией: при изменении каталога добавляет и удаляет сессии,
+        не чаще раза в SESSIONS_REFRESH_INTERVAL сек. перечитывает изменившиеся json файлы,
+        возвращает список сессий """
+        dir_mtime = os.stat(cls.work_sessions_dir).st_mtime_ns
+        dir_changed = dir_mtime != cls.registry_dir_mtime
+        if dir_changed:
+            names = {f_name.rsplit('.', 1)[0] for f_name in os.listdir(cls.work_sessions_dir)
+                     if f_name.endswith('.json') and in_shard(f_name.rsplit('.', 1)[0])}
+            for session_name in set(cls.registry) - names:
+                cls.drop_session_entry(session_name)
+            for session_name in names - set(cls.registry):
+                cls.registry[session_name] = {'stat': None, 'data': {}}
+            cls.registry_dir_mtime = dir_mtime
+
+        if dir_changed or time.monotonic() - cls.registry_refresh_time >= SESSIONS_REFRESH_INTERVAL:
+            for session_name in list(cls.registry):
+                try:
+                    cls.load_session_entry(session_name)
+                except FileNotFoundError:
+                    cls.drop_session_entry(session_name)
+                except ValueError as exc:
+                    cls.logger.warning(cls.sign + f'сессия: {session_name} | ERROR чтения json файла: {exc=}')
+            cls.registry_refresh_time = time.monotonic()
+        return list(cls.registry)
+
+    @classmethod
+    def load_session_entry(cls, session_name: str) -> dict:
+        """ Возвращает данные сессии из реестра, перечитывая json файл если он изменился с прошлого чтения """
+        json_file = os.path.join(cls.work_sessions_dir, f'{session_name}.json')
+        file_stat = os.stat(json_file)
+        stat = (file_stat.st_mtime_ns, file_stat.st_size)
+
+        entry = cls.registry.get(session_name)
+        if not entry or entry['stat'] != stat:
+            with open(json_file, 'r', encoding='utf-8') as file:
+                data = json.load(file)
+            cls.store_session_entry(session_name, stat, data)
+            return data
+        return entry['data']
+
+    @classmethod
+    def store_session_entry(cls, session_name: str, stat: tuple[int, int], data: dict) -> None:
+        """ Сохраняет данные сессии в реестре и обновляет её место в очередях, если сессия не в работе """
+        cls.registry[session_name] = {'stat': stat, 'data': data}
+        if session_name not in cls.taken_sessions:
+            cls.schedule_session(session_name)
+
+    @classmethod
+    def drop_session_entry(cls, session_name: str) -> None:
+        """ Удаляет сессию из реестра и очередей """
+        cls.registry.pop(session_name, None)
+        cls.taken_sessions.discard(session_name)
+        for scheduler in cls.schedulers.values():
+            scheduler.remove(session_name)
+
+    @staticmethod
+    def session_available_at(session_data: dict, mailing: bool) -> float:
+        """ Возвращает время с которого сессия доступна: после карантина, для рассылки после stop_sending,
+        для проверки номеров сессия с заполненной телефонной книгой недоступна (math.inf) """
+        available_at = 0
+        if isinstance(quarantine := session_data.get('quarantine_until'), int):
+            available_at = quarantine
+        if mailing:
+            if isinstance(stop_sending := session_data.get('stop_sending'), int):
+                available_at = max(available_at, stop_sending)
+        elif isinstance(phone_book := session_data.get('phone_book'), list) and len(phone_book) >= MAX_CONTACTS:
+            available_at = math.inf
+        return available_at
+
+    @classmethod
+    def count_sessions(cls) -> dict[str, int]:
+        """ Количество сессий в реестре: всего, в работе, в карантине и с ограничением рассылки """
+        now = time.time()
+        counts = {'total': len(cls.registry), 'in_work': len(cls.taken_sessions), 'quarantine': 0, 'stop_sending': 0}
+        for entry in cls.registry.values():
+            for key, state in (('quarantine_until', 'quarantine'), ('stop_sending', 'stop_sending')):
+                if isinstance(until := entry['data'].get(key), int) and until > now:
+                    counts[state] += 1
+        return counts
+
+    @classmethod
+    def schedule_session(cls, session_name: str, not_before: float = 0) -> None:
+        """ Помещает сессию в очереди с временем доступности не раньше not_before """
+        session_data = cls.registry[session_name]['data']
+        for mailing, scheduler in cls.schedulers.items():
+            scheduler.push(session_name, max(cls.session_available_at(session_data, mailing), not_before))
+        cls.schedule_changed.set()
+
+    @classmethod
+    async def release_session(cls, session_name: str, not_before: float = 0) -> None:
+        """ Возвращает выданную в работу сессию в очереди """
+        if session_name in cls.taken_sessions:
+            cls.taken_sessions.discard(session_name)
+            if session_name in cls.registry:
+                cls.schedule_session(session_name, not_before=not_before)
+
+    @classmethod
+    async def get_session_name(cls, mailing: bool = False) -> str | None:
+        """ Возвращает имя сессии, которая раньше других стала доступна для работы, если таких нет -
+        ожидает до освобождения ближайшей сессии """
+        scheduler = cls.schedulers[mailing]
+        while await cls.get_sessions():
+            session_name, wait = scheduler.pop_available(time.time())
+            if session_name:
+                cls.taken_sessions.add(session_name)
+                for other_scheduler in cls.schedulers.values():
+                    other_scheduler.remove(session_name)
+                return session_name
+
+            if wait is None:
+                cls.logger.warning(cls.sign + 'Нет доступных сессий: все сессии в работе '
+                                              'или с заполненной телефонной книгой')
+            else:
+                cls.logger.warning(cls.sign + f'Все сессии ограничены, ожидание: {int(wait)} сек.')
+
+            cls.schedule_changed.clear()
+            try:
+                await asyncio.wait_for(cls.schedule_changed.wait(),
+                                       timeout=min(wait or SESSIONS_REFRESH_INTERVAL, SESSIONS_REFRESH_INTERVAL))
+            except asyncio.TimeoutError:
+                pass
+        return None
 
     @classmethod
     async def check_exists_session(cls, session_name) -> bool:
@@ -113,9 +272,8 @@ class SessionFilesManager(BaseSingletonClass):
 
     @classmethod
     async def get_session_data(cls, session_name) -> dict:
-        """ Возвращает данные из json файла сессии """
-        with open(f'{cls.work_sessions_dir}{os.sep}{session_name}.json', 'r', encoding='utf-8') as file:
-            return json.load(file)
+        """ Возвращает данные json файла сессии из реестра """
+        return cls.load_session_entry(session_name)
 
     @classmethod
     async def get_key_session_json(cls, session_name: str, key: str) -> Any:
@@ -135,12 +293,42 @@ class SessionFilesManager(BaseSingletonClass):
         else:
             data[key] = value
 
-        with open(f'{cls.work_sessions_dir}{os.sep}{session_name}.json', 'w', encoding='utf-8') as file:
-            json.dump(data, file, ensure_ascii=False, indent=4)
+        await cls.write_session_data(session_name, data)
 
         cls.logger.info(cls.sign + f'{session_name=} update: {key=} | {value=}')
         return len(data.get(key)) if key == 'phone_book' else value
 
+    @classmethod
+    async def extend_phone_book(cls, session_name: str, entries: list[dict]) -> int:
+        """ Добавляет записи в телефонную книгу сессии одной записью json файла, данные берутся из реестра
+        без повторного чтения файла, возвращает размер телефонной книги """
+        entry = cls.registry.get(session_name)
+        data = entry['data'] if entry else cls.load_session_entry(session_name)
+        phone_book = data.get('phone_book') if isinstance(data.get('phone_book'), list) else []
+        data['phone_book'] = phone_book + entries
+
+        await cls.write_session_data(session_name, data)
+
+        cls.logger.info(cls.sign + f'{session_name=} update phone_book: +{len(entries)} | {len(data["phone_book"])=}')
+        return len(data['phone_book'])
+
+    @classmethod
+    async def write_session_data(cls, session_name: str, data: dict) -> None:
+        """ Записывает данные в json файл сессии через временный файл, чтобы другие процессы
+        не прочитали файл записанный частично, и обновляет реестр """
+        json_file = os.path.join(cls.work_sessions_dir, f'{session_name}.json')
+        try:
+            with open(f'{json_file}.tmp', 'w', encoding='utf-8') as file:
+                json.dump(data, file, ensure_ascii=False, indent=4)
+            os.replace(f'{json_file}.tmp', json_file)
+        except BaseException:
+            if entry := cls.registry.get(session_name):
+                entry['stat'] = None
+            raise
+
+        file_stat = os.stat(json_file)
+        cls.store_session_entry(session_name, (file_stat.st_mtime_ns, file_stat.st_size), data)
+
     @classmethod
     async def move_session_to_bad_sessions(cls, session_name: str) -> bool:
         """ Перемещает сессию в каталог bad_sessions """
@@ -148,6 +336,7 @@ class SessionFilesManager(BaseSingletonClass):
         to_dir = cls.bad_sessions_dir
 
         if os.path.exists(json_file) and os.path.exists(sql_file):
+            cls.drop_session_entry(session_name)
             shutil.move(json_file, to_dir)
             shutil.move(sql_file, to_dir)
             cls.logger.debug(cls.sign + f'Сессия: {session_name} '
@@ -155,22 +344,6 @@ class SessionFilesManager(BaseSingletonClass):
             return True
         return False
 
-    @classmethod
-    async def check_all_sessions_for_quarantine(cls, sessions):
-        """ Проверяет все сессии на карантин """
-        quarantine = []
-        for session_name in sessions:
-            quarantin_session = (await cls.get_session_data(session_name)).get('quarantine_until')
-            if not quarantin_session:
-                quarantine.append(False)
-            elif quarantin_session and isinstance(quarantin_session, int) and quarantin_session < time.time():
-                quarantine.append(False)
-            else:
-                quarantine.append(quarantin_session)
-        if all(quarantine):
-            return int(min(quarantine) - time.time())
-        return False
-
     @classmethod
     async def check_session_for_quarantine(cls, session_name, session_data) -> bool:
         """ Проверка сессии на карантин """
@@ -185,22 +358,6 @@ class SessionFilesManager(BaseSingletonClass):
                 await cls.update_key_session_json(session_name, key='quarantine_until', value=None)
         return result
 
-    @classmethod
-    async def check_all_sessions_for_stop_sending(cls, sessions):
-        """ Проверяет все сессии на ограничение рассылки """
-        stop_list = []
-        for session_name in sessions:
-            stop_sending = (await cls.get_session_data(session_name)).get('stop_sending')
-            if not stop_sending:
-                stop_list.append(False)
-            elif stop_sending and isinstance(stop_sending, int) and stop_sending < time.time():
-                stop_list.append(False)
-            else:
-                stop_list.append(stop_sending)
-        if all(stop_list):
-            return int(min(stop_list) - time.time())
-        return False
-
     @classmethod
     async def check_session_for_stop_sending(cls, session_name, session_data) -> bool:
         """ Проверка сессии на время между отправкой сообщений """
@@ -0,0 +1,47 @@
+import heapq
+import math
+
+
+class SessionScheduler:
+    """ Очередь сессий с приоритетом по времени, когда сессия станет доступна для работы.
+        Устаревшие записи кучи не удаляются сразу, а пропускаются при извлечении """
+
+    def __init__(self):
+        self.heap = []
+        self.available_at = {}
+
+    def __len__(self) -> int:
+        return len(self.available_at)
+
+    def __contains__(self, session_name: str) -> bool:
+        return session_name in self.available_at
+
+    def push(self, session_name: str, available_at: float) -> None:
+        """ Добавляет сессию или меняет время её доступности, сессия с бесконечным временем убирается из очереди """
+        if math.isinf(available_at):
+            self.remove(session_name)
+            return
+        self.available_at[session_name] = available_at
+        heapq.heappush(self.heap, (available_at, session_name))
+        if len(self.heap) > 2 * len(self.available_at) + 64:
+            self.heap = [(value, name) for name, value in self.available_at.items()]
+            heapq.heapify(self.heap)
+
+    def remove(self, session_name: str) -> None:
+        """ Убирает сессию из очереди """
+        self.available_at.pop(session_name, None)
+
+    def pop_available(self, now: float) -> tuple[str | None, float | None]:
+        """ Извлекает доступную на момент now сессию за O(log n) и возвращает (имя сессии, None),
+        если доступных нет - (None, сек. до освобождения ближайшей) или (None, None) если очередь пуста """
+        while self.heap:
+            available_at, session_name = self.heap[0]
+            if self.available_at.get(session_name) != available_at:
+                heapq.heappop(self.heap)
+                continue
+            if available_at > now:
+                return None, available_at - now
+            heapq.heappop(self.heap)
+            del self.available_at[session_name]
+            return session_name, None
+        return None, None
@@ -1,5 +1,4 @@
 import asyncio
-import signal
 import time
 from datetime import datetime
 
@@ -10,7 +9,7 @@ from telethon.tl.types.contacts import ImportedContacts
 
 from managers.base import BaseTelegramWorkers
 from config import MAX_CONTACTS, DEFAULT_QUARANTINE_TIME, \
-    PHONE_CONTACT_test, SESSION_test, MSG_test
+    PHONE_CONTACT_test, SESSION_test, MSG_test, RPC_TIMEOUT, SEND_TIMEOUT
 
 
 class Tester(BaseTelegramWorkers):
@@ -59,11 +58,14 @@ class Tester(BaseTelegramWorkers):
         if not session_data:
             return
 
+        if await self.session_files.session_in_work_status(session_name=session_name, action='start') != 'start':
+            self.logger.warning(self.sign + f'сессия: {session_name} используется другим процессом')
+            return
+
         try:
             if client := await self.get_tg_client(session_name=session_name, session_data=session_data):
                 self.logger.info(self.sign + f'СТАРТ сессии: {session_name} | '
                                              f'{session_data.get("first_name")} {session_data.get("last_name")}')
-            await self.session_files.session_in_work_status(session_name=session_name, action='start')
             await self.start_tg_client(session_name=session_name, session_data=session_data,
                                        client=client, contacts=contacts, msg_text=msg_text)
 
@@ -71,6 +73,9 @@ class Tester(BaseTelegramWorkers):
             self.logger.error(self.sign + f'Critical ERROR -> {base_exc=}')
 
         await self.session_files.session_in_work_status(session_name=session_name, action='stop')
+        await self.client_pool.close_all()
+        await self.session_files.release_all_sessions()
+        await self.proxy_manager.stop()
 
     async def start_tg_client(self, session_name: str, session_data: dict,
                               client: TelegramClient, contacts: list, msg_text: str | None = None) -> None:
@@ -79,10 +84,7 @@ class Tester(BaseTelegramWorkers):
         phone_book = await self.session_files.get_session_phone_book(session_name, session_data)
         sent = 'did_not_go'
 
-        async with client:
-            signal.alarm(0)
-            await self.check_connect_session(client=client)
-
+        async with self.connected(client):
             if not contact.username:
                 if contact.session_check != session_name:
                     if len(phone_book) >= MAX_CONTACTS:
@@ -124,14 +126,15 @@ class Tester(BaseTelegramWorkers):
         user_id, access_hash = None, None
         try:
             contact = InputPhoneContact(client_id=0, phone=phone, first_name="", last_name="")
-            contacts: ImportedContacts = await client(functions.contacts.ImportContactsRequest([contact]))
+            request = functions.contacts.ImportContactsRequest([contact])
+            contacts: ImportedContacts = await asyncio.wait_for(client(request), RPC_TIMEOUT)
 
             if contacts.to_dict()['imported']:
                 user_id = contacts.to_dict()['users'][0]['id']
                 access_hash = contacts.to_dict()['users'][0]['access_hash']
 
                 try:
-                    await client(functions.contacts.DeleteContactsRequest(id=[user_id]))
+                    await asyncio.wait_for(client(functions.contacts.DeleteContactsRequest(id=[user_id])), RPC_TIMEOUT)
                 except Exception as exc:
                     self.logger.warning(self.sign + f'ERROR при удалении контакта: {exc=}')
 
@@ -146,7 +149,7 @@ class Tester(BaseTelegramWorkers):
         """ Отправляет сообщение по user_id и access_hash """
         try:
             user = InputPeerUser(user_id=user_id, access_hash=access_hash)
-            await client.send_message(user, text, link_preview=False)
+            await asyncio.wait_for(client.send_message(user, text, link_preview=False), SEND_TIMEOUT)
             sent = True
         except Exception as exc:
             cls.logger.warning(f'ERROR: {exc=}')
@@ -157,7 +160,7 @@ class Tester(BaseTelegramWorkers):
     async def sender_from_username(cls, username: str, client: TelegramClient, text: str) -> bool:
         """ Отправляет сообщение по username """
         try:
-            await client.send_message(username, text, link_preview=False)
+            await asyncio.wait_for(client.send_message(username, text, link_preview=False), SEND_TIMEOUT)
             sent = True
         except Exception as exc:
             cls.logger.warning(f'ERROR: {exc=}')
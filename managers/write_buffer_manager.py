@@ -0,0 +1,97 @@
+import asyncio
+import time
+from datetime import datetime
+
+from config import DB_BUFFER_SIZE, DB_BUFFER_FLUSH_INTERVAL
+from managers.base import BaseSingletonClass
+from managers.contact_record import ContactRecord
+
+
+class WriteBufferManager(BaseSingletonClass):
+    """ Класс Singleton для отложенной пакетной записи результатов проверки и рассылки в БД.
+        Записи копятся в памяти и сбрасываются в БД одной транзакцией при заполнении буфера,
+        по истечении DB_BUFFER_FLUSH_INTERVAL и при завершении работы, в строки таблиц контакты преобразуются
+        при записи """
+    # поля записей таблиц contacts и bad_contacts
+    contact_fields = ('phone', 'promo_id', 'var_1', 'var_2', 'var_3', 'date_check', 'session_check', 'user_id',
+                      'username', 'first_name', 'last_name')
+    bad_contact_fields = ('phone', 'promo_id', 'var_1', 'var_2', 'var_3', 'date_check', 'session_check',
+                          'check_result')
+
+    def __init__(self, **kwargs):
+        super().__init__()
+        self.db_manager = kwargs.get('db_manager')
+        self.metrics = kwargs.get('metrics_manager')
+        self.known_phones = kwargs.get('known_phones_manager')
+        self.session_files = kwargs.get('session_files_manager')
+        self.contacts = []
+        self.bad_contacts = []
+        self.sent_contacts = {}
+        self.last_flush = time.monotonic()
+        self.flush_task = None
+
+    def __len__(self) -> int:
+        return len(self.contacts) + len(self.bad_contacts) + len(self.sent_contacts)
+
+    async def add_contact(self, contact: ContactRecord, bad_contact: bool = False) -> None:
+        """ Добавляет в буфер результат проверки номера телефона для таблицы contacts или bad_contacts """
+        contact.date_check = datetime.now()
+        (self.bad_contacts if bad_contact else self.contacts).append(contact)
+        await self.flush_if_needed()
+
+    async def add_sent_contact(self, contact: ContactRecord) -> None:
+        """ Добавляет в буфер контакт изменённый после отправки сообщения """
+        self.sent_contacts[contact.phone] = contact
+        await self.flush_if_needed()
+
+    async def flush_if_needed(self) -> None:
+        """ Сбрасывает буфер при достижении DB_BUFFER_SIZE записей или DB_BUFFER_FLUSH_INTERVAL сек. """
+        if len(self) >= DB_BUFFER_SIZE or time.monotonic() - self.last_flush >= DB_BUFFER_FLUSH_INTERVAL:
+            await self.flush()
+
+    async def flush(self) -> int:
+        """ Записывает все накопленные записи в БД одной транзакцией, при ошибке записи возвращает их в буфер """
+        self.last_flush = time.monotonic()
+        if not len(self):
+            return 0
+
+        contacts, bad_contacts, sent_contacts = self.contacts, self.bad_contacts, self.sent_contacts
+        self.contacts, self.bad_contacts, self.sent_contacts = [], [], {}
+        total = len(contacts) + len(bad_contacts) + len(sent_contacts)
+        started = time.perf_counter()
+        try:
+            await self.db_manager.save_results_many(
+                contacts=[contact.to_row(self.contact_fields) for contact in contacts],
+                bad_contacts=[contact.to_row(self.bad_contact_fields) for contact in bad_contacts],
+                sent_contacts=list(sent_contacts.values()), work_owner=self.session_files.lease_owner)
+        except Exception as exc:
+            self.logger.error(self.sign + f'ERROR записи буфера в БД, {total} записей возвращено в буфер: {exc=}')
+            self.contacts[:0] = contacts
+            self.bad_contacts[:0] = bad_contacts
+            self.sent_contacts = sent_contacts | self.sent_contacts
+            return 0
+        finally:
+            self.metrics.observe('tcs_db_flush_duration_seconds', time.perf_counter() - started)
+        self.metrics.inc('tcs_db_flush_rows_total', total)
+        self.known_phones.add_many(contact.phone for contact in contacts + bad_contacts)
+        return total
+
+    async def periodic_flush(self) -> None:
+        """ Фоновая задача: сбрасывает буфер не реже чем раз в DB_BUFFER_FLUSH_INTERVAL сек. """
+        while True:
+            await asyncio.sleep(DB_BUFFER_FLUSH_INTERVAL)
+            await self.flush_if_needed()
+
+    async def start(self) -> None:
+        """ Запускает фоновую запись буфера """
+        if not self.flush_task or self.flush_task.done():
+            self.last_flush = time.monotonic()
+            self.flush_task = asyncio.create_task(self.periodic_flush())
+
+    async def stop(self) -> None:
+        """ Останавливает фоновую запись и сбрасывает остаток буфера в БД """
+        if self.flush_task:
+            self.flush_task.cancel()
+            self.flush_task = None
+        if written := await self.flush():
+            self.logger.info(self.sign + f'при завершении работы записано в БД: {written} записей')
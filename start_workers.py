@@ -0,0 +1,88 @@
+import argparse
+import asyncio
+import multiprocessing
+import os
+import queue
+
+COUNTERS = ('total_contacts', 'added_contacts', 'sent_messages', 'fallen_sessions')
+
+
+def run_shard(mode: str, shard_index: int, shard_count: int, counters_queue: multiprocessing.Queue,
+              promo_id: str | None = None, send_interval_hours: int | None = None) -> None:
+    """ Процесс-воркер: работает со своей частью сессий и номеров телефонов, по завершении
+    передаёт счётчики в родительский процесс """
+    os.environ['SHARD_INDEX'] = str(shard_index)
+    os.environ['SHARD_COUNT'] = str(shard_count)
+    os.environ['SKIP_MIGRATIONS'] = '1'
+    from loader import checker, mailer
+
+    worker = checker if mode == 'checker' else mailer
+    mailer.promo_id = promo_id
+    mailer.send_interval_hours = send_interval_hours
+    try:
+        asyncio.run(worker())
+    finally:
+        counters_queue.put({counter: getattr(worker, counter) for counter in COUNTERS})
+
+
+def input_mailer_data() -> tuple[str, int]:
+    """ Запрашивает promo_id и интервал рассылки один раз для всех процессов рассыльщика """
+    promo_id = ''
+    while not promo_id:
+        promo_id = input('Введите promo_id: ').strip()
+    input_time = ''
+    while not input_time.isdigit() or not 24 > int(input_time) > 0:
+        input_time = input('Введите кол-во часов между отправкой сообщений из одной сессии (от 1 до 24): ')
+    return promo_id, int(input_time)
+
+
+def collect_counters(processes: list, counters_queue: multiprocessing.Queue) -> tuple[dict, int]:
+    """ Собирает и суммирует счётчики процессов, возвращает суммы и количество отчитавшихся процессов """
+    totals = dict.fromkeys(COUNTERS, 0)
+    received = 0
+    while received < len(processes):
+        try:
+            counters = counters_queue.get(timeout=1)
+        except queue.Empty:
+            if not any(process.is_alive() for process in processes) and counters_queue.empty():
+                break
+            continue
+        received += 1
+        for counter, value in counters.items():
+            totals[counter] += value
+    return totals, received
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Запуск чекера или рассыльщика в нескольких процессах')
+    parser.add_argument('mode', choices=['checker', 'mailer'])
+    parser.add_argument('-p', '--processes', type=int, default=os.cpu_count())
+    args = parser.parse_args()
+
+    promo_id, send_interval_hours = input_mailer_data() if args.mode == 'mailer' else (None, None)
+
+    from config import logger
+    from database.migrations import migrate
+
+    # миграции применяются один раз до запуска процессов, процессы их не запускают
+    migrate()
+    context = multiprocessing.get_context('spawn')
+    counters_queue = context.Queue()
+    processes = [
+        context.Process(target=run_shard, name=f'{args.mode}-{shard_index}',
+                        args=(args.mode, shard_index, args.processes, counters_queue, promo_id, send_interval_hours))
+        for shard_index in range(args.processes)
+    ]
+    for process in processes:
+        process.start()
+    logger.info(f'Запущено процессов {args.mode}: {len(processes)}')
+
+    totals, received = collect_counters(processes, counters_queue)
+    for process in processes:
+        process.join()
+    logger.info(f'Все процессы {args.mode} завершены, отчитались: {received} из {len(processes)} | '
+                + ' | '.join(f'{counter}: {value}' for counter, value in totals.items()))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,59 @@
+""" Общие фикстуры тестов, запускаются из корня проекта: python -m pytest
+
+Тесты выполняются во временной рабочей директории с БД SQLite, директория создаётся до импорта config,
+чтобы БД, логи и working_files тестов не пересекались с рабочими """
+import os
+import sys
+import tempfile
+
+import pytest
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+os.environ['PG_DATABASE'] = ''
+if ROOT_DIR not in sys.path:
+    sys.path.insert(0, ROOT_DIR)
+
+
+def pytest_sessionstart(session):
+    """ Переходит во временную рабочую директорию после разбора аргументов pytest и до импорта тестов """
+    workdir = tempfile.mkdtemp(prefix='tcs_test_')
+    for sub_dir in ('database', 'logs', 'working_files/work_sessions', 'working_files/input_files',
+                    'working_files/bad_sessions', 'working_files/good_sessions_after_checker'):
+        os.makedirs(os.path.join(workdir, sub_dir), exist_ok=True)
+    os.chdir(workdir)
+
+
+@pytest.fixture(scope='session')
+def db_manager():
+    """ DBManager создаётся один раз: каждый вызов DBManager() заново оборачивает методы класса """
+    from database.migrations import migrate
+    from managers.async_db_manager import DBManager
+
+    migrate()
+    return DBManager()
+
+
+@pytest.fixture
+def dbm(db_manager):
+    """ DBManager с применёнными миграциями, после теста таблицы очищаются """
+    from database.db_utils import Tables
+
+    yield db_manager
+    with db_manager.point_db_connection:
+        for table in Tables.all_tables():
+            table.delete().execute()
+
+
+@pytest.fixture
+def csv_file():
+    """ Записывает строки во входной csv файл, после теста файл удаляется """
+    from config import INPUT_CSV_FILE_PATH
+
+    def write(lines: list[str], mode: str = 'w') -> None:
+        with open(INPUT_CSV_FILE_PATH, mode, encoding='utf-8') as file:
+            file.write(''.join(lines))
+
+    yield write
+    if os.path.exists(INPUT_CSV_FILE_PATH):
+        os.remove(INPUT_CSV_FILE_PATH)
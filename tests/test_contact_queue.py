@@ -0,0 +1,90 @@
+import asyncio
+
+import pytest
+
+from managers.contact_queue import ContactQueue, DBWorkQueue
+from managers.contact_record import ContactRecord
+
+PHONES = [79000000001, 79000000002, 79000000003]
+
+
+def contact(phone: int) -> ContactRecord:
+    return ContactRecord(phone=phone, promo_id='promo')
+
+
+def result_row(phone: int) -> dict:
+    return {'phone': phone, 'promo_id': 'promo', 'check_result': 'not found'}
+
+
+@pytest.fixture
+def work_queue_enabled(monkeypatch):
+    monkeypatch.setattr('managers.async_db_manager.DB_WORK_QUEUE', True)
+
+
+def test_contact_queue_order():
+    """ get отдаёт контакты с конца, put_back - следующим, retry - после остальных """
+    async def run() -> list[int]:
+        contacts = ContactQueue([1, 2, 3])
+        first = await contacts.get()
+        await contacts.retry(first)
+        second = await contacts.get()
+        await contacts.put_back(second)
+        return [await contacts.get() for _ in range(4)]
+
+    assert asyncio.run(run()) == [2, 1, 3, None]
+
+
+def test_contact_queue_exhausted_only_after_close():
+    contacts = ContactQueue(closed=False)
+    assert not contacts.exhausted
+    contacts.close()
+    assert contacts.exhausted
+
+
+def test_db_work_queue_exhausted_after_results_saved(dbm, work_queue_enabled):
+    """ Номер становится проверенным при записи результата, пропуске или после повторной выдачи """
+    async def run() -> DBWorkQueue:
+        contacts = DBWorkQueue(db_manager=dbm, owner='owner')
+        await contacts.put_many(contact(phone) for phone in PHONES)
+        contacts.close()
+        taken = [await contacts.get() for _ in PHONES]
+        assert sorted(item.phone for item in taken) == PHONES
+
+        await contacts.skip(taken[0])
+        await contacts.retry(taken[1])
+        await dbm.save_results_many(contacts=[], bad_contacts=[result_row(taken[2].phone)], sent_contacts=[],
+                                    work_owner='owner')
+        retried = await contacts.get()
+        assert retried.phone == taken[1].phone
+        await dbm.save_results_many(contacts=[], bad_contacts=[result_row(retried.phone)], sent_contacts=[],
+                                    work_owner='owner')
+        await contacts.refresh()
+        return contacts
+
+    contacts = asyncio.run(run())
+    assert contacts.exhausted
+    assert asyncio.run(dbm.count_work()) == {'pending': 0, 'claimed': 0}
+
+
+def test_save_results_keeps_claims_of_other_owner(dbm, work_queue_enabled):
+    """ Результат записанный другим владельцем не завершает чужую выдачу номера """
+    async def run() -> dict:
+        contacts = DBWorkQueue(db_manager=dbm, owner='owner')
+        await contacts.put_many([contact(PHONES[0])])
+        await contacts.get()
+        await dbm.save_results_many(contacts=[], bad_contacts=[result_row(PHONES[0])], sent_contacts=[],
+                                    work_owner='other')
+        return await dbm.count_work()
+
+    assert asyncio.run(run()) == {'pending': 0, 'claimed': 1}
+
+
+def test_db_work_queue_release_returns_unsent_items(dbm):
+    async def run() -> dict:
+        contacts = DBWorkQueue(db_manager=dbm, owner='owner')
+        await contacts.put_many(contact(phone) for phone in PHONES)
+        await contacts.get()
+        await contacts.release()
+        return await dbm.count_work()
+
+    assert asyncio.run(run()) == {'pending': 2, 'claimed': 1}
@@ -0,0 +1,66 @@
+import asyncio
+
+import pytest
+
+from managers.checker_manager import Checker
+from managers.contact_queue import ContactQueue
+from managers.csv_manager import CSVManager
+from managers.known_phones_manager import KnownPhonesManager
+
+
+def row(phone: int) -> str:
+    return f'promo,{phone},a,b,c\n'
+
+
+async def read_phones(csv_manager: CSVManager, progress: dict | None = None, chunk_size: int = 2) -> list[int]:
+    return [contact.phone async for chunk in csv_manager.iter_chunks(chunk_size=chunk_size, progress=progress)
+            for contact in chunk]
+
+
+def test_iter_chunks_splits_file_into_chunks(csv_file):
+    csv_file([row(79000000000 + num) for num in range(5)] + ['promo,not_a_phone,a,b,c\n'])
+
+    async def run() -> list[int]:
+        return [len(chunk) async for chunk in CSVManager().iter_chunks(chunk_size=2)]
+
+    assert asyncio.run(run()) == [2, 2, 1]
+
+
+def test_resume_from_partial_last_line(csv_file):
+    """ Не дописанная последняя строка не входит в сохранённую позицию и читается после дозаписи """
+    csv_file([row(79000000001), 'promo,7900000'])
+    csv_manager = CSVManager()
+    asyncio.run(read_phones(csv_manager))
+    progress = csv_manager.get_position()
+    assert progress['offset'] == len(row(79000000001)) and progress['lines'] == 1
+
+    csv_file(['0002,a,b,c\n', row(79000000003)], mode='a')
+    assert asyncio.run(read_phones(CSVManager(), progress)) == [79000000002, 79000000003]
+
+
+def test_resume_rereads_changed_file(csv_file):
+    """ Если начало файла изменилось, файл читается полностью """
+    csv_file([row(79000000001), row(79000000002)])
+    csv_manager = CSVManager()
+    asyncio.run(read_phones(csv_manager))
+    progress = csv_manager.get_position()
+
+    csv_file([row(79000000005), row(79000000002), row(79000000003)])
+    assert asyncio.run(read_phones(CSVManager(), progress)) == [79000000005, 79000000002, 79000000003]
+
+
+@pytest.mark.parametrize('indexed', [True, False])
+def test_ingest_skips_phones_repeated_across_chunks(csv_file, dbm, monkeypatch, indexed):
+    """ Номер повторяющийся в разных пачках файла попадает в очередь один раз """
+    monkeypatch.setattr('managers.known_phones_manager.KNOWN_PHONES_INDEX', indexed)
+    monkeypatch.setattr(CSVManager.iter_chunks, '__defaults__', (2, None))
+    csv_file([row(phone) for phone in (79000000001, 79000000002, 79000000001, 79000000003, 79000000002)])
+    known_phones = KnownPhonesManager(db_manager=dbm)
+    checker = Checker(db_manager=dbm, csv_manager=CSVManager(), known_phones_manager=known_phones)
+    contacts = ContactQueue(closed=False)
+    try:
+        assert asyncio.run(checker.ingest_contacts(contacts=contacts))
+    finally:
+        known_phones.close()
+
+    assert sorted(contact.phone for contact in contacts.items) == [79000000001, 79000000002, 79000000003]
@@ -0,0 +1,65 @@
+import asyncio
+import os
+from datetime import datetime
+
+import pytest
+
+from config import KNOWN_PHONES_SNAPSHOT_PATH
+from managers.contact_record import ContactRecord
+from managers.known_phones_manager import KnownPhonesManager
+
+SAVED = [79000000001, 79000000003]
+BAD = [79000000002]
+
+
+@pytest.fixture
+def known_phones(dbm, monkeypatch):
+    monkeypatch.setattr('managers.known_phones_manager.KNOWN_PHONES_INDEX', True)
+    rows = [{'phone': phone, 'promo_id': 'promo', 'date_check': datetime.now()} for phone in SAVED]
+    bad_rows = [{'phone': phone, 'promo_id': 'promo', 'date_check': datetime.now()} for phone in BAD]
+    asyncio.run(dbm.save_results_many(contacts=rows, bad_contacts=bad_rows, sent_contacts=[]))
+    if os.path.exists(KNOWN_PHONES_SNAPSHOT_PATH):
+        os.remove(KNOWN_PHONES_SNAPSHOT_PATH)
+    manager = KnownPhonesManager(db_manager=dbm)
+    yield manager
+    manager.close()
+
+
+def contacts(*phones) -> list[ContactRecord]:
+    return [ContactRecord(phone=phone) for phone in phones]
+
+
+def test_load_builds_snapshot_from_db(known_phones):
+    assert asyncio.run(known_phones.load())
+    assert os.path.exists(KNOWN_PHONES_SNAPSHOT_PATH)
+    assert [list(view) for view in known_phones.views] == [SAVED, BAD]
+    assert all(phone in known_phones for phone in SAVED + BAD)
+    assert 79000000004 not in known_phones
+
+
+def test_filter_new_drops_known_repeated_and_invalid(known_phones):
+    asyncio.run(known_phones.load())
+    chunk = contacts(79000000001, 79000000004, 79000000002, 79000000004, 'not_a_phone', 79000000005)
+    assert [contact.phone for contact in known_phones.filter_new(chunk)] == [79000000004, 79000000005]
+
+
+def test_add_many_only_after_load(known_phones):
+    known_phones.add_many([79000000004])
+    assert 79000000004 not in known_phones
+
+    asyncio.run(known_phones.load())
+    known_phones.add_many([79000000004])
+    assert 79000000004 in known_phones
+    assert known_phones.filter_new(contacts(79000000004)) == []
+
+
+def test_snapshot_reopened_with_phones_checked_after_it(known_phones, dbm):
+    """ Номера записанные после создания снимка дочитываются из БД при следующей загрузке """
+    asyncio.run(known_phones.load())
+    known_phones.close()
+    rows = [{'phone': 79000000009, 'promo_id': 'promo', 'date_check': datetime.now()}]
+    asyncio.run(dbm.save_results_many(contacts=rows, bad_contacts=[], sent_contacts=[]))
+
+    assert asyncio.run(known_phones.load())
+    assert 79000000009 in known_phones.delta
+    assert all(phone in known_phones for phone in SAVED + BAD)
@@ -0,0 +1,59 @@
+import asyncio
+
+import pytest
+from telethon.errors import FloodWaitError
+
+from managers.base import current_session
+from managers.metrics_manager import MetricsManager
+
+
+@pytest.fixture
+def metrics():
+    current_session.set('session')
+    return MetricsManager()
+
+
+def requests_total(metrics: MetricsManager, result: str) -> float:
+    return metrics.counters[('tcs_session_requests_total', metrics.labels(session='session', result=result))]
+
+
+def observed(metrics: MetricsManager) -> int:
+    histogram = metrics.histograms.get(('tcs_rpc_duration_seconds', metrics.labels(method='import_contacts')))
+    return histogram[-1] if histogram else 0
+
+
+def test_track_rpc_success(metrics):
+    with metrics.track_rpc('import_contacts'):
+        pass
+
+    assert requests_total(metrics, 'success') == 1
+    assert observed(metrics) == 1
+
+
+@pytest.mark.parametrize('exc, result', [(FloodWaitError(request=None, capture=10), 'flood_wait'),
+                                         (ConnectionError(), 'error')])
+def test_track_rpc_errors_are_reraised(metrics, exc, result):
+    with pytest.raises(type(exc)):
+        with metrics.track_rpc('import_contacts'):
+            raise exc
+
+    assert requests_total(metrics, result) == 1
+    assert observed(metrics) == 1
+
+
+def test_track_rpc_cancelled_request_not_observed(metrics):
+    """ Время отменённого запроса не попадает в гистограмму """
+    async def request() -> None:
+        with metrics.track_rpc('import_contacts'):
+            await asyncio.sleep(10)
+
+    async def run() -> None:
+        task = asyncio.create_task(request())
+        await asyncio.sleep(0)
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+
+    asyncio.run(run())
+    assert requests_total(metrics, 'cancelled') == 1
+    assert observed(metrics) == 0
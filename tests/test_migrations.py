@@ -0,0 +1,29 @@
+from database.db_utils import db, Tables
+from database.migrations import migrate, SchemaVersion, MIGRATIONS, MAINTENANCE_MIGRATIONS
+
+
+def applied_versions() -> set[int]:
+    with db.connection_context():
+        return {row.version for row in SchemaVersion.select(SchemaVersion.version)}
+
+
+def test_migrate_applies_all_migrations_once(db_manager):
+    assert applied_versions() == {version for version, _, _ in MIGRATIONS}
+    assert migrate() == 0
+    with db.connection_context():
+        assert set(db.get_tables()) >= {model._meta.table_name for model in Tables.all_tables()}
+
+
+def test_maintenance_migrations_are_not_applied_automatically(db_manager):
+    assert not applied_versions() & {version for version, _, _ in MAINTENANCE_MIGRATIONS}
+
+
+def test_session_leases_created_by_own_migration(db_manager):
+    """ БД без таблицы аренды сессий и версии 6 получает таблицу при следующем migrate() """
+    with db.connection_context():
+        db.drop_tables([Tables.session_leases])
+        SchemaVersion.delete().where(SchemaVersion.version == 6).execute()
+
+    assert migrate() == 1
+    with db.connection_context():
+        assert Tables.session_leases.table_exists()
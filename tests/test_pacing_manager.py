@@ -0,0 +1,43 @@
+import pytest
+from telethon.errors import FloodWaitError, PeerFloodError
+
+from config import PACING_FLOOD_MARGIN, PEER_FLOOD_QUARANTINE_TIME, PACING_ERROR_QUARANTINE, DEFAULT_QUARANTINE_TIME
+from managers.pacing_manager import PacingManager
+
+
+@pytest.fixture
+def pacing():
+    return PacingManager()
+
+
+def test_flood_wait_quarantine_from_error(pacing):
+    exc = FloodWaitError(request=None, capture=120)
+    assert pacing.on_error('session', exc) == 120 + PACING_FLOOD_MARGIN
+    assert pacing.is_flooded('session')
+    assert pacing.quarantine_time('session') == 120 + PACING_FLOOD_MARGIN
+
+
+def test_peer_flood_quarantine(pacing):
+    assert pacing.on_error('session', PeerFloodError(request=None)) == PEER_FLOOD_QUARANTINE_TIME
+    assert pacing.is_flooded('session')
+
+
+def test_import_limit_quarantine_as_peer_flood(pacing):
+    """ Лимит импорта контактов сообщается без исключения и времени ожидания """
+    assert pacing.on_error('session', flood=True) == PEER_FLOOD_QUARANTINE_TIME
+    assert pacing.is_flooded('session')
+
+
+def test_other_errors_quarantine_doubles_until_default(pacing):
+    quarantines = [pacing.on_error('session', ConnectionError()) for _ in range(10)]
+    assert quarantines[:2] == [PACING_ERROR_QUARANTINE, PACING_ERROR_QUARANTINE * 2]
+    assert quarantines[-1] == DEFAULT_QUARANTINE_TIME
+    assert not pacing.is_flooded('session')
+
+
+def test_success_resets_errors_and_flood(pacing):
+    pacing.on_error('session', flood=True)
+    pacing.on_error('session')
+    pacing.on_success('session')
+    assert not pacing.is_flooded('session')
+    assert pacing.on_error('session') == PACING_ERROR_QUARANTINE
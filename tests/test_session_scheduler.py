@@ -0,0 +1,47 @@
+import math
+
+from managers.session_scheduler import SessionScheduler
+
+
+def test_pop_available_in_order_of_availability():
+    scheduler = SessionScheduler()
+    scheduler.push('late', 30)
+    scheduler.push('early', 10)
+    scheduler.push('middle', 20)
+
+    assert scheduler.pop_available(now=25) == ('early', None)
+    assert scheduler.pop_available(now=25) == ('middle', None)
+    assert scheduler.pop_available(now=25) == (None, 5)
+    assert scheduler.pop_available(now=30) == ('late', None)
+    assert scheduler.pop_available(now=30) == (None, None)
+
+
+def test_push_moves_session_and_skips_stale_entries():
+    scheduler = SessionScheduler()
+    scheduler.push('session', 10)
+    scheduler.push('session', 50)
+
+    assert len(scheduler) == 1
+    assert scheduler.pop_available(now=20) == (None, 30)
+    assert scheduler.pop_available(now=50) == ('session', None)
+    assert 'session' not in scheduler
+
+
+def test_infinite_time_and_remove_drop_session():
+    scheduler = SessionScheduler()
+    scheduler.push('stopped', 10)
+    scheduler.push('stopped', math.inf)
+    scheduler.push('removed', 10)
+    scheduler.remove('removed')
+
+    assert len(scheduler) == 0
+    assert scheduler.pop_available(now=100) == (None, None)
+
+
+def test_heap_is_compacted_after_many_updates():
+    scheduler = SessionScheduler()
+    for num in range(1000):
+        scheduler.push('session', num)
+
+    assert len(scheduler.heap) <= 2 * len(scheduler) + 64
+    assert scheduler.pop_available(now=999) == ('session', None)